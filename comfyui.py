@@ -12,6 +12,21 @@ import shutil
 from cog import Path
 from urllib.error import URLError
 
+from tracing import tracer
+
+# Loader nodes and the input naming the model file they load
+MODEL_LOADER_INPUTS = {
+    "CheckpointLoaderSimple": "ckpt_name",
+    "LoraLoader": "lora_name",
+    "VAELoader": "vae_name",
+    "UpscaleModelLoader": "model_name",
+    "ACN_ControlNet++LoaderAdvanced": "name",
+    "DownloadAndLoadDepthAnythingV2Model": "model",
+}
+
+# Output nodes writing files under their filename_prefix
+SAVE_NODES = ["SaveImage", "SaveDepthRaw"]
+
 class Node:
     def __init__(self, node):
         self.node = node
@@ -38,20 +53,125 @@ class Node:
         if self.is_type_in(unsupported_nodes):
             raise ValueError(f"{self.type()} node is not supported: {unsupported_nodes[self.type()]}")
 
+class PromptTimeoutError(TimeoutError):
+    """
+    A prompt ran past its deadline and was cancelled. prompt_id is None when
+    the deadline passed before the prompt was queued.
+    """
+
+    def __init__(self, prompt_id, elapsed, last_node=None, last_class_type=None):
+        self.prompt_id = prompt_id
+        self.elapsed = elapsed
+        self.last_node = last_node
+        self.last_class_type = last_class_type
+        if prompt_id is None:
+            message = f"Request reached its deadline after waiting {elapsed:.1f}s for a ComfyUI server"
+        else:
+            message = (
+                f"Prompt {prompt_id} was cancelled after {elapsed:.1f}s, past its deadline. "
+                f"Last node reached: {last_node} ({last_class_type})"
+            )
+        super().__init__(message)
+
+
+class RequestContext:
+    """
+    Scratch space for a single prediction: its own input and output
+    subfolders on a ComfyUI server, so requests never touch each other's files
+    and can overlap. Files are removed when the context exits, or once the
+    background tasks given to cleanup_after finish.
+    """
+
+    def __init__(self, comfyUI):
+        self.id = uuid.uuid4().hex
+        self.server_address = comfyUI.server_address
+        self.input_directory = os.path.join(comfyUI.input_directory, self.id)
+        self.output_directory = os.path.join(comfyUI.output_directory, self.id)
+        self.client_id = None
+        self.ws = None
+        self.deferred = False
+
+    def __enter__(self):
+        os.makedirs(self.input_directory, exist_ok=True)
+        os.makedirs(self.output_directory, exist_ok=True)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.ws is not None:
+            self.ws.close()
+        if exc_type is not None or not self.deferred:
+            self.cleanup()
+
+    def connect(self):
+        """Open a progress websocket owned by this request"""
+        self.client_id = str(uuid.uuid4())
+        self.ws = websocket.WebSocket()
+        self.ws.connect(f"ws://{self.server_address}/ws?clientId={self.client_id}")
+
+    def prepare_workflow(self, workflow):
+        """
+        Save outputs into this request's subfolder. PreviewImage nodes are
+        dropped since their files in ComfyUI's shared temp directory can't be
+        attributed to a request.
+        """
+        for node_id in list(workflow):
+            node = Node(workflow[node_id])
+            if node.is_type("PreviewImage"):
+                del workflow[node_id]
+            elif node.is_type_in(SAVE_NODES):
+                node.set_input("filename_prefix", f"{self.id}/{node.input('filename_prefix', 'ComfyUI')}")
+        return workflow
+
+    @tracer.traced("cleanup")
+    def cleanup(self):
+        shutil.rmtree(self.input_directory, ignore_errors=True)
+        shutil.rmtree(self.output_directory, ignore_errors=True)
+
+    def cleanup_after(self, futures):
+        """Keep the files until every background task using them is done"""
+        if not futures:
+            return
+        self.deferred = True
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def done(_):
+            with lock:
+                remaining[0] -= 1
+                finished = remaining[0] == 0
+            if finished:
+                self.cleanup()
+
+        for future in futures:
+            future.add_done_callback(done)
+
+
 class ComfyUI:
-    def __init__(self, server_address):
+    def __init__(self, server_address, cuda_device=None, temp_directory=None, main_script="./ComfyUI/main.py"):
         self.server_address = server_address
+        self.cuda_device = cuda_device
+        self.temp_directory = temp_directory
+        self.main_script = main_script
+        self.server_process = None
+
+    @property
+    def temp_output_directory(self):
+        """Where ComfyUI writes temporary (preview) images"""
+        return os.path.join(self.temp_directory or "ComfyUI", "temp")
 
     def start_server(self, output_directory, input_directory):
         self.input_directory = input_directory
         self.output_directory = output_directory
 
         start_time = time.time()
+        self.server_process = None
         server_thread = threading.Thread(
             target=self.run_server, args=(output_directory, input_directory)
         )
         server_thread.start()
         while not self.is_server_running():
+            if self.server_process is not None and not self.is_alive():
+                raise RuntimeError(f"Server {self.server_address} exited during startup")
             if time.time() - start_time > 600:
                 raise TimeoutError("Server did not start within 600 seconds")
             time.sleep(0.5)
@@ -60,7 +180,12 @@ class ComfyUI:
         print(f"Server started in {elapsed_time:.2f} seconds")
 
     def run_server(self, output_directory, input_directory):
-        command = f"python ./ComfyUI/main.py --output-directory {output_directory} --input-directory {input_directory} --disable-metadata"
+        port = self.server_address.rsplit(":", 1)[-1]
+        command = f"exec python {self.main_script} --port {port} --output-directory {output_directory} --input-directory {input_directory} --disable-metadata"
+        if self.cuda_device is not None:
+            command += f" --cuda-device {self.cuda_device}"
+        if self.temp_directory:
+            command += f" --temp-directory {self.temp_directory}"
 
         """
         We need to capture the stdout and stderr from the server process
@@ -75,24 +200,42 @@ class ComfyUI:
             stderr=subprocess.PIPE,
             universal_newlines=True,
         )
+        self.server_process = server_process
 
         def print_stdout():
             for stdout_line in iter(server_process.stdout.readline, ""):
-                print(f"[ComfyUI] {stdout_line.strip()}")
+                print(f"[ComfyUI {port}] {stdout_line.strip()}")
 
         stdout_thread = threading.Thread(target=print_stdout)
         stdout_thread.start()
 
         for stderr_line in iter(server_process.stderr.readline, ""):
-            print(f"[ComfyUI] {stderr_line.strip()}")
+            print(f"[ComfyUI {port}] {stderr_line.strip()}")
+
+    def is_alive(self):
+        """Whether the server process started by run_server is still running"""
+        return self.server_process is not None and self.server_process.poll() is None
+
+    def stop_server(self):
+        if self.is_alive():
+            self.server_process.kill()
+            self.server_process.wait()
+
+    def queue_depth(self):
+        """Number of prompts running or pending on the server"""
+        with urllib.request.urlopen(
+            f"http://{self.server_address}/queue", timeout=5
+        ) as response:
+            queue = json.loads(response.read())
+        return len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
 
     def is_server_running(self):
         try:
             with urllib.request.urlopen(
-                "http://{}/history/{}".format(self.server_address, "123")
+                "http://{}/history/{}".format(self.server_address, "123"), timeout=5
             ) as response:
                 return response.status == 200
-        except URLError:
+        except (URLError, OSError):
             return False
 
     def is_image_or_video_value(self, value):
@@ -122,13 +265,50 @@ class ComfyUI:
         self.post_request("/queue", {"clear": True})
         self.post_request("/interrupt")
 
-    def queue_prompt(self, prompt):
+    def cancel_prompt(self, prompt_id):
+        """
+        Stop a single prompt: drop it from the queue if it is still pending,
+        or interrupt it if it is the one running. Other prompts are untouched.
+        """
+        with urllib.request.urlopen(f"http://{self.server_address}/queue", timeout=5) as response:
+            queue = json.loads(response.read())
+
+        if any(item[1] == prompt_id for item in queue.get("queue_running", [])):
+            print(f"Interrupting running prompt {prompt_id}")
+            self.post_request("/interrupt")
+        elif any(item[1] == prompt_id for item in queue.get("queue_pending", [])):
+            print(f"Removing pending prompt {prompt_id} from the queue")
+            self.post_request("/queue", {"delete": [prompt_id]})
+
+    def is_prompt_done(self, prompt_id):
+        """
+        Whether prompt_id is in /history, raising if it finished with an
+        error like a websocket execution_error would
+        """
+        with urllib.request.urlopen(
+            f"http://{self.server_address}/history/{prompt_id}", timeout=5
+        ) as response:
+            history = json.loads(response.read())
+        if prompt_id not in history:
+            return False
+
+        status = history[prompt_id].get("status") or {}
+        if status.get("status_str") == "error":
+            errors = [data for event, data in status.get("messages", []) if event == "execution_error"]
+            error_message = json.dumps(errors[0] if errors else status, indent=2)
+            raise Exception(
+                f"There was an error executing your workflow:\n\n{error_message}"
+            )
+        return True
+
+    def queue_prompt(self, prompt, client_id=None):
+        client_id = client_id or self.client_id
         try:
             # Prompt is the loaded workflow (prompt is the label comfyUI uses)
-            p = {"prompt": prompt, "client_id": self.client_id}
+            p = {"prompt": prompt, "client_id": client_id}
             data = json.dumps(p).encode("utf-8")
             req = urllib.request.Request(
-                f"http://{self.server_address}/prompt?{self.client_id}", data=data
+                f"http://{self.server_address}/prompt?{client_id}", data=data
             )
 
             output = json.loads(urllib.request.urlopen(req).read())
@@ -142,33 +322,123 @@ class ComfyUI:
                 "ComfyUI Error – Your workflow could not be run. This usually happens if you’re trying to use an unsupported node. Check the logs for 'KeyError: ' details, and go to https://github.com/fofr/cog-comfyui to see the list of supported custom nodes."
             )
 
-    def wait_for_prompt_completion(self, workflow, prompt_id):
+    def prompt_events(self, workflow, prompt_id, ws=None, deadline=None, recv_timeout=5.0):
+        """
+        Yield progress events for prompt_id until it finishes executing.
+
+        Events are dicts with a "type" of "executing" (node started),
+        "progress" (sampler step value/max) or "executed" (node finished,
+        with the paths of any images it saved to the output directory).
+
+        The websocket is read with recv_timeout so a deadline (a time.time()
+        value) is enforced even when no messages arrive. Past the deadline the
+        prompt is cancelled and PromptTimeoutError is raised. If the socket
+        drops, completion is tracked through /history instead, where a
+        prompt that failed raises like an execution_error message.
+        """
+        ws = ws or self.ws
+        start_time = time.time()
+        last_node, last_class_type = None, None
+
+        def check_deadline():
+            if deadline is not None and time.time() > deadline:
+                try:
+                    self.cancel_prompt(prompt_id)
+                except Exception as e:
+                    # a server that is down can't run it any further either
+                    print(f"Failed to cancel prompt {prompt_id}: {e}")
+                raise PromptTimeoutError(prompt_id, time.time() - start_time, last_node, last_class_type)
+
         while True:
-            out = self.ws.recv()
-            if isinstance(out, str):
-                message = json.loads(out)
-
-                if message["type"] == "execution_error":
-                    error_message = json.dumps(message, indent=2)
-                    raise Exception(
-                        f"There was an error executing your workflow:\n\n{error_message}"
-                    )
-
-                if message["type"] == "executing":
-                    data = message["data"]
-                    if data["node"] is None and data["prompt_id"] == prompt_id:
-                        break
-                    elif data["prompt_id"] == prompt_id:
-                        node = workflow.get(data["node"], {})
-                        meta = node.get("_meta", {})
-                        class_type = node.get("class_type", "Unknown")
-                        print(
-                            f"Executing node {data['node']}, title: {meta.get('title', 'Unknown')}, class type: {class_type}"
-                        )
-            else:
+            check_deadline()
+            timeout = recv_timeout
+            if deadline is not None:
+                timeout = max(min(recv_timeout, deadline - time.time()), 0.01)
+            ws.settimeout(timeout)
+            try:
+                out = ws.recv()
+            except websocket.WebSocketTimeoutException:
+                # quiet socket: a long node, or a completion message we missed
+                if self.is_prompt_done(prompt_id):
+                    break
+                continue
+            except (websocket.WebSocketConnectionClosedException, ConnectionError) as e:
+                print(f"Lost ComfyUI websocket ({e}), polling history for {prompt_id}")
+                while not self.is_prompt_done(prompt_id):
+                    check_deadline()
+                    time.sleep(1.0)
+                break
+
+            if not isinstance(out, str):
                 continue
 
-    def load_workflow(self, workflow):
+            message = json.loads(out)
+
+            if message["type"] == "execution_error":
+                error_message = json.dumps(message, indent=2)
+                raise Exception(
+                    f"There was an error executing your workflow:\n\n{error_message}"
+                )
+
+            data = message.get("data", {})
+            if data.get("prompt_id") != prompt_id:
+                continue
+
+            if message["type"] == "executing":
+                if data["node"] is None:
+                    break
+                node = workflow.get(data["node"], {})
+                meta = node.get("_meta", {})
+                class_type = node.get("class_type", "Unknown")
+                last_node, last_class_type = data["node"], class_type
+                print(
+                    f"Executing node {data['node']}, title: {meta.get('title', 'Unknown')}, class type: {class_type}"
+                )
+                yield {
+                    "type": "executing",
+                    "prompt_id": prompt_id,
+                    "node": data["node"],
+                    "title": meta.get("title", "Unknown"),
+                    "class_type": class_type,
+                }
+
+            elif message["type"] == "execution_cached":
+                yield {
+                    "type": "cached",
+                    "prompt_id": prompt_id,
+                    "nodes": data.get("nodes", []),
+                }
+
+            elif message["type"] == "progress":
+                yield {
+                    "type": "progress",
+                    "prompt_id": prompt_id,
+                    "node": data.get("node"),
+                    "value": data["value"],
+                    "max": data["max"],
+                }
+
+            elif message["type"] == "executed":
+                images = (data.get("output") or {}).get("images", [])
+                files = [
+                    os.path.join(self.output_directory, image.get("subfolder", ""), image["filename"])
+                    for image in images
+                    if image.get("type") == "output"
+                ]
+                if files:
+                    yield {
+                        "type": "executed",
+                        "prompt_id": prompt_id,
+                        "node": data["node"],
+                        "files": files,
+                    }
+
+    def wait_for_prompt_completion(self, workflow, prompt_id, ws=None, deadline=None):
+        for _ in self.prompt_events(workflow, prompt_id, ws, deadline):
+            pass
+
+    @staticmethod
+    def load_workflow(workflow):
         if not isinstance(workflow, dict):
             wf = json.loads(workflow)
         else:
@@ -195,17 +465,46 @@ class ComfyUI:
             print(f"Randomising {input_key} to {new_seed}")
             inputs[input_key] = new_seed
 
-    def randomise_seeds(self, workflow):
+    def randomise_seeds(self, workflow, node_ids=None):
+        """
+        Randomise seed inputs. Pass node_ids to limit this to the samplers
+        that need a fresh seed, leaving every other node's inputs unchanged
+        so ComfyUI can reuse its cached outputs.
+        """
         for node_id, node in workflow.items():
+            if node_ids is not None and node_id not in node_ids:
+                continue
             inputs = node.get("inputs", {})
             seed_keys = ["seed", "noise_seed", "rand_seed"]
             for seed_key in seed_keys:
                 self.randomise_input_seed(seed_key, inputs)
 
-    def run_workflow(self, workflow):
+    @staticmethod
+    def model_files(workflow):
+        """Sorted model files referenced by the loader nodes of a workflow"""
+        files = set()
+        for node in workflow.values():
+            node = Node(node)
+            if node.is_type_in(MODEL_LOADER_INPUTS):
+                value = node.input(MODEL_LOADER_INPUTS[node.type()])
+                if isinstance(value, str):
+                    files.add(value)
+        return sorted(files)
+
+    def run_workflow(self, workflow, context=None, deadline=None):
+        for _ in self.run_workflow_iter(workflow, context, deadline):
+            pass
+
+    def run_workflow_iter(self, workflow, context=None, deadline=None):
+        """
+        Run a workflow, yielding progress events while it executes. With a
+        RequestContext the prompt is tracked on the request's own websocket.
+        """
         print("Running workflow")
-        prompt_id = self.queue_prompt(workflow)
-        self.wait_for_prompt_completion(workflow, prompt_id)
+        client_id = context.client_id if context else None
+        ws = context.ws if context else None
+        prompt_id = self.queue_prompt(workflow, client_id)
+        yield from self.prompt_events(workflow, prompt_id, ws, deadline)
         output_json = self.get_history(prompt_id)
         print("outputs: ", output_json)
         print("====================================")
@@ -239,6 +538,9 @@ class ComfyUI:
 
         return sorted(files)
 
+    def request_context(self):
+        return RequestContext(self)
+
     def cleanup(self, directories):
         self.clear_queue()
         for directory in directories:
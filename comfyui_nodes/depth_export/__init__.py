@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+import folder_paths
+
+
+class SaveDepthRaw:
+    """
+    Save depth maps as float16 .npy arrays straight from the IMAGE tensor,
+    keeping the precision that an 8-bit SaveImage PNG throws away.
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "images": ("IMAGE",),
+                "filename_prefix": ("STRING", {"default": "depth_raw"}),
+            }
+        }
+
+    RETURN_TYPES = ()
+    FUNCTION = "save"
+    OUTPUT_NODE = True
+    CATEGORY = "image"
+
+    def save(self, images, filename_prefix="depth_raw"):
+        full_output_folder, filename, counter, subfolder, _ = folder_paths.get_save_image_path(
+            filename_prefix, folder_paths.get_output_directory(), images[0].shape[1], images[0].shape[0]
+        )
+
+        results = []
+        for image in images:
+            # depth models repeat the same map across the RGB channels
+            depth = image[..., 0].cpu().numpy().astype(np.float16)
+            file = f"{filename}_{counter:05}_.npy"
+            np.save(os.path.join(full_output_folder, file), depth)
+            results.append({"filename": file, "subfolder": subfolder, "type": "output"})
+            counter += 1
+
+        # reported as "depth" rather than "images" so the UI doesn't try to show them
+        return {"ui": {"depth": results}}
+
+
+NODE_CLASS_MAPPINGS = {"SaveDepthRaw": SaveDepthRaw}
+NODE_DISPLAY_NAME_MAPPINGS = {"SaveDepthRaw": "Save Depth (float16)"}
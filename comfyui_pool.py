@@ -0,0 +1,199 @@
+import time
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from comfyui import ComfyUI
+
+
+class ComfyUIPool:
+    """
+    Runs several ComfyUI servers on distinct ports and directories (one per GPU)
+    and dispatches each prediction to the least-loaded healthy server.
+
+    Load is the larger of the server's `/queue` depth and the number of
+    predictions holding it that have not finished running their workflow. A
+    prediction that passes an `executed` event stops counting once it is set,
+    while it still holds the server to collect its outputs. Ties go to the
+    server that last ran the same scheduling key so its loaded models are
+    reused, then to the one with fewer holds. A monitor thread takes servers
+    that stop responding out of rotation and restarts them.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        output_directory: str,
+        input_directory: str,
+        host: str = "127.0.0.1",
+        base_port: int = 8188,
+        cuda_devices: list = None,
+        health_interval: float = 10.0,
+        max_failed_checks: int = 3,
+        main_script: str = "./ComfyUI/main.py"
+    ):
+        self.health_interval = health_interval
+        self.max_failed_checks = max_failed_checks
+        self.lock = threading.Lock()
+        self.backends = []
+        self.directories = {}
+        self.holds = {}  # backend -> executed events of the predictions holding it
+        self.stats = {}
+
+        for i in range(size):
+            # the first server keeps the default directories
+            suffix = "" if i == 0 else f"_{i}"
+            cuda_device = None
+            if cuda_devices:
+                cuda_device = cuda_devices[i % len(cuda_devices)]
+            elif size > 1:
+                cuda_device = i
+
+            backend = ComfyUI(
+                f"{host}:{base_port + i}",
+                cuda_device=cuda_device,
+                temp_directory=f"/tmp/comfyui{suffix}" if i else None,
+                main_script=main_script
+            )
+            self.backends.append(backend)
+            self.directories[backend] = (f"{output_directory}{suffix}", f"{input_directory}{suffix}")
+            self.holds[backend] = []
+            self.stats[backend] = {
+                "address": backend.server_address,
+                "cuda_device": cuda_device,
+                "healthy": False,
+                "restarting": False,
+                "in_flight": 0,
+                "queue_depth": 0,
+                "dispatched": 0,
+                "failed_checks": 0,
+                "restarts": 0,
+                "last_key": None
+            }
+
+    def start(self):
+        """Start every server in parallel and begin health monitoring"""
+        with ThreadPoolExecutor(max_workers=len(self.backends)) as pool:
+            futures = {
+                backend: pool.submit(backend.start_server, *self.directories[backend])
+                for backend in self.backends
+            }
+        for backend, future in futures.items():
+            try:
+                future.result()
+                self.stats[backend]["healthy"] = True
+            except Exception as e:
+                print(f"Failed to start ComfyUI at {backend.server_address}: {e}")
+
+        if not any(stats["healthy"] for stats in self.stats.values()):
+            raise RuntimeError("No ComfyUI servers started")
+
+        monitor = threading.Thread(target=self.monitor, daemon=True)
+        monitor.start()
+
+    def busy(self, backend) -> int:
+        """Predictions holding a server that are still running their workflow"""
+        return sum(1 for executed in self.holds[backend] if executed is None or not executed.is_set())
+
+    def load(self, backend) -> int:
+        try:
+            self.stats[backend]["queue_depth"] = backend.queue_depth()
+        except Exception:
+            # an unreachable server is left for the health check to handle
+            pass
+        with self.lock:
+            return max(self.stats[backend]["queue_depth"], self.busy(backend))
+
+    def acquire(self, key=None, executed: threading.Event = None) -> ComfyUI:
+        """Reserve the least-loaded healthy server for a prediction"""
+        healthy = [b for b in self.backends if self.stats[b]["healthy"]]
+        if not healthy:
+            raise RuntimeError("No healthy ComfyUI servers available")
+
+        loads = {backend: self.load(backend) for backend in healthy}
+        with self.lock:
+            backend = min(
+                healthy,
+                key=lambda b: (
+                    max(loads[b], self.busy(b)),
+                    self.stats[b]["last_key"] != key,
+                    self.stats[b]["in_flight"]
+                )
+            )
+            self.holds[backend].append(executed)
+            self.stats[backend]["in_flight"] += 1
+            self.stats[backend]["dispatched"] += 1
+            self.stats[backend]["last_key"] = key
+        return backend
+
+    def release(self, backend, executed: threading.Event = None):
+        with self.lock:
+            self.holds[backend].remove(executed)
+            self.stats[backend]["in_flight"] -= 1
+
+    @contextmanager
+    def backend(self, key=None, executed: threading.Event = None):
+        """
+        Hold a server for the duration of a prediction. Set `executed` once
+        the workflow has run to let other predictions be dispatched to the
+        server while this one collects its outputs.
+        """
+        backend = self.acquire(key, executed)
+        try:
+            yield backend
+        except Exception:
+            # a failed run may mean the server went down
+            self.check(backend)
+            raise
+        finally:
+            self.release(backend, executed)
+
+    def check(self, backend):
+        """Update a server's health, restarting it if it crashed or hung"""
+        stats = self.stats[backend]
+        if stats["restarting"]:
+            return
+
+        if backend.is_alive() and backend.is_server_running():
+            stats["healthy"] = True
+            stats["failed_checks"] = 0
+            return
+
+        stats["healthy"] = False
+        stats["failed_checks"] += 1
+        print(f"ComfyUI at {backend.server_address} is unhealthy ({stats['failed_checks']} failed checks)")
+
+        if not backend.is_alive() or stats["failed_checks"] >= self.max_failed_checks:
+            stats["restarting"] = True
+            threading.Thread(target=self.restart, args=(backend,), daemon=True).start()
+
+    def restart(self, backend):
+        stats = self.stats[backend]
+        try:
+            print(f"Restarting ComfyUI at {backend.server_address}")
+            backend.stop_server()
+            backend.start_server(*self.directories[backend])
+            stats["restarts"] += 1
+            stats["failed_checks"] = 0
+            stats["healthy"] = True
+        except Exception as e:
+            print(f"Failed to restart ComfyUI at {backend.server_address}: {e}")
+        finally:
+            stats["restarting"] = False
+
+    def monitor(self):
+        while True:
+            time.sleep(self.health_interval)
+            for backend in self.backends:
+                try:
+                    self.check(backend)
+                except Exception as e:
+                    print(f"Health check failed for {backend.server_address}: {e}")
+
+    def get_stats(self) -> list:
+        """Per-server dispatch and health statistics"""
+        with self.lock:
+            return [dict(self.stats[backend]) for backend in self.backends]
+
+    def __len__(self):
+        return len(self.backends)
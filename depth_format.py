@@ -0,0 +1,101 @@
+import zlib
+import struct
+
+import numpy as np
+from PIL import Image, PngImagePlugin
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# float16 container: magic, version, codec, byte-shuffled, width, height, min, max
+HEADER = struct.Struct("<4sBBBxIIff")
+MAGIC = b"DPTH"
+CODECS = {"zlib": 0, "zstd": 1}
+
+
+def load_depth(path) -> np.ndarray:
+    """A raw depth map saved by the SaveDepthRaw node, as float32"""
+    return np.load(path).astype(np.float32)
+
+
+def depth_range(depth: np.ndarray):
+    return float(depth.min()), float(depth.max())
+
+
+def save_png16(depth: np.ndarray, path):
+    """
+    Lossless 16-bit grayscale PNG of the depth normalized to its range. The
+    range is kept in a depth_range text chunk so clients can undo it.
+    """
+    low, high = depth_range(depth)
+    scale = 65535.0 / (high - low) if high > low else 0.0
+    quantized = np.round((depth - low) * scale).astype(np.uint16)
+
+    info = PngImagePlugin.PngInfo()
+    info.add_text("depth_range", f"{low},{high}")
+    Image.fromarray(quantized).save(path, format="PNG", pnginfo=info, compress_level=6)
+    return low, high
+
+
+def save_float16(depth: np.ndarray, path, codec: str = "zlib"):
+    """
+    float16 depth values behind a fixed header holding the size and range.
+    Bytes are shuffled (all low bytes, then all high bytes) before
+    compression, which roughly halves the size of smooth depth maps.
+    """
+    if codec == "zstd" and zstandard is None:
+        codec = "zlib"
+    low, high = depth_range(depth)
+    height, width = depth.shape
+
+    shuffled = np.ascontiguousarray(depth.astype("<f2").view(np.uint8).reshape(-1, 2).T).tobytes()
+    if codec == "zstd":
+        payload = zstandard.ZstdCompressor(level=3).compress(shuffled)
+    else:
+        payload = zlib.compress(shuffled, 6)
+
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, 1, CODECS[codec], 1, width, height, low, high))
+        file.write(payload)
+    return low, high
+
+
+def read_depth(path) -> np.ndarray:
+    """Decode a depth artifact written by save_png16 or save_float16 to float32"""
+    with open(path, "rb") as file:
+        head = file.read(HEADER.size)
+
+        if head[:4] == MAGIC:
+            _, _, codec, shuffled, width, height, _, _ = HEADER.unpack(head)
+            payload = file.read()
+            if codec == CODECS["zstd"]:
+                data = zstandard.ZstdDecompressor().decompress(payload)
+            else:
+                data = zlib.decompress(payload)
+            values = np.frombuffer(data, dtype=np.uint8)
+            if shuffled:
+                values = np.ascontiguousarray(values.reshape(2, -1).T)
+            return values.view("<f2").reshape(height, width).astype(np.float32)
+
+    with Image.open(path) as image:
+        low, high = (float(v) for v in image.text["depth_range"].split(","))
+        quantized = np.asarray(image, dtype=np.float32)
+    return low + quantized * ((high - low) / 65535.0)
+
+
+def save_preview(depth: np.ndarray, path, quality: int = 80):
+    """Quantized 8-bit WebP of the depth for display, cheap to encode"""
+    low, high = depth_range(depth)
+    scale = 255.0 / (high - low) if high > low else 0.0
+    Image.fromarray(np.round((depth - low) * scale).astype(np.uint8)).save(
+        path, format="WEBP", quality=quality, method=2
+    )
+
+
+# depth_format -> (extension, writer, content type)
+DEPTH_FORMATS = {
+    "png16": (".png", save_png16, "image/png"),
+    "float16": (".f16z", save_float16, "application/octet-stream"),
+}
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from minio.error import S3Error
+
+
+class DownloadCache:
+    """
+    Size-bounded local cache for objects downloaded from storage.
+
+    Each cached object is stored under the hash of its bucket and key, next to
+    a small sidecar recording its ETag. A fetch costs one HEAD request: when
+    the stored ETag still matches the cached copy is hard-linked (or copied)
+    to the destination, otherwise the object is downloaded, checked against
+    its ETag and cached. The least recently used entries are evicted once the
+    cache grows past max_bytes.
+    """
+
+    def __init__(self, cloud, cache_directory: str, max_bytes: int = 2 * 1024**3, workers: int = 4):
+        self.cloud = cloud
+        self.cache_directory = cache_directory
+        self.max_bytes = max_bytes
+        self.workers = workers
+        os.makedirs(cache_directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.key_locks = {}  # entry -> lock held while fetching, linking or evicting it
+        self.stats = Counter()
+
+    def entry_path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.cache_directory, hashlib.sha256(f"{bucket}/{key}".encode()).hexdigest())
+
+    def fetch(self, files: dict, bucket: str = None, deadline: float = None) -> dict:
+        """
+        Fetch several objects (key -> local path) in parallel, returning
+        key -> success. Raises TimeoutError if they are not all fetched by
+        the deadline; downloads still running finish into the cache.
+        """
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        futures = {key: pool.submit(self.get, key, path, bucket) for key, path in files.items()}
+        _, pending = wait(futures.values(), None if deadline is None else max(0.0, deadline - time.time()))
+        pool.shutdown(wait=False, cancel_futures=True)
+        if pending:
+            keys = [key for key, future in futures.items() if future in pending]
+            raise TimeoutError(f"Downloading {', '.join(keys)} did not finish before the deadline")
+        return {key: future.result() for key, future in futures.items()}
+
+    def get(self, key: str, local_path: str, bucket: str = None) -> bool:
+        """Place an object at local_path, from the cache when it is still current"""
+        bucket = bucket or self.cloud.bucket
+        try:
+            stat = self.cloud.call("stat_object", bucket, key)
+        except S3Error as e:
+            print(f"Error downloading file: {e}")
+            return False
+        etag = stat.etag.strip('"')
+
+        entry = self.entry_path(bucket, key)
+        while True:
+            with self.lock:
+                key_lock = self.key_locks.setdefault(entry, threading.Lock())
+            with key_lock:
+                with self.lock:
+                    # evicted while waiting, so another fetch may hold a new lock
+                    if self.key_locks.get(entry) is not key_lock:
+                        continue
+                if not self.place(bucket, key, entry, etag, stat.size, local_path):
+                    return False
+            break
+
+        self.evict()
+        return True
+
+    def place(self, bucket: str, key: str, entry: str, etag: str, size: int, local_path: str) -> bool:
+        """Link the cached copy to local_path, downloading it first on a miss"""
+        if self.cached_etag(entry) == etag and self.touch(entry):
+            with self.lock:
+                self.stats["hits"] += 1
+                self.stats["bytes_saved"] += size
+        else:
+            if not self.download(bucket, key, entry, etag):
+                return False
+            with self.lock:
+                self.stats["misses"] += 1
+                self.stats["bytes_downloaded"] += size
+
+        if os.path.exists(local_path):
+            os.remove(local_path)
+        try:
+            os.link(entry, local_path)
+        except OSError:
+            shutil.copyfile(entry, local_path)
+        return True
+
+    @staticmethod
+    def touch(entry: str) -> bool:
+        """Mark an entry as used, False if its file is gone"""
+        try:
+            os.utime(entry)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def cached_etag(self, entry: str) -> str:
+        try:
+            with open(f"{entry}.json", "r") as file:
+                return json.loads(file.read())["etag"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def download(self, bucket: str, key: str, entry: str, etag: str) -> bool:
+        part_path = f"{entry}.part"
+        try:
+            self.cloud.call("fget_object", bucket, key, part_path)
+        except S3Error as e:
+            print(f"Error downloading file: {e}")
+            return False
+
+        _, _, parts = etag.partition("-")
+        local_etag = self.cloud.local_etag(part_path, int(parts or 1))
+        # ETags of SSE-KMS objects, or multipart objects with unknown part
+        # sizes, can't be recomputed locally
+        if local_etag is not None and local_etag != etag:
+            print(f"Checksum mismatch downloading {key}")
+            os.remove(part_path)
+            return False
+
+        os.replace(part_path, entry)
+        with open(f"{entry}.json", "w") as file:
+            file.write(json.dumps({"bucket": bucket, "key": key, "etag": etag}))
+        return True
+
+    def entries(self) -> list:
+        """(last used, size, path) of every cached object"""
+        entries = []
+        for name in os.listdir(self.cache_directory):
+            if name.endswith((".json", ".part")):
+                continue
+            path = os.path.join(self.cache_directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """Remove the least recently used objects until the cache fits max_bytes"""
+        with self.lock:
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                key_lock = self.key_locks.setdefault(path, threading.Lock())
+                if not key_lock.acquire(blocking=False):
+                    # being fetched or linked right now
+                    continue
+                try:
+                    # files hard-linked into request directories stay intact
+                    for stale in (path, f"{path}.json"):
+                        if os.path.exists(stale):
+                            os.remove(stale)
+                finally:
+                    del self.key_locks[path]
+                    key_lock.release()
+                total -= size
+                self.stats["evictions"] += 1
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            requests = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / requests if requests else 0.0,
+                "cached_bytes": sum(size for _, size, _ in self.entries())
+            }
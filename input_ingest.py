@@ -0,0 +1,99 @@
+import os
+import tarfile
+import zipfile
+from pathlib import Path
+from typing import List
+
+# Leading bytes of the image types LoadImage is given
+IMAGE_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"\xff\xd8\xff", ".jpg"),
+]
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".webp"]
+
+
+def sniff_image(head: bytes) -> str:
+    """Image extension matching a file's first 12 bytes, or None"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    return None
+
+
+class InputIngester:
+    """
+    Extracts the images from an uploaded tar or zip archive, one member at a
+    time. Members are never extracted wholesale: each one is identified by
+    its first bytes, anything that isn't an image is skipped, and extraction
+    stops with a ValueError once the archive exceeds max_members entries or
+    max_bytes of extracted data. Sizes are counted while copying, so headers
+    that understate a member's size don't get past the budget.
+    """
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024, max_members: int = 1000, chunk_size: int = 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_members = max_members
+        self.chunk_size = chunk_size
+
+    def ingest(self, archive: Path, file_extension: str, directory: str) -> List[Path]:
+        """Extract the images of a .tar (any compression) or .zip archive, in archive order"""
+        self.members = 0
+        self.extracted_bytes = 0
+        self.skipped = 0
+        images = []
+
+        if file_extension == ".zip":
+            with zipfile.ZipFile(archive, "r") as zip_ref:
+                for info in zip_ref.infolist():
+                    self.count_member()
+                    if info.is_dir():
+                        continue
+                    with zip_ref.open(info) as stream:
+                        images.append(self.write_member(info.filename, stream, directory))
+        else:
+            # "r|*" reads the archive as a stream, whatever its compression
+            with tarfile.open(archive, "r|*") as tar:
+                for member in tar:
+                    self.count_member()
+                    if not member.isfile():
+                        continue
+                    with tar.extractfile(member) as stream:
+                        images.append(self.write_member(member.name, stream, directory))
+
+        images = [image for image in images if image is not None]
+        if not images:
+            raise ValueError(f"No supported images ({', '.join(IMAGE_EXTENSIONS)}) found in {os.path.basename(archive)}")
+        return images
+
+    def count_member(self):
+        self.members += 1
+        if self.members > self.max_members:
+            raise ValueError(f"Archive has more than {self.max_members} members")
+
+    def write_member(self, name: str, stream, directory: str) -> Path:
+        head = stream.read(12)
+        extension = sniff_image(head)
+        # skip non-images, and names that would land outside the directory
+        relative = os.path.normpath(name)
+        if extension is None or os.path.isabs(relative) or relative.startswith(".."):
+            self.skipped += 1
+            return None
+
+        if os.path.splitext(relative)[1].lower() not in IMAGE_EXTENSIONS:
+            relative += extension
+        path = Path(os.path.join(directory, relative))
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(path, "wb") as file:
+            chunk = head
+            while chunk:
+                self.extracted_bytes += len(chunk)
+                if self.extracted_bytes > self.max_bytes:
+                    file.close()
+                    path.unlink()
+                    raise ValueError(f"Archive extracts to more than {self.max_bytes} bytes")
+                file.write(chunk)
+                chunk = stream.read(self.chunk_size)
+        return path
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import threading
+from typing import Dict, List, Iterator
+
+from minio.error import S3Error
+
+
+class ManifestIndex:
+    """
+    Compact local index of the panoramas in a bucket, persisted as JSON.
+
+    Objects are stored as `{id}/{artifact}`, so the index maps each id to its
+    artifacts and their sizes plus the newest last_modified. It is built from
+    a streaming listing and checkpointed with the last key seen, so update()
+    can stop after max_keys objects and the next call resumes where it left
+    off. Keys are listed in order, so ids created behind the marker are picked
+    up on the next pass: when a pass reaches the end of the bucket the marker
+    wraps around, and ids that were not seen during the pass are dropped.
+    """
+
+    def __init__(self, cloud, path: str, bucket: str = None):
+        self.cloud = cloud
+        self.path = path
+        self.bucket = bucket or cloud.bucket
+        self.lock = threading.Lock()
+
+        self.entries = {}  # id -> {"artifacts": {name: size}, "last_modified": iso, "pass": n}
+        self.marker = None
+        self.current_pass = 0
+        self.updated = None
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as file:
+                data = json.loads(file.read())
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable manifest {self.path}: {e}")
+            return
+
+        if data.get("bucket") != self.bucket:
+            print(f"Ignoring manifest {self.path} for bucket {data.get('bucket')}")
+            return
+        self.entries = data["entries"]
+        self.marker = data["marker"]
+        self.current_pass = data["pass"]
+        self.updated = data.get("updated")
+
+    def save(self):
+        """Atomically write the index to disk"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(json.dumps({
+                "bucket": self.bucket,
+                "marker": self.marker,
+                "pass": self.current_pass,
+                "updated": self.updated,
+                "entries": self.entries
+            }, separators=(",", ":")))
+        os.replace(tmp_path, self.path)
+
+    def update(self, max_keys: int = None, checkpoint_every: int = 10000) -> int:
+        """
+        Continue listing the bucket from the last marker, indexing up to
+        max_keys objects (the rest of the pass when None). Returns the number
+        of objects read.
+        """
+        count = 0
+        with self.lock:
+            try:
+                for obj in self.cloud.iter_files(start_after=self.marker, bucket=self.bucket):
+                    self.add(obj)
+                    self.marker = obj["name"]
+                    count += 1
+                    if count % checkpoint_every == 0:
+                        self.save()
+                    if max_keys is not None and count >= max_keys:
+                        break
+                else:
+                    self.finish_pass()
+            except S3Error as e:
+                print(f"Error listing {self.bucket}: {e}")
+
+            self.updated = time.time()
+            self.save()
+        return count
+
+    def add(self, obj: Dict):
+        id, _, artifact = obj["name"].partition("/")
+        if not artifact:
+            return
+        entry = self.entries.get(id)
+        if entry is None or entry["pass"] != self.current_pass:
+            # first time this id is seen in the current pass
+            entry = self.entries[id] = {"artifacts": {}, "last_modified": None, "pass": self.current_pass}
+        entry["artifacts"][artifact] = obj["size"]
+        last_modified = obj["last_modified"].isoformat() if obj["last_modified"] else None
+        if last_modified and (entry["last_modified"] is None or last_modified > entry["last_modified"]):
+            entry["last_modified"] = last_modified
+
+    def finish_pass(self):
+        """Drop ids deleted since the last pass and start the next one"""
+        for id in [id for id, entry in self.entries.items() if entry["pass"] != self.current_pass]:
+            del self.entries[id]
+        self.marker = None
+        self.current_pass += 1
+
+    def get(self, id: str) -> Dict:
+        entry = self.entries.get(id)
+        if entry is None:
+            return None
+        return {"id": id, "size": sum(entry["artifacts"].values()), **entry}
+
+    def query(
+        self,
+        prefix: str = "",
+        has: List[str] = None,
+        missing: List[str] = None,
+        since: str = None,
+        limit: int = None
+    ) -> Iterator[Dict]:
+        """
+        Ids matching an id prefix, having all artifacts in `has`, lacking
+        all artifacts in `missing`, and modified at or after `since` (ISO
+        timestamp), most recently modified first.
+        """
+        matches = []
+        for id, entry in self.entries.items():
+            if prefix and not id.startswith(prefix):
+                continue
+            if has and not all(name in entry["artifacts"] for name in has):
+                continue
+            if missing and any(name in entry["artifacts"] for name in missing):
+                continue
+            if since and (entry["last_modified"] or "") < since:
+                continue
+            matches.append(id)
+
+        matches.sort(key=lambda id: self.entries[id]["last_modified"] or "", reverse=True)
+        for id in matches[:limit]:
+            yield self.get(id)
+
+    def summary(self) -> Dict:
+        return {
+            "bucket": self.bucket,
+            "ids": len(self.entries),
+            "objects": sum(len(entry["artifacts"]) for entry in self.entries.values()),
+            "bytes": sum(sum(entry["artifacts"].values()) for entry in self.entries.values()),
+            "pass": self.current_pass,
+            "marker": self.marker,
+            "updated": self.updated
+        }
+
+    def __len__(self):
+        return len(self.entries)
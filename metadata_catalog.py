@@ -0,0 +1,403 @@
+import os
+import json
+import time
+import socket
+import threading
+from itertools import islice
+from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from minio.error import S3Error
+
+OPERATORS = {
+    "==": lambda column, value: column == value,
+    "!=": lambda column, value: column != value,
+    ">": lambda column, value: column > value,
+    ">=": lambda column, value: column >= value,
+    "<": lambda column, value: column < value,
+    "<=": lambda column, value: column <= value,
+    "in": lambda column, value: np.isin(column, list(value)),
+    "contains": lambda column, value: np.char.find(column, value) >= 0,
+}
+
+AGGREGATES = {
+    "count": lambda values: int(np.count_nonzero(~np.isnan(values))),
+    "sum": lambda values: float(np.nansum(values)),
+    "mean": lambda values: float(np.nanmean(values)) if np.any(~np.isnan(values)) else None,
+    "min": lambda values: float(np.nanmin(values)) if np.any(~np.isnan(values)) else None,
+    "max": lambda values: float(np.nanmax(values)) if np.any(~np.isnan(values)) else None,
+}
+
+# every node mirrors its catalog to its own key under this prefix
+MIRROR_PREFIX = "catalog/"
+
+
+class MetadataCatalog:
+    """
+    Columnar catalog of the metadata.json written for every generation.
+
+    Compacted rows live in one compressed .npz with an array per field:
+    float64 for numbers (NaN when missing) and dictionary-encoded codes plus
+    a vocabulary for strings. New rows are appended to a JSON lines journal
+    and folded into the column file every compact_every rows, keeping the
+    newest row per id. Each compaction is mirrored to the bucket under a key
+    of the node's own (catalog/{node}.npz), so nodes never overwrite each
+    other. At startup and before a backfill, sync() folds in every node's
+    mirror, which is also how a fresh machine starts.
+
+        catalog.query({"sampler": "dpmpp_sde", "cfg": (">", 4)}, columns=["id", "cfg"])
+        catalog.aggregate("width", "mean", by="sampler")
+    """
+
+    def __init__(
+        self,
+        cloud,
+        directory: str,
+        bucket: str = None,
+        uploader=None,
+        compact_every: int = 256,
+        node: str = None,
+        mirror_key: str = None
+    ):
+        self.cloud = cloud
+        self.uploader = uploader or cloud
+        self.bucket = bucket or cloud.bucket
+        self.compact_every = compact_every
+        self.node = node or os.environ.get("CATALOG_NODE") or socket.gethostname()
+        self.mirror_key = mirror_key or f"{MIRROR_PREFIX}{self.node}.npz"
+        self.column_path = os.path.join(directory, "metadata.npz")
+        self.journal_path = os.path.join(directory, "pending.jsonl")
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.RLock()
+        self.table = {}  # compacted columns: name -> float64 or str array
+        self.pending = []  # rows appended since the last compaction
+        self.merged = None  # table and pending rows combined, rebuilt lazily
+
+        self.load()
+        self.sync()
+
+    def sync(self) -> int:
+        """
+        Fold in the catalogs every node mirrored to the bucket (this one's
+        included, for a fresh machine), returning the number of rows read
+        """
+        try:
+            keys = [
+                obj["name"] for obj in self.cloud.iter_files(MIRROR_PREFIX, bucket=self.bucket)
+                if obj["name"].endswith(".npz")
+            ]
+        except S3Error as e:
+            if e.code != "NoSuchBucket":
+                print(f"Error listing metadata catalogs: {e}")
+            return 0
+
+        tables = []
+        download_path = os.path.join(os.path.dirname(self.column_path), "sync.npz")
+        for key in keys:
+            try:
+                self.cloud.call("fget_object", self.bucket, key, download_path)
+                tables.append(read_columns(download_path))
+            except (S3Error, OSError, ValueError) as e:
+                print(f"Skipping metadata catalog {key}: {e}")
+        if os.path.exists(download_path):
+            os.remove(download_path)
+
+        rows = sum(len(table["id"]) for table in tables if "id" in table)
+        if rows:
+            self.compact(tables, mirror=False)
+            print(f"Synced {rows} rows from {len(tables)} metadata catalogs in {self.bucket}")
+        return rows
+
+    def load(self):
+        if os.path.exists(self.column_path):
+            self.table = read_columns(self.column_path)
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r") as file:
+                for line in file:
+                    try:
+                        self.pending.append(json.loads(line))
+                    except ValueError:
+                        # a torn final line from a crash mid-append
+                        pass
+
+    def append(self, metadata: Dict, compact: bool = True):
+        """Add a generation's metadata, replacing any earlier row with its id"""
+        row = {**metadata}
+        row.setdefault("created", time.time())
+        with self.lock:
+            with open(self.journal_path, "a") as file:
+                file.write(json.dumps(row) + "\n")
+            self.pending.append(row)
+            self.merged = None
+            if compact and len(self.pending) >= self.compact_every:
+                self.compact()
+
+    def merge(self, tables: List[Dict[str, np.ndarray]] = ()) -> Dict[str, np.ndarray]:
+        """
+        Compacted columns with other tables and the pending rows folded in,
+        newest row per id
+        """
+        rows = self.pending
+        tables = [self.table, *tables]
+        sizes = [len(next(iter(table.values()))) if table else 0 for table in tables]
+        names = []
+        for table in tables:
+            names.extend(name for name in table if name not in names)
+        for row in rows:
+            names.extend(name for name in row if name not in names)
+
+        columns = {}
+        for name in names:
+            olds = [table.get(name) for table in tables]
+            new = [flatten(row.get(name)) for row in rows]
+            numeric = all(old is None or old.dtype.kind == "f" for old in olds) and all(
+                value is None or isinstance(value, (int, float)) for value in new
+            )
+            if numeric:
+                olds = [np.full(size, np.nan) if old is None else old for old, size in zip(olds, sizes)]
+                new = np.array([np.nan if value is None else float(value) for value in new], dtype=np.float64)
+            else:
+                olds = [
+                    np.full(size, "") if old is None
+                    else np.where(np.isnan(old), "", old.astype(str)) if old.dtype.kind == "f"
+                    else old
+                    for old, size in zip(olds, sizes)
+                ]
+                new = np.array(["" if value is None else str(value) for value in new], dtype=str)
+            columns[name] = np.concatenate([*olds, new])
+
+        if "id" in columns and len(columns["id"]):
+            created = columns.get("created")
+            if created is not None and created.dtype.kind == "f":
+                # order by creation so a node's stale copy of a row never wins
+                order = np.argsort(np.nan_to_num(created, nan=-np.inf), kind="stable")
+                columns = {name: column[order] for name, column in columns.items()}
+            # keep the last occurrence of every id, in order
+            ids = columns["id"][::-1]
+            _, first = np.unique(ids, return_index=True)
+            keep = np.sort(len(ids) - 1 - first)
+            columns = {name: column[keep] for name, column in columns.items()}
+        return columns
+
+    def frame(self) -> Dict[str, np.ndarray]:
+        with self.lock:
+            if self.merged is None:
+                self.merged = self.merge()
+            return self.merged
+
+    def compact(self, tables: List[Dict[str, np.ndarray]] = (), mirror: bool = True):
+        """Fold pending rows (and other tables) into the column file and mirror it to the bucket"""
+        with self.lock:
+            columns = self.merge(tables) if tables else self.frame()
+            arrays = {}
+            for name, column in columns.items():
+                if column.dtype.kind == "f":
+                    arrays[f"n:{name}"] = column
+                else:
+                    vocabulary, codes = np.unique(column, return_inverse=True)
+                    arrays[f"c:{name}"] = codes.astype(np.int32)
+                    arrays[f"v:{name}"] = vocabulary
+
+            tmp_path = f"{self.column_path}.tmp.npz"
+            np.savez_compressed(tmp_path, **arrays)
+            os.replace(tmp_path, self.column_path)
+            open(self.journal_path, "w").close()
+
+            self.table = columns
+            self.pending = []
+            self.merged = columns
+
+        if not mirror:
+            return
+        try:
+            self.uploader.upload_file(self.column_path, self.mirror_key, "application/octet-stream", self.bucket)
+        except Exception as e:
+            print(f"Error mirroring metadata catalog: {e}")
+
+    def mask(self, where: Dict = None) -> np.ndarray:
+        """
+        Rows matching every predicate. A predicate is a value to compare for
+        equality, an (operator, value) tuple using one of OPERATORS, or a
+        callable taking the column array and returning a boolean mask.
+        """
+        columns = self.frame()
+        size = len(columns["id"]) if "id" in columns else 0
+        mask = np.ones(size, dtype=bool)
+        for name, predicate in (where or {}).items():
+            if name not in columns:
+                return np.zeros(size, dtype=bool)
+            column = columns[name]
+            if callable(predicate):
+                mask &= predicate(column)
+            elif isinstance(predicate, tuple):
+                operator, value = predicate
+                mask &= OPERATORS[operator](column, value)
+            else:
+                mask &= column == predicate
+        return mask
+
+    def query(
+        self,
+        where: Dict = None,
+        columns: List[str] = None,
+        order_by: str = None,
+        descending: bool = False,
+        limit: int = None
+    ) -> List[Dict]:
+        """Matching rows as dicts, optionally sorted and limited"""
+        frame = self.frame()
+        indices = np.flatnonzero(self.mask(where))
+        if order_by:
+            order = np.argsort(frame[order_by][indices], kind="stable")
+            indices = indices[order[::-1] if descending else order]
+        names = columns or list(frame)
+        return [
+            {name: python_value(frame[name][i]) for name in names if name in frame}
+            for i in islice(indices, limit)
+        ]
+
+    def aggregate(self, column: str = "id", func: str = "count", by: str = None, where: Dict = None) -> Dict:
+        """
+        Aggregate a numeric column (or count rows) over the matching rows,
+        either in total or per value of the `by` column.
+        """
+        frame = self.frame()
+        mask = self.mask(where)
+        if func == "count" and (column == "id" or column not in frame):
+            values = np.zeros(len(mask))
+        else:
+            values = frame[column].astype(np.float64)
+        values = values[mask]
+
+        if by is None:
+            return {"all": AGGREGATES[func](values)}
+        groups = frame[by][mask]
+        return {
+            python_value(group): AGGREGATES[func](values[groups == group])
+            for group in np.unique(groups)
+        }
+
+    def backfill(self, workers: int = 16, limit: int = None) -> int:
+        """
+        Catalog metadata.json objects already in the bucket that the catalog
+        doesn't know about, fetching them with parallel GETs. Other nodes'
+        catalogs are synced first so their rows aren't fetched again.
+        """
+        self.sync()
+        known = set(self.frame().get("id", []))
+        objects = [
+            obj for obj in self.cloud.iter_files(bucket=self.bucket)
+            if obj["name"].endswith("/metadata.json") and obj["name"].split("/")[0] not in known
+        ][:limit]
+        print(f"Backfilling {len(objects)} metadata objects from {self.bucket}")
+
+        count = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for obj, row in zip(objects, pool.map(self.fetch_metadata, objects)):
+                if row is None:
+                    continue
+                row.setdefault("id", obj["name"].split("/")[0])
+                row.setdefault("created", obj["last_modified"].timestamp() if obj["last_modified"] else None)
+                self.append(row, compact=False)
+                count += 1
+        self.compact()
+        return count
+
+    def fetch_metadata(self, obj: Dict) -> Dict:
+        try:
+            response = self.cloud.call("get_object", self.bucket, obj["name"])
+            try:
+                return json.loads(response.data)
+            finally:
+                response.close()
+                response.release_conn()
+        except (S3Error, ValueError) as e:
+            print(f"Skipping {obj['name']}: {e}")
+            return None
+
+    def __len__(self):
+        frame = self.frame()
+        return len(frame["id"]) if "id" in frame else 0
+
+
+def read_columns(path: str) -> Dict[str, np.ndarray]:
+    """Columns of a compacted .npz, decoding dictionary-encoded strings"""
+    columns = {}
+    with np.load(path) as data:
+        for name in data.files:
+            kind, _, column = name.partition(":")
+            if kind == "n":
+                columns[column] = data[name]
+            elif kind == "c":
+                columns[column] = data[f"v:{column}"][data[name]]
+    return columns
+
+
+def flatten(value):
+    """Store nested values as JSON strings"""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def python_value(value):
+    if isinstance(value, np.floating):
+        if np.isnan(value):
+            return None
+        return int(value) if value.is_integer() else float(value)
+    if isinstance(value, np.str_):
+        return str(value)
+    return value
+
+
+if __name__ == '__main__':
+    import argparse
+    from minio_manager import MinioStorageManager
+
+    parser = argparse.ArgumentParser(description='Metadata catalog')
+    parser.add_argument('--bucket', type=str, help='Bucket to catalog', default='test')
+    parser.add_argument('--directory', type=str, help='Local catalog directory', default=None)
+    parser.add_argument('--backfill', action='store_true', help='Catalog metadata already in the bucket')
+    parser.add_argument('--where', type=str, help='JSON predicates, e.g. \'{"sampler": "dpmpp_sde", "cfg": [">", 4]}\'')
+    parser.add_argument('--aggregate', type=str, nargs=2, metavar=('COLUMN', 'FUNC'), help='e.g. width mean')
+    parser.add_argument('--by', type=str, help='Group aggregates by this column')
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    # load from .env file
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    manager = MinioStorageManager(
+        endpoint=os.environ['MINIO_ENDPOINT'],
+        access_key=os.environ['MINIO_ACCESS_KEY'],
+        secret_key=os.environ['MINIO_SECRET_KEY'],
+        external_endpoint=os.environ['MINIO_EXTERNAL_ENDPOINT'],
+        bucket=args.bucket,
+    )
+    catalog = MetadataCatalog(
+        manager,
+        args.directory or os.path.join(os.environ.get('CATALOG_DIR', '/tmp/catalog'), args.bucket),
+        args.bucket
+    )
+
+    if args.backfill:
+        print(f"Backfilled {catalog.backfill()} rows")
+
+    where = {
+        name: tuple(predicate) if isinstance(predicate, list) else predicate
+        for name, predicate in json.loads(args.where or "{}").items()
+    }
+
+    start = time.perf_counter()
+    if args.aggregate:
+        result = catalog.aggregate(*args.aggregate, by=args.by, where=where)
+        for group, value in result.items():
+            print(f"{group}: {value}")
+    else:
+        for row in catalog.query(where, columns=["id", "prompt", "sampler", "scheduler", "cfg", "steps", "width", "height"], limit=args.limit):
+            print(row)
+    print(f"{len(catalog)} rows, query took {(time.perf_counter() - start) * 1000:.1f}ms")
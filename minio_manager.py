@@ -1,15 +1,24 @@
 import os
 import json
+import time
 import hashlib
 import mimetypes
+import threading
+from itertools import islice
+from collections import Counter
 from pathlib import Path
-from typing import List, Dict
+from datetime import timedelta
+from typing import List, Dict, Iterator
 from urllib.parse import urljoin
 
-import numpy as np
-from PIL import Image
+import certifi
+import urllib3
 from minio import Minio
 from minio.error import S3Error
+from minio.commonconfig import ENABLED, Filter
+from minio.lifecycleconfig import LifecycleConfig, Rule, Expiration
+
+from multipart_upload import MultipartUploader, MIN_PART_SIZE
 
 class MinioStorageManager:
     def __init__(
@@ -19,7 +28,13 @@ class MinioStorageManager:
         secret_key: str = "ROOTPASSWORD",
         bucket: str = "test",
         secure: bool = False,
-        external_endpoint: str = None  # Optional external endpoint for public URLs
+        external_endpoint: str = None,  # Optional external endpoint for public URLs
+        bucket_ttl: float = 300.0,  # How long a bucket is known to exist before re-checking
+        max_presigned_urls: int = 1024,  # Presigned URLs kept for reuse
+        client=None,  # Optional preconfigured (or fake) S3 client
+        multipart_threshold: int = None,  # Files this large use parallel multipart uploads (off by default)
+        part_size: int = 8 * 1024 * 1024,
+        upload_workers: int = 8
     ):
         self.endpoint = endpoint
         self.external_endpoint = external_endpoint or endpoint
@@ -27,36 +42,115 @@ class MinioStorageManager:
         self.secret_key = secret_key
         self.bucket = bucket
         self.secure = secure
+        self.bucket_ttl = bucket_ttl
+        self.max_presigned_urls = max_presigned_urls
+        self.multipart_threshold = multipart_threshold
 
-        # Initialize MinIO client
-        self.client = Minio(
+        # Initialize MinIO client, with enough pooled connections for
+        # every multipart worker plus regular requests
+        self.client = client or Minio(
             endpoint,
             access_key=access_key,
             secret_key=secret_key,
-            secure=secure
+            secure=secure,
+            http_client=urllib3.PoolManager(
+                maxsize=upload_workers + 4,
+                timeout=urllib3.Timeout(connect=10, read=300),
+                cert_reqs="CERT_REQUIRED",
+                ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+                retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504])
+            )
         )
+        self.multipart = MultipartUploader(self, part_size=part_size, workers=upload_workers)
+
+        # Storage metadata caches and per-operation call counters
+        self.lock = threading.Lock()
+        self.known_buckets = {}  # bucket -> time it was last confirmed
+        self.presigned_urls = {}  # (bucket, object, expires) -> (url, time signed), oldest first
+        self.stats = Counter()
+
+    def call(self, operation: str, *args, **kwargs):
+        """Call an S3 client operation, counting it"""
+        with self.lock:
+            self.stats[operation] += 1
+        return getattr(self.client, operation)(*args, **kwargs)
+
+    def get_stats(self) -> Dict:
+        """Counts of S3 operations and cache hits since creation or reset"""
+        with self.lock:
+            return dict(self.stats)
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats.clear()
+
+    def ensure_bucket(self, bucket: str):
+        """Create the bucket unless it was seen within bucket_ttl"""
+        with self.lock:
+            checked = self.known_buckets.get(bucket)
+            if checked is not None and time.time() - checked < self.bucket_ttl:
+                self.stats["bucket_cache_hits"] += 1
+                return
+
+        if not self.call("bucket_exists", bucket):
+            self.create_bucket(bucket)
+
+        with self.lock:
+            self.known_buckets[bucket] = time.time()
+
+    def cache_presigned_url(self, key: tuple, url: str):
+        """Remember a presigned URL, dropping expired and then the oldest ones past max_presigned_urls"""
+        now = time.time()
+        with self.lock:
+            self.presigned_urls.pop(key, None)
+            self.presigned_urls[key] = (url, now)
+            if len(self.presigned_urls) <= self.max_presigned_urls:
+                return
+            for cached_key, (_, signed) in list(self.presigned_urls.items()):
+                if now - signed >= 0.9 * cached_key[2]:
+                    del self.presigned_urls[cached_key]
+            while len(self.presigned_urls) > self.max_presigned_urls:
+                del self.presigned_urls[next(iter(self.presigned_urls))]
+                self.stats["url_cache_evictions"] += 1
+
+    def invalidate_bucket(self, bucket: str):
+        with self.lock:
+            self.known_buckets.pop(bucket, None)
+            for key in [k for k in self.presigned_urls if k[0] == bucket]:
+                del self.presigned_urls[key]
 
     def list_buckets(self) -> List[Dict]:
         """List all buckets"""
         try:
-            buckets = self.client.list_buckets()
+            buckets = self.call("list_buckets")
             return [{"name": bucket.name, "creation_date": bucket.creation_date} for bucket in buckets]
         except S3Error as e:
             print(f"Error listing buckets: {e}")
             return []
 
-    def files(self, path_on_storage: str = "") -> List[Dict]:
-        """List all files in a bucket with optional prefix"""
+    def iter_files(self, prefix: str = "", start_after: str = None, bucket: str = None) -> Iterator[Dict]:
+        """
+        Stream the objects under a prefix in key order, one listing page at a
+        time. Pass the last name seen as start_after to resume a listing.
+        """
+        if not bucket:
+            bucket = self.bucket
+
+        objects = self.call("list_objects", bucket, prefix=prefix or None, recursive=True, start_after=start_after)
+        for obj in objects:
+            yield {
+                "name": obj.object_name,
+                "size": obj.size,
+                "last_modified": obj.last_modified,
+                "etag": obj.etag.strip('"') if obj.etag else None
+            }
+
+    def files(self, path_on_storage: str = "", limit: int = None) -> List[Dict]:
+        """List files in a bucket with optional prefix"""
         try:
-            objects = self.client.list_objects(self.bucket, prefix=path_on_storage, recursive=True)
             return [
-                {
-                    "name": obj.object_name,
-                    "size": obj.size,
-                    "last_modified": obj.last_modified,
-                    "url": self.get_file_url(obj.object_name)
-                }
-                for obj in objects
+                {**obj, "url": self.get_file_url(obj["name"])}
+                for obj in islice(self.iter_files(path_on_storage), limit)
             ]
         except S3Error as e:
             print(f"Error listing files: {e}")
@@ -69,8 +163,8 @@ class MinioStorageManager:
         
         try:
             # Check if bucket already exists
-            if not self.client.bucket_exists(bucket):
-                self.client.make_bucket(bucket)
+            if not self.call("bucket_exists", bucket):
+                self.call("make_bucket", bucket)
                 
                 # If public access is requested, set bucket policy
                 if public:
@@ -85,7 +179,7 @@ class MinioStorageManager:
                             }
                         ]
                     }
-                    self.client.set_bucket_policy(bucket, json.dumps(policy))
+                    self.call("set_bucket_policy", bucket, json.dumps(policy))
                 
                 return {"name": bucket, "status": "created"}
             return {"name": bucket, "status": "already exists"}
@@ -94,6 +188,33 @@ class MinioStorageManager:
             print(f"Error creating bucket: {e}")
             return {"name": bucket, "status": "error", "message": str(e)}
     
+    def expire_prefix(self, prefix: str, days: int, bucket: str = None) -> bool:
+        """
+        Add a lifecycle rule deleting objects under prefix once they are days
+        old. Other rules on the bucket are kept.
+        """
+        if not bucket:
+            bucket = self.bucket
+        rule_id = f"expire-{prefix.strip('/').replace('/', '-')}"
+
+        try:
+            self.ensure_bucket(bucket)
+            config = self.call("get_bucket_lifecycle", bucket)
+            rules = config.rules if config else []
+            for rule in rules:
+                if rule.rule_id == rule_id and rule.expiration and rule.expiration.days == days \
+                        and rule.rule_filter and rule.rule_filter.prefix == prefix:
+                    return True
+
+            rules = [rule for rule in rules if rule.rule_id != rule_id]
+            rules.append(Rule(ENABLED, rule_filter=Filter(prefix=prefix), rule_id=rule_id, expiration=Expiration(days=days)))
+            self.call("set_bucket_lifecycle", bucket, LifecycleConfig(rules))
+            return True
+
+        except S3Error as e:
+            print(f"Error setting lifecycle rule on {bucket}: {e}")
+            return False
+
     def upload_file_from_stream(
         self,
         file_stream,
@@ -105,7 +226,8 @@ class MinioStorageManager:
         file_size = file_stream.seek(0, os.SEEK_END)
         file_stream.seek(0)
 
-        self.client.put_object(
+        self.call(
+            "put_object",
             bucket_name=bucket,
             object_name=object_name,
             data=file_stream,
@@ -115,7 +237,8 @@ class MinioStorageManager:
     
     def get_file_url(self, object_name: str, bucket: str = None, expires: int = None) -> str:
         """
-        Get URL for a file. If expires is set, returns a presigned URL.
+        Get URL for a file. If expires is set, returns a presigned URL,
+        reusing a previously signed one until it is within 10% of expiry.
         Otherwise returns a public URL.
         """
         if not bucket:
@@ -123,12 +246,22 @@ class MinioStorageManager:
 
         try:
             if expires:
+                key = (bucket, object_name, expires)
+                with self.lock:
+                    cached = self.presigned_urls.get(key)
+                    if cached and time.time() - cached[1] < 0.9 * expires:
+                        self.stats["url_cache_hits"] += 1
+                        return cached[0]
+
                 # Get presigned URL for temporary access
-                return self.client.presigned_get_object(
+                url = self.call(
+                    "presigned_get_object",
                     bucket,
                     object_name,
-                    expires=expires
+                    expires=timedelta(seconds=expires)
                 )
+                self.cache_presigned_url(key, url)
+                return url
             else:
                 # Ensure the external endpoint is set and properly formatted
                 if not self.external_endpoint:
@@ -166,20 +299,23 @@ class MinioStorageManager:
 
         try:
             # Ensure bucket exists
-            if not self.client.bucket_exists(bucket):
-                self.create_bucket(bucket)
+            self.ensure_bucket(bucket)
 
             # If content_type is not provided, try to guess it
             if not content_type:
                 content_type, _ = mimetypes.guess_type(str(filepath))
 
-            # Upload the file
-            self.client.fput_object(
-                bucket,
-                path_on_storage,
-                str(filepath),
-                content_type=content_type
-            )
+            # Upload the file, splitting large ones into parallel parts
+            if self.multipart_threshold and os.path.getsize(filepath) >= self.multipart_threshold:
+                self.multipart.upload(filepath, bucket, path_on_storage, content_type)
+            else:
+                self.call(
+                    "fput_object",
+                    bucket,
+                    path_on_storage,
+                    str(filepath),
+                    content_type=content_type
+                )
 
             # Return the appropriate URL
             if make_public:
@@ -190,8 +326,75 @@ class MinioStorageManager:
 
         except S3Error as e:
             print(f"Error uploading file: {e}")
+            # the cached bucket state may be stale
+            self.invalidate_bucket(bucket)
             return None
 
+    def stored_objects(self, keys: List[str], bucket: str = None) -> Dict[str, Dict]:
+        """
+        Size and ETag of the given keys that exist in the bucket, found with
+        one listing per distinct prefix rather than a HEAD per key.
+        """
+        if not bucket:
+            bucket = self.bucket
+
+        prefixes = {key.rpartition("/")[0] for key in keys}
+        wanted = set(keys)
+        stored = {}
+        for prefix in prefixes:
+            try:
+                objects = self.call("list_objects", bucket, prefix=f"{prefix}/" if prefix else None)
+                for obj in objects:
+                    if obj.object_name in wanted:
+                        stored[obj.object_name] = {"size": obj.size, "etag": obj.etag.strip('"')}
+            except S3Error as e:
+                # a missing bucket simply means nothing is stored yet
+                if e.code != "NoSuchBucket":
+                    print(f"Error listing {prefix}: {e}")
+        return stored
+
+    def local_etag(self, filepath: Path, parts: int = 1) -> str:
+        """
+        The ETag S3 reports for this file's content when uploaded in the given
+        number of parts: the MD5 of the file, or for multipart uploads the MD5
+        of the part MD5s followed by the part count.
+        """
+        if parts <= 1:
+            md5 = hashlib.md5()
+            with open(filepath, "rb") as f:
+                while chunk := f.read(1024 * 1024):
+                    md5.update(chunk)
+            return md5.hexdigest()
+
+        size = os.path.getsize(filepath)
+        # our multipart engine and minio-py's fput_object (5 MiB parts) are
+        # the two ways objects get split
+        for part_size in (self.multipart.part_size, MIN_PART_SIZE):
+            if -(-size // part_size) != parts:
+                continue
+            digests = b""
+            with open(filepath, "rb") as f:
+                while chunk := f.read(part_size):
+                    digests += hashlib.md5(chunk).digest()
+            return f"{hashlib.md5(digests).hexdigest()}-{parts}"
+        return None
+
+    def unchanged_files(self, files: Dict[str, Path], bucket: str = None) -> set:
+        """Keys of files (key -> local path) whose stored object already has the same content"""
+        stored = self.stored_objects(list(files), bucket)
+        unchanged = set()
+        for key, obj in stored.items():
+            filepath = files[key]
+            if obj["size"] != os.path.getsize(filepath):
+                continue
+            _, _, parts = obj["etag"].partition("-")
+            if obj["etag"] == self.local_etag(filepath, int(parts or 1)):
+                unchanged.add(key)
+
+        with self.lock:
+            self.stats["dedup_hits"] += len(unchanged)
+        return unchanged
+
     # download: response = self.client.get_object(bucket, path_on_storage); response.data
 
     def download_file_to_disk(self, path_on_storage: str, local_path: Path, bucket: str = None) -> None:
@@ -199,7 +402,7 @@ class MinioStorageManager:
             bucket = self.bucket
 
         try:
-            self.client.fget_object(bucket, path_on_storage, str(local_path))
+            self.call("fget_object", bucket, path_on_storage, str(local_path))
             return True
         except S3Error as e:
             print(f"Error downloading file: {e}")
@@ -222,6 +425,10 @@ class MinioStorageManager:
     @staticmethod
     def resize_image(img_path, target_size=(512, 256)):
         """Resizes an image to a thumbnail while maintaining the aspect ratio"""
+        # only this helper needs them, the CLI starts without loading either
+        import numpy as np
+        from PIL import Image
+
         img = Image.open(str(img_path))
         w, h = img.size
         scale_factor = min(target_size[0] / w, target_size[1] / h)
@@ -237,7 +444,13 @@ if __name__ == '__main__':
     parser.add_argument('--create-bucket', type=str, help='Create a new bucket')
     parser.add_argument('--bucket', type=str, help='Default bucket for manager', default='test')
     parser.add_argument('--upload', type=str, help='Upload a file')
-    parser.add_argument('--list', action='store_true', help='List files in bucket')
+    parser.add_argument('--list', action='store_true', help='List panoramas in bucket from the local manifest')
+    parser.add_argument('--manifest', type=str, help='Manifest index path', default=None)
+    parser.add_argument('--refresh', type=int, help='Objects to read from the bucket before listing (-1 for a full pass)', default=0)
+    parser.add_argument('--prefix', type=str, help='Only list ids starting with this prefix', default='')
+    parser.add_argument('--has', type=str, nargs='*', help='Only list ids with these artifacts, e.g. animation.mp4')
+    parser.add_argument('--missing', type=str, nargs='*', help='Only list ids without these artifacts')
+    parser.add_argument('--limit', type=int, help='Maximum ids to list', default=50)
     args = parser.parse_args()
 
     # load from .env file
@@ -258,10 +471,21 @@ if __name__ == '__main__':
         print(f"Bucket {manager.bucket} created: {response}")
 
     if args.list:
-        files = manager.files()
-        print("Files in bucket:")
-        for file in files:
-            print(f"- {file['name']} ({file['size']} bytes) - {file['url']}")
+        from manifest_index import ManifestIndex
+
+        manifest_path = args.manifest or os.path.join(
+            os.environ.get('MANIFEST_DIR', '/tmp/manifests'), f"{args.bucket}.json"
+        )
+        index = ManifestIndex(manager, manifest_path, args.bucket)
+        if args.refresh or index.updated is None:
+            read = index.update(max_keys=None if args.refresh < 0 or index.updated is None else args.refresh)
+            print(f"Indexed {read} objects")
+
+        print(f"Panoramas in bucket: {index.summary()}")
+        start = time.perf_counter()
+        for entry in index.query(args.prefix, args.has, args.missing, limit=args.limit):
+            print(f"- {entry['id']} ({entry['size']} bytes, {entry['last_modified']}) {sorted(entry['artifacts'])}")
+        print(f"Query took {(time.perf_counter() - start) * 1000:.1f}ms")
 
     if args.upload:
         file_path = Path(args.upload)
@@ -0,0 +1,142 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from comfyui import ComfyUI
+from scripts.download_models import load_entries, resolve, download_file, ensure_directory
+
+
+class ModelManifest:
+    """
+    Knows which model files each workflow loads and fetches the missing ones
+    from custom_models.json in the background, the priority workflow's
+    models first, so a fresh node can serve that workflow before the rest
+    have arrived.
+
+    Files already under base_dir are ready immediately, without touching the
+    network. Entries without a "filename" are resolved with HEAD requests,
+    and only when something is missing. Models a workflow loads that no entry
+    provides are left to their loader node (some download on first use).
+    """
+
+    def __init__(self, workflows: dict, config: str = "custom_models.json", base_dir: str = "ComfyUI/models", workers: int = 4):
+        self.base_dir = base_dir
+        self.workers = workers
+        self.entries = load_entries(config)
+        self.required = {}
+        for key, path in workflows.items():
+            with open(path, "r") as file:
+                self.required[key] = ComfyUI.model_files(ComfyUI.load_workflow(file.read()))
+
+        self.ready = {
+            filename: threading.Event()
+            for files in self.required.values()
+            for filename in files
+        }
+        self.failed = set()
+        self.sources = {}  # filename -> (directory, url, filename, sha256)
+
+    def find(self, filename: str) -> str:
+        """Path of a model file if it is already under base_dir"""
+        for directory in os.listdir(self.base_dir) if os.path.isdir(self.base_dir) else []:
+            path = os.path.join(self.base_dir, directory, filename)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def start(self, priority: str = "base"):
+        """Mark what's on disk ready and download the rest in a background thread"""
+        missing = set()
+        for filename, event in self.ready.items():
+            if self.find(filename):
+                event.set()
+            else:
+                missing.add(filename)
+
+        print(f"Models: {len(self.ready) - len(missing)} on disk, {len(missing)} to fetch")
+        if missing:
+            thread = threading.Thread(target=self.fetch, args=(missing, priority), daemon=True)
+            thread.start()
+
+    def fetch(self, missing: set, priority: str):
+        try:
+            # learn the filenames of entries that don't declare one
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                names = pool.map(
+                    lambda entry: entry[2] or self.resolve_name(entry[1]),
+                    self.entries
+                )
+                for entry, filename in zip(self.entries, names):
+                    if filename:
+                        self.sources[filename] = (entry[0], entry[1], filename, entry[3])
+
+            for filename in missing - set(self.sources):
+                print(f"No download for {filename}, leaving it to its loader node")
+                self.ready[filename].set()
+
+            # priority workflow first, then the others, in parallel within each
+            first = [f for f in self.required.get(priority, []) if f in missing and f in self.sources]
+            rest = sorted(f for f in missing if f in self.sources and f not in first)
+            for group in (first, rest):
+                start_time = time.time()
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    list(pool.map(self.download, group))
+                if group:
+                    fetched = [f for f in group if f not in self.failed]
+                    print(f"Fetched {len(fetched)}/{len(group)} models in {time.time() - start_time:.0f}s: {fetched}")
+        except Exception as e:
+            print(f"Error fetching models: {e}")
+        finally:
+            # nothing waits forever on a model this thread won't fetch
+            for filename in missing:
+                if not self.ready[filename].is_set():
+                    self.failed.add(filename)
+                    self.ready[filename].set()
+
+    def resolve_name(self, url: str) -> str:
+        try:
+            return resolve(url)[1]
+        except Exception as e:
+            print(f"Error resolving {url}: {e}")
+            return None
+
+    def download(self, filename: str):
+        directory, url, filename, sha256 = self.sources[filename]
+        destination = os.path.join(self.base_dir, directory)
+        try:
+            ensure_directory(destination)
+            if download_file(url, destination, filename, sha256) is None:
+                self.failed.add(filename)
+        except Exception as e:
+            print(f"Error downloading {filename}: {e}")
+            self.failed.add(filename)
+        finally:
+            self.ready[filename].set()
+
+    def wait_for(self, workflow_key: str, timeout: float = None):
+        """Block until every model of a workflow is on disk"""
+        deadline = time.time() + timeout if timeout is not None else None
+        pending = [f for f in self.required[workflow_key] if not self.ready[f].is_set()]
+        if pending:
+            print(f"Waiting for models: {pending}")
+
+        for filename in self.required[workflow_key]:
+            remaining = None if deadline is None else max(0.0, deadline - time.time())
+            if not self.ready[filename].wait(remaining):
+                raise TimeoutError(f"Model {filename} for the {workflow_key} workflow is still downloading")
+            if filename in self.failed:
+                raise RuntimeError(f"Model {filename} for the {workflow_key} workflow failed to download")
+
+    def is_ready(self, workflow_key: str) -> bool:
+        return all(self.ready[f].is_set() and f not in self.failed for f in self.required[workflow_key])
+
+    def status(self) -> dict:
+        return {
+            key: {
+                "ready": self.is_ready(key),
+                "missing": [f for f in files if not self.ready[f].is_set()],
+                "failed": [f for f in files if f in self.failed]
+            }
+            for key, files in self.required.items()
+        }
@@ -0,0 +1,85 @@
+import os
+import time
+import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from minio.datatypes import Part
+
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3 minimum for every part but the last
+MAX_PARTS = 10000
+
+
+class MultipartUploader:
+    """
+    Uploads large files as S3 multipart uploads with parts sent concurrently.
+
+    Each part is read from disk by the worker that sends it, so memory stays
+    bounded by workers * part_size. Parts carry a Content-MD5 the server
+    verifies, the returned ETag is checked against the local MD5, and a failed
+    part is retried on its own with exponential backoff. If a part still fails
+    the whole upload is aborted so no orphaned parts are left behind.
+    """
+
+    def __init__(self, storage, part_size: int = 8 * 1024 * 1024, workers: int = 8, retries: int = 3, backoff: float = 0.5):
+        self.storage = storage
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+
+    def part_ranges(self, size: int):
+        """(part_number, offset, length) for each part of a file"""
+        part_size = max(self.part_size, -(-size // MAX_PARTS))
+        return [
+            (i + 1, offset, min(part_size, size - offset))
+            for i, offset in enumerate(range(0, size, part_size))
+        ]
+
+    def upload(self, filepath, bucket: str, object_name: str, content_type: str = None) -> str:
+        """Upload a file, returning the ETag of the completed object"""
+        size = os.path.getsize(filepath)
+        upload_id = self.storage.call(
+            "_create_multipart_upload",
+            bucket,
+            object_name,
+            {"Content-Type": content_type or "application/octet-stream"}
+        )
+
+        try:
+            with open(filepath, "rb") as f:
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    parts = list(pool.map(
+                        lambda part: self.upload_part(f.fileno(), bucket, object_name, upload_id, *part),
+                        self.part_ranges(size)
+                    ))
+
+            result = self.storage.call("_complete_multipart_upload", bucket, object_name, upload_id, parts)
+            return result.etag
+
+        except Exception:
+            try:
+                self.storage.call("_abort_multipart_upload", bucket, object_name, upload_id)
+            except Exception as e:
+                print(f"Failed to abort multipart upload of {object_name}: {e}")
+            raise
+
+    def upload_part(self, fd: int, bucket: str, object_name: str, upload_id: str, part_number: int, offset: int, length: int) -> Part:
+        data = os.pread(fd, length, offset)
+        md5 = hashlib.md5(data)
+        headers = {"Content-MD5": base64.b64encode(md5.digest()).decode()}
+
+        for attempt in range(self.retries + 1):
+            try:
+                etag = self.storage.call("_upload_part", bucket, object_name, data, headers, upload_id, part_number)
+                etag = etag.strip('"')
+                # SSE-KMS objects return ETags that aren't MD5s of the content
+                if len(etag) == 32 and etag != md5.hexdigest():
+                    raise ValueError(f"Checksum mismatch for part {part_number} of {object_name}")
+                return Part(part_number, etag)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                print(f"Retrying part {part_number} of {object_name} in {delay:.1f}s: {e}")
+                time.sleep(delay)
@@ -1,10 +1,16 @@
 import os
+import copy
 import json
+import time
 import shutil
-import tarfile
-import zipfile
+import asyncio
+import functools
+import importlib
+import threading
+import contextvars
+import concurrent.futures
 from concurrent.futures import ThreadPoolExecutor
-from typing import List
+from typing import Iterator
 import numpy as np
 
 # uncomment to run "cog predict ..."
@@ -15,16 +21,29 @@ import numpy as np
 from PIL import Image
 from cog import BasePredictor, Input, Path
 from comfyui import ComfyUI
+from comfyui_pool import ComfyUIPool
+from scheduler import AffinityScheduler
+from upload_spool import UploadSpool
+from download_cache import DownloadCache
+from metadata_catalog import MetadataCatalog
+from thumbnails import ThumbnailEngine
+from depth_format import DEPTH_FORMATS, load_depth, save_preview
+from input_ingest import InputIngester
+from model_manifest import ModelManifest
+from tracing import tracer
+from resource_sampler import ResourceSampler, parse_budgets
 
 from minio_manager import MinioStorageManager as CloudStorageManager
-from scripts.crop_animation import create_animation
-from scripts.embedding import ImageTextEmbedding
 
 OUTPUT_DIR = "/tmp/outputs"
 INPUT_DIR = "/tmp/inputs"
 ANIMATION_DIR = "/tmp/animation"
-COMFYUI_TEMP_OUTPUT_DIR = "ComfyUI/temp"
-ALL_DIRECTORIES = [OUTPUT_DIR, INPUT_DIR, COMFYUI_TEMP_OUTPUT_DIR]
+TILES_DIR = "/tmp/tiles"
+UPLOAD_SPOOL_DIR = "/tmp/upload_spool"
+DOWNLOAD_CACHE_DIR = "/tmp/download_cache"
+CATALOG_DIR = "/tmp/catalog"
+THUMBNAIL_WIDTHS = [int(w) for w in os.environ.get('THUMBNAIL_WIDTHS', '256,512,1024').split(',')]
+THUMBNAIL_WIDTH = 512  # served at the original {hash}/image_thumbnail.webp keys
 
 WORKFLOWS = {
     'base': os.environ.get('WORKFLOW_IMAGE', 'workflows/360-panorama-sdxl-depth.json'),
@@ -32,11 +51,110 @@ WORKFLOWS = {
     'upscale-input': os.environ.get('WORKFLOW_IMAGE_UPSCALE_INPUT', 'workflows/360-panorama-sdxl-input-upscale-inpaint-depth.json') # from id
 }
 
+# Sampler nodes seeded by the `seed` and `upscale_seed` inputs. Only these are
+# randomised; every other node keeps the template's inputs so ComfyUI can
+# reuse its cached outputs across requests
+BASE_SAMPLER_NODES = {
+    'base': '11',
+    'upscale': '169'
+}
+UPSCALE_SAMPLER_NODE = '38'
+
+# SaveImage injected after the base decode of the upscale workflow
+# so the 2:1 panorama can be delivered before UltimateSDUpscale finishes
+PREVIEW_NODE_ID = "171"
+PREVIEW_SOURCE_NODE_ID = "170"
+PREVIEW_PREFIX = "preview"
+
+# SaveDepthRaw (comfyui_nodes/depth_export) injected after the depth model
+# of each workflow to keep the full-precision depth map
+DEPTH_RAW_NODE_ID = "172"
+DEPTH_NODES = {'base': '23', 'upscale': '126', 'upscale-input': '126'}
+DEPTH_RAW_PREFIX = "depth_raw"
+
+# Intermediate images streamed with stream_progress, expired by a bucket
+# lifecycle rule after this many days (0 to keep them)
+PROGRESS_PREFIX = "progress/"
+PROGRESS_RETENTION_DAYS = int(os.environ.get('PROGRESS_RETENTION_DAYS', 1))
+
+# Default time budget for a request in seconds (0 for no limit), and the
+# smallest budget an upscale from a prompt needs before it is skipped
+WORKFLOW_TIMEOUT = float(os.environ.get('WORKFLOW_TIMEOUT', 0))
+UPSCALE_MIN_SECONDS = float(os.environ.get('UPSCALE_MIN_SECONDS', 60))
+
+# Modules only the background jobs need, imported on first use: embedding
+# pulls in torch and open_clip, crop_animation and tile_pyramid cv2 and
+# equilib. With PREWARM_IMPORTS they are loaded in a thread after setup
+BACKGROUND_MODULES = ['scripts.embedding', 'scripts.crop_animation', 'scripts.tile_pyramid']
+PREWARM_IMPORTS = os.environ.get('PREWARM_IMPORTS', '1') == '1'
+
+# peak limits that flag a request or job, e.g. "rss_mb=24000,gpu_memory_mb=22000"
+RESOURCE_BUDGETS = parse_budgets(os.environ.get('RESOURCE_BUDGETS', ''))
+
 BUCKETS = {
     'base': os.environ.get('BUCKET_IMAGE', '360-panorama-sdxl'),
     'upscale': os.environ.get('BUCKET_IMAGE_UPSCALE', '360-panorama-sdxl-upscale')
 }
 
+# predictions run concurrently (cog.yaml concurrency.max); each step of one
+# runs on these threads so the event loop stays free for the others
+PREDICT_STEPS = ThreadPoolExecutor(max_workers=32, thread_name_prefix="predict")
+
+
+def concurrent_predictions(function):
+    """
+    Run a generator predict method as the async generator cog needs to
+    accept concurrent predictions. Each step runs on a worker thread, in a
+    context of its own so spans carry over from one step to the next. The
+    generator is closed on a worker thread too, after any step in progress,
+    so its cleanup runs even when the client goes away.
+    """
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        context = contextvars.copy_context()
+        generator = context.run(function, *args, **kwargs)
+        done = object()
+        step = None
+        try:
+            while True:
+                step = PREDICT_STEPS.submit(context.run, next, generator, done)
+                item = await asyncio.wrap_future(step)
+                if item is done:
+                    return
+                yield item
+        finally:
+            def close():
+                if step is not None:
+                    concurrent.futures.wait([step])
+                context.run(generator.close)
+            await asyncio.wrap_future(PREDICT_STEPS.submit(close))
+    return wrapper
+
+
+def output_prefixes(wf, workflow_key):
+    """
+    filename_prefix of the SaveImage nodes writing the image and the depth
+    map, the latter being the one fed by the workflow's depth node
+    """
+    saves = {
+        node_id: node["inputs"] for node_id, node in wf.items()
+        if node["class_type"] == "SaveImage" and node_id != PREVIEW_NODE_ID
+    }
+    depth = next(inputs for inputs in saves.values() if inputs["images"][0] == DEPTH_NODES[workflow_key])
+    image = next(inputs for inputs in saves.values() if inputs is not depth)
+    return image["filename_prefix"], depth["filename_prefix"]
+
+
+def saved_file(files, directory, prefix):
+    """The file a SaveImage node with this filename_prefix wrote under directory"""
+    for f in files:
+        # ComfyUI names outputs {prefix}_{counter:05}_.png, relative to its
+        # output directory
+        if os.path.relpath(f, directory).startswith(f"{prefix}_"):
+            return f
+    raise Exception(f"No output saved with the filename prefix {prefix}")
+
+
 def cleanup_animation_thread(thread):
     """Helper function to join animation thread"""
     thread.join()
@@ -46,14 +164,30 @@ def cleanup_animation_thread(thread):
 class Predictor(BasePredictor):
 
     def setup(self):
-        self.comfyUI = ComfyUI("127.0.0.1:8188")
-        self.comfyUI.start_server(OUTPUT_DIR, INPUT_DIR)
+        # fetch missing models in the background, the base workflow's first;
+        # requests wait only for the models of their own workflow
+        self.models = ModelManifest(
+            WORKFLOWS,
+            os.environ.get('MODELS_CONFIG', 'custom_models.json'),
+            workers=int(os.environ.get('MODEL_DOWNLOAD_WORKERS', 4))
+        )
+        self.models.start(priority='base')
+
+        self.pool = ComfyUIPool(
+            size=int(os.environ.get('COMFYUI_BACKENDS', 1)),
+            output_directory=OUTPUT_DIR,
+            input_directory=INPUT_DIR,
+            base_port=int(os.environ.get('COMFYUI_BASE_PORT', 8188))
+        )
+        self.pool.start()
+        self.models.wait_for('base')
 
         self.cloud = CloudStorageManager(
             endpoint=os.environ['MINIO_ENDPOINT'],
             access_key=os.environ['MINIO_ACCESS_KEY'],
             secret_key=os.environ['MINIO_SECRET_KEY'],
-            external_endpoint=os.environ['MINIO_EXTERNAL_ENDPOINT']
+            external_endpoint=os.environ['MINIO_EXTERNAL_ENDPOINT'],
+            multipart_threshold=int(os.environ['MULTIPART_THRESHOLD_MB']) * 1024 * 1024 if os.environ.get('MULTIPART_THRESHOLD_MB') else None
         )
 
         try:
@@ -61,29 +195,110 @@ class Predictor(BasePredictor):
         except Exception as e:
             raise(f"Failed to connect to Minio: {e}\ntry adjusting environment variables")
 
-        self.executor = ThreadPoolExecutor(max_workers=3)
+        # durable write-behind uploads; replay anything a previous run left
+        self.spool = UploadSpool(
+            self.cloud,
+            os.environ.get('UPLOAD_SPOOL_DIR', UPLOAD_SPOOL_DIR),
+            workers=int(os.environ.get('UPLOAD_WORKERS', 4))
+        )
+        self.spool.replay()
+
+        self.ingester = InputIngester(
+            max_bytes=int(os.environ.get('INPUT_MAX_MB', 512)) * 1024 * 1024,
+            max_members=int(os.environ.get('INPUT_MAX_MEMBERS', 1000))
+        )
 
-    def handle_input_file(self, input_file: Path):
+        # inputs re-upscaled with different settings are served locally
+        self.downloads = DownloadCache(
+            self.cloud,
+            os.environ.get('DOWNLOAD_CACHE_DIR', DOWNLOAD_CACHE_DIR),
+            max_bytes=int(os.environ.get('DOWNLOAD_CACHE_MB', 2048)) * 1024 * 1024
+        )
+
+        self.thumbnails = ThumbnailEngine(sorted(set(THUMBNAIL_WIDTHS) | {THUMBNAIL_WIDTH}))
+
+        # queryable columnar copy of every bucket's metadata.json objects
+        self.catalogs = {
+            bucket: MetadataCatalog(
+                self.cloud,
+                os.path.join(os.environ.get('CATALOG_DIR', CATALOG_DIR), bucket),
+                bucket,
+                uploader=self.spool
+            )
+            for bucket in set(BUCKETS.values())
+        }
+
+        # intermediate images only matter while a request runs
+        if PROGRESS_RETENTION_DAYS > 0:
+            for bucket in set(BUCKETS.values()):
+                self.cloud.expire_prefix(PROGRESS_PREFIX, PROGRESS_RETENTION_DAYS, bucket)
+
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+        # memory, CPU, disk and GPU use of the predictor and ComfyUI servers
+        self.resources = ResourceSampler(
+            processes=lambda: [
+                backend.server_process.pid
+                for backend in self.pool.backends
+                if getattr(backend, 'server_process', None) is not None
+            ],
+            directories=[output for output, _ in self.pool.directories.values()] + [ANIMATION_DIR, TILES_DIR],
+            interval=float(os.environ.get('RESOURCE_SAMPLE_INTERVAL', 1.0)),
+            budgets=RESOURCE_BUDGETS
+        )
+
+        # stage timings as Prometheus histograms, on a port and/or in a file
+        tracer.metrics_file = os.environ.get('METRICS_FILE')
+        if os.environ.get('METRICS_PORT'):
+            tracer.serve(int(os.environ['METRICS_PORT']))
+        self.scheduler = AffinityScheduler(
+            max_batch=int(os.environ.get('SCHEDULER_MAX_BATCH', 4)),
+            max_wait=float(os.environ.get('SCHEDULER_MAX_WAIT', 60)),
+            capacity=len(self.pool)
+        )
+
+        if PREWARM_IMPORTS:
+            threading.Thread(target=self.prewarm_imports, daemon=True).start()
+
+    @staticmethod
+    def prewarm_imports():
+        """Import the background jobs' modules off the request path"""
+        for name in BACKGROUND_MODULES:
+            start = time.time()
+            try:
+                importlib.import_module(name)
+                print(f"Imported {name} in {time.time() - start:.2f}s")
+            except Exception as e:
+                print(f"Error importing {name}: {e}")
+
+    def handle_input_file(self, input_file: Path, comfyUI: ComfyUI, input_directory: str) -> Path:
+        """Place the input image (or an archive's images) in the input directory, returning the image to load"""
         file_extension = self.get_file_extension(input_file)
 
-        if file_extension == ".tar":
-            with tarfile.open(input_file, "r") as tar:
-                tar.extractall(INPUT_DIR)
-        elif file_extension == ".zip":
-            with zipfile.ZipFile(input_file, "r") as zip_ref:
-                zip_ref.extractall(INPUT_DIR)
+        if file_extension in [".tar", ".zip"]:
+            # the ingester counts per archive, so concurrent requests each get a copy
+            ingester = copy.copy(self.ingester)
+            images = ingester.ingest(input_file, file_extension, input_directory)
+            print(
+                f"Extracted {len(images)} images ({ingester.extracted_bytes} bytes) from "
+                f"{ingester.members} archive members, skipped {ingester.skipped}"
+            )
+            image = images[0]
         elif file_extension in [".jpg", ".jpeg", ".png", ".webp"]:
-            shutil.copy(input_file, os.path.join(INPUT_DIR, f"input{file_extension}"))
+            image = Path(os.path.join(input_directory, f"input{file_extension}"))
+            shutil.copy(input_file, image)
         else:
             raise ValueError(f"Unsupported file type: {file_extension}")
 
         print("====================================")
-        print(f"Inputs uploaded to {INPUT_DIR}:")
-        self.comfyUI.get_files(INPUT_DIR)
+        print(f"Input image: {image}")
         print("====================================")
+        return image
 
     def get_file_extension(self, input_file: Path) -> str:
         file_extension = os.path.splitext(input_file)[1].lower()
+        if file_extension in [".tgz", ".gz", ".bz2", ".xz"]:
+            file_extension = ".tar"
         if not file_extension:
             with open(input_file, "rb") as f:
                 file_signature = f.read(4)
@@ -102,6 +317,8 @@ class Predictor(BasePredictor):
                     )
         return file_extension
 
+    @concurrent_predictions
+    @tracer.traced("predict", root=True)
     def predict(
         self,
         input_file: Path = Input(
@@ -174,261 +391,447 @@ class Predictor(BasePredictor):
             description="Format of the output images",
             choices=["webp", "jpg", "png"],
             default="webp",
+        ),
+        progressive: bool = Input(
+            description="Upload the base panorama as a preview under the image id before upscaling finishes, then replace it with the upscaled result (upscale from prompt only)",
+            default=False,
+        ),
+        timeout: float = Input(
+            description="Seconds the request may take before the workflow is cancelled. Upscaling from a prompt is skipped when the budget is too small for it. 0 uses the server default",
+            default=0.0,
+        ),
+        depth_format: str = Input(
+            description="Full-precision depth artifact uploaded next to the 8-bit depth.webp preview: 16-bit PNG, or float16 with a range header",
+            choices=["webp", "png16", "float16"],
+            default="webp",
+        ),
+        stream_progress: bool = Input(
+            description="Yield JSON progress events (current node, sampler steps, intermediate images) before the final URLs",
+            default=False,
         )
-        ) -> List[str]:
+        ) -> Iterator[str]:
+
+        storage_calls = self.cloud.get_stats()
 
-        # clean up directories
-        self.comfyUI.cleanup(ALL_DIRECTORIES)
+        # deadline for the request, checked while waiting for models, a
+        # server, the input download and ComfyUI
+        timeout = timeout or WORKFLOW_TIMEOUT
+        deadline = time.time() + timeout if timeout > 0 else None
+
+        # degrade to the base workflow when an upscale can't fit the budget
+        degraded = False
+        if deadline and upscale_by > 1 and not (input_file or input_file_id) and timeout < UPSCALE_MIN_SECONDS:
+            print(f"Skipping upscale: {timeout:.0f}s budget is below {UPSCALE_MIN_SECONDS:.0f}s")
+            upscale_by = 0.0
+            degraded = True
 
         # load the workflow
-        if input_file:
-            EXAMPLE_WORKFLOW_JSON = WORKFLOWS['upscale-input']
+        if input_file or input_file_id:
+            workflow_key = 'upscale-input'
             bucket = BUCKETS['upscale']
-        elif input_file_id:
-            EXAMPLE_WORKFLOW_JSON = WORKFLOWS['upscale-input']
+        elif upscale_by > 1:
+            workflow_key = 'upscale'
             bucket = BUCKETS['upscale']
         else:
-            if upscale_by > 1:
-                EXAMPLE_WORKFLOW_JSON = WORKFLOWS['upscale']
-                bucket = BUCKETS['upscale']
-            else:
-                EXAMPLE_WORKFLOW_JSON = WORKFLOWS['base']
-                bucket = BUCKETS['base']
+            workflow_key = 'base'
+            bucket = BUCKETS['base']
+        EXAMPLE_WORKFLOW_JSON = WORKFLOWS[workflow_key]
+        tracer.label(workflow=workflow_key)
 
-        self.cloud.bucket = bucket
-        print(f"Using bucket: {self.cloud.bucket}")
+        print(f"Using bucket: {bucket}")
         print(f"Using workflow: {EXAMPLE_WORKFLOW_JSON}")
 
         # load the workflow
-        with open(EXAMPLE_WORKFLOW_JSON, "r") as file:
-            wf = self.comfyUI.load_workflow(json.loads(file.read()))
-
-        # handle input file
-        if input_file:
-            self.handle_input_file(input_file)
-
-            # Update the input file in the workflow JSON
-            wf['130']['inputs']['image'] = os.path.join(INPUT_DIR, f"input{os.path.splitext(input_file)[1]}")
-
-            # build the prompts
-            wf['6']['inputs']['text'] = prompt
-            wf['6']['inputs']['text'] += ", " + suffix_prompt
-            wf['7']['inputs']['text'] = negative_prompt
+        with tracer.span("workflow_load"), open(EXAMPLE_WORKFLOW_JSON, "r") as file:
+            wf = ComfyUI.load_workflow(json.loads(file.read()))
+
+        # a fresh node may still be downloading this workflow's models
+        with tracer.span("model_wait"):
+            self.models.wait_for(workflow_key, deadline - time.time() if deadline else None)
+
+        # wait for a turn, grouped with queued requests using the same models,
+        # then dispatch to the least-loaded ComfyUI server, preferring one that
+        # last ran the same workflow and models
+        schedule_key = self.scheduler.key(EXAMPLE_WORKFLOW_JSON, ComfyUI.model_files(wf))
+        executed = threading.Event()
+        # each request works in its own input/output subfolders, removed when
+        # it (and any background task reading its files) finishes
+        with self.scheduler.slot(schedule_key, deadline) as release_slot, \
+                self.pool.backend(schedule_key, executed) as comfyUI, comfyUI.request_context() as context, \
+                self.resources.track(f"predict {context.id}") as usage:
+            # handle input file
+            if input_file:
+                with tracer.span("input"):
+                    input_image = self.handle_input_file(input_file, comfyUI, context.input_directory)
+
+                # Update the input file in the workflow JSON
+                wf['130']['inputs']['image'] = str(input_image)
+
+                # build the prompts
+                wf['6']['inputs']['text'] = prompt
+                wf['6']['inputs']['text'] += ", " + suffix_prompt
+                wf['7']['inputs']['text'] = negative_prompt
         
-        # download image from cloud storage
-        elif input_file_id:
-            # build the path to image.webp
-            cloud_path = f"{input_file_id.strip('/')}/image.webp"
-
-            # download the input file from cloud storage
-            input_file = self.cloud.download_file_to_disk(cloud_path, f"{INPUT_DIR}/input.webp", BUCKETS['base'])
-
-            # Update the input file in the workflow JSON
-            wf['130']['inputs']['image'] = os.path.join(INPUT_DIR, f"input.webp")
-
-            # download + parse workflow
-            cloud_path = f"{input_file_id.strip('/')}/workflow.json"
-            self.cloud.download_file_to_disk(cloud_path, f"{INPUT_DIR}/workflow.json", BUCKETS['base'])
-
-            with open(f"{INPUT_DIR}/workflow.json", "r") as file:
-                wf_og = json.loads(file.read())
+            # download image from cloud storage
+            elif input_file_id:
+                # fetch the image and its workflow in parallel, reusing
+                # cached copies that are still current
+                base_id = input_file_id.strip('/')
+                with tracer.span("input"):
+                    fetched = self.downloads.fetch({
+                        f"{base_id}/image.webp": f"{context.input_directory}/input.webp",
+                        f"{base_id}/workflow.json": f"{context.input_directory}/workflow.json"
+                    }, BUCKETS['base'], deadline)
+                for cloud_path, ok in fetched.items():
+                    if not ok:
+                        raise ValueError(f"Could not download {cloud_path} from {BUCKETS['base']}")
+                print(f"Download cache: {self.downloads.get_stats()}")
+
+                # Update the input file in the workflow JSON
+                wf['130']['inputs']['image'] = os.path.join(context.input_directory, f"input.webp")
+
+                with open(f"{context.input_directory}/workflow.json", "r") as file:
+                    wf_og = json.loads(file.read())
             
-            # update the workflow using the original workflow
-            wf['6']['inputs']['text'] = wf_og['6']['inputs']['text'] # prompt
-            wf['7']['inputs']['text'] = wf_og['7']['inputs']['text'] # negative prompt
+                # update the workflow using the original workflow
+                wf['6']['inputs']['text'] = wf_og['6']['inputs']['text'] # prompt
+                wf['7']['inputs']['text'] = wf_og['7']['inputs']['text'] # negative prompt
 
-            # force upscaling
-            if upscale_by <= 1:
-                upscale_by = 2.0
-        else:
-            # build the prompts
-            wf['6']['inputs']['text'] = prompt
-            wf['6']['inputs']['text'] += ", " + suffix_prompt
-            wf['7']['inputs']['text'] = negative_prompt
-
-            # base generation settings
-            wf['11']['inputs']['cfg'] = cfg
-            wf['11']['inputs']['steps'] = steps
-            wf['11']['inputs']['sampler_name'] = sampler
-            wf['11']['inputs']['scheduler'] = scheduler
-    
-        # connect to comfyUI
-        self.comfyUI.connect()
-
-        # seed
-        self.comfyUI.randomise_seeds(wf)
-
-        if seed > 0:
-            # only use for base generation side
-            if EXAMPLE_WORKFLOW_JSON == WORKFLOWS['base']:
-                wf['11']['inputs']['seed'] = seed
-            elif EXAMPLE_WORKFLOW_JSON == WORKFLOWS['upscale']:
-                wf['7']['inputs']['seed'] = seed
-
-        # upscaling
-        if upscale_by > 1:
-            wf['38']['inputs']['upscale_by'] = upscale_by
-            wf['38']['inputs']['upscale_steps'] = upscale_steps
-            wf['38']['inputs']['sampler_name'] = upscale_sampler
-            wf['38']['inputs']['scheduler'] = upscale_scheduler
-            wf['38']['inputs']['denoise'] = upscale_denoise
-            
-            if upscale_seed > 0:
-                wf['38']['inputs']['seed'] = upscale_seed
-
-        # run the workflow
-        self.comfyUI.run_workflow(wf)
-
-        output_directories = [OUTPUT_DIR]
-
-        images = self.comfyUI.get_files(output_directories)
-
-        # convert images to webp
-        saved_images, sizes = self.optimize_images(images, output_format)
-
-        # back up images on cloud storage
-        image_hash = self.cloud.hash_file(saved_images[1])
-        if input_file_id:
-            image_hash = input_file_id.strip('/')
-
-        # upload image
-        try:
-            image_url = self.cloud.upload_file(saved_images[1], f"{image_hash}/image.webp", 'image/webp')
-            print(f"Image uploaded to: {image_url}")
-        except Exception as e:
-            print(f"Failed to upload image: {e}")
-
-            if 'duplicate' in str(e).lower():
-                image_url = self.cloud.get_file_url(f"{image_hash}/image.webp")
+                # force upscaling
+                if upscale_by <= 1:
+                    upscale_by = 2.0
             else:
-                image_url = None
-
-        #upload depth
-        try:
-            depth_url = self.cloud.upload_file(saved_images[0], f"{image_hash}/depth.webp", 'image/webp')
-            print(f"Depth uploaded to: {depth_url}")
-        except Exception as e:
-            print(f"Failed to upload depth image: {e}")
-
-            if 'duplicate' in str(e).lower():
-                depth_url = self.cloud.get_file_url(f"{image_hash}/depth.webp")
+                # build the prompts
+                wf['6']['inputs']['text'] = prompt
+                wf['6']['inputs']['text'] += ", " + suffix_prompt
+                wf['7']['inputs']['text'] = negative_prompt
+
+                # base generation settings
+                base_sampler = BASE_SAMPLER_NODES[workflow_key]
+                wf[base_sampler]['inputs']['cfg'] = cfg
+                wf[base_sampler]['inputs']['steps'] = steps
+                wf[base_sampler]['inputs']['sampler_name'] = sampler
+                wf[base_sampler]['inputs']['scheduler'] = scheduler
+    
+            # connect to comfyUI
+            context.connect()
+
+            # seed, randomising only the samplers without a requested seed
+            random_seed_nodes = []
+            if workflow_key in BASE_SAMPLER_NODES:
+                if seed > 0:
+                    wf[BASE_SAMPLER_NODES[workflow_key]]['inputs']['seed'] = seed
+                else:
+                    random_seed_nodes.append(BASE_SAMPLER_NODES[workflow_key])
+            if UPSCALE_SAMPLER_NODE in wf:
+                if upscale_seed > 0:
+                    wf[UPSCALE_SAMPLER_NODE]['inputs']['seed'] = upscale_seed
+                else:
+                    random_seed_nodes.append(UPSCALE_SAMPLER_NODE)
+            comfyUI.randomise_seeds(wf, random_seed_nodes)
+
+            # upscaling
+            if upscale_by > 1:
+                wf['38']['inputs']['upscale_by'] = upscale_by
+                wf['38']['inputs']['upscale_steps'] = upscale_steps
+                wf['38']['inputs']['sampler_name'] = upscale_sampler
+                wf['38']['inputs']['scheduler'] = upscale_scheduler
+                wf['38']['inputs']['denoise'] = upscale_denoise
+
+            # save the base panorama so it can be delivered early
+            progressive = progressive and workflow_key == 'upscale'
+            if progressive:
+                wf[PREVIEW_NODE_ID] = {
+                    "inputs": {
+                        "filename_prefix": f"{PREVIEW_PREFIX}/{PREVIEW_PREFIX}",
+                        "images": [PREVIEW_SOURCE_NODE_ID, 0]
+                    },
+                    "class_type": "SaveImage",
+                    "_meta": {"title": "Save Preview"}
+                }
+
+            if depth_format in DEPTH_FORMATS:
+                wf[DEPTH_RAW_NODE_ID] = {
+                    "inputs": {
+                        "filename_prefix": f"{DEPTH_RAW_PREFIX}/{DEPTH_RAW_PREFIX}",
+                        "images": [DEPTH_NODES[workflow_key], 0]
+                    },
+                    "class_type": "SaveDepthRaw",
+                    "_meta": {"title": "Save Depth (float16)"}
+                }
+
+            context.prepare_workflow(wf)
+
+            # run the workflow
+            preview = {}
+            cache_stats = {"cached_nodes": 0, "executed_nodes": 0}
+            # queued until ComfyUI reports the first node, then executing
+            queue_span = tracer.start("queue")
+            execution_span = None
+            for event in comfyUI.run_workflow_iter(wf, context, deadline):
+                if execution_span is None:
+                    tracer.finish(queue_span)
+                    execution_span = tracer.start("execution")
+                if event["type"] == "cached":
+                    cache_stats["cached_nodes"] += len(event["nodes"])
+                elif event["type"] == "executing":
+                    cache_stats["executed_nodes"] += 1
+
+                if progressive and event["type"] == "executed" and event["node"] == PREVIEW_NODE_ID:
+                    preview = self.publish_preview(
+                        Path(event["files"][0]), output_format, bucket,
+                        prompt=prompt, suffix_prompt=suffix_prompt, negative_prompt=negative_prompt,
+                        cfg=cfg, steps=steps, sampler=sampler, scheduler=scheduler,
+                        seed=wf[BASE_SAMPLER_NODES['upscale']]['inputs']['seed']
+                    )
+                    if stream_progress:
+                        yield json.dumps({"type": "preview", **preview})
+                elif stream_progress:
+                    yield self.progress_message(event, bucket)
+            tracer.finish(queue_span)
+            if execution_span is not None:
+                tracer.finish(execution_span)
+            # the next request can start on this server while this one finalizes
+            executed.set()
+            release_slot()
+            print(f"Cache: {cache_stats['cached_nodes']} nodes cached, {cache_stats['executed_nodes']} executed")
+
+            finalize_span = tracer.start("finalize")
+            output_directories = [context.output_directory]
+
+            images = comfyUI.get_files(output_directories)
+            raw_depths = [f for f in images if f.parent.name == DEPTH_RAW_PREFIX]
+            image_prefix, depth_prefix = output_prefixes(wf, workflow_key)
+            image_file = saved_file(images, comfyUI.output_directory, image_prefix)
+
+            depth_data = None
+            if raw_depths:
+                # encode the depth artifact and its preview from the float
+                # data rather than re-encoding the 8-bit SaveImage output
+                depth = load_depth(raw_depths[0])
+                extension, write_depth, depth_content_type = DEPTH_FORMATS[depth_format]
+                depth_data = (Path(f"{context.output_directory}/depth{extension}"), depth_content_type)
+                depth_range = write_depth(depth, depth_data[0])
+
+                depth_preview = Path(f"{context.output_directory}/depth_preview.webp")
+                save_preview(depth, depth_preview)
+                (saved_image,), (image_size,) = self.optimize_images([image_file], output_format)
+                saved_depth = depth_preview
             else:
-                depth_url = None
-
-        # create thumbnails
-        image_thumbnail = self.cloud.resize_image(saved_images[1])
-        
-        # Save the resized image
-        Image.fromarray(image_thumbnail).save('image_thumbnail.webp', format='WEBP')
-
-        try:
-            thumbnail_url = self.cloud.upload_file('image_thumbnail.webp', f"{image_hash}/image_thumbnail.webp", 'image/webp')
-            print(f"Thumbnail uploaded to: {thumbnail_url}")
-        except Exception as e:
-            print(f"Failed to upload thumbnail: {e}")
-
-            if 'duplicate' in str(e).lower():
-                thumbnail_url = self.cloud.get_file_url(f"{image_hash}/image_thumbnail.webp")
+                # convert images to webp
+                depth_file = saved_file(images, comfyUI.output_directory, depth_prefix)
+                (saved_depth, saved_image), (_, image_size) = self.optimize_images([depth_file, image_file], output_format)
+
+            # back up images on cloud storage
+            image_hash = self.cloud.hash_file(saved_image)
+            if input_file_id:
+                image_hash = input_file_id.strip('/')
+            elif preview.get("id"):
+                # the preview already lives under the hash of the base image
+                image_hash = preview["id"]
+
+            # create every thumbnail size from one decode of each image
+            thumbnails = {
+                "image": self.thumbnails.generate(saved_image, context.output_directory, "image"),
+                "depth": self.thumbnails.generate(saved_depth, context.output_directory, "depth")
+            }
+
+            with open(f"{context.output_directory}/workflow.json", "w") as file:
+                file.write(json.dumps(wf, indent=4))
+
+            # URLs are deterministic, so the metadata can reference them
+            # before anything is uploaded
+            artifacts = {
+                "image": (saved_image, f"{image_hash}/image.webp", 'image/webp'),
+                "depth": (saved_depth, f"{image_hash}/depth.webp", 'image/webp'),
+                # the default size also keeps its original unsuffixed key
+                "thumbnail": (thumbnails["image"][THUMBNAIL_WIDTH]["path"], f"{image_hash}/image_thumbnail.webp", 'image/webp'),
+                "depth_thumbnail": (thumbnails["depth"][THUMBNAIL_WIDTH]["path"], f"{image_hash}/depth_thumbnail.webp", 'image/webp'),
+                "workflow": (f"{context.output_directory}/workflow.json", f"{image_hash}/workflow.json", 'application/json'),
+            }
+            image_url, depth_url, thumbnail_url, depth_thumbnail_url, workflow_url = [
+                self.spool.file_url(key, bucket) for _, key, _ in artifacts.values()
+            ]
+            if depth_data:
+                artifacts["depth_data"] = (depth_data[0], f"{image_hash}/{depth_data[0].name}", depth_data[1])
+            for name, sizes_by_width in thumbnails.items():
+                for width, thumbnail in sizes_by_width.items():
+                    key = f"{image_hash}/{thumbnail['path'].name}"
+                    artifacts[f"{name}_thumbnail_{width}"] = (thumbnail["path"], key, 'image/webp')
+                    thumbnail["url"] = self.spool.file_url(key, bucket)
+                    del thumbnail["path"]
+
+            # create a metadata json
+            metadata = {
+                "id": image_hash,
+                "width": image_size[0],
+                "height": image_size[1],
+                "prompt": prompt,
+                "suffix_prompt": suffix_prompt,
+                "negative_prompt": negative_prompt,
+                "cfg": cfg,
+                "steps": steps,
+                "sampler": sampler,
+                "scheduler": scheduler,
+                "upscale_by": upscale_by,
+                "upscale_steps": upscale_steps,
+                "upscale_sampler": upscale_sampler,
+                "upscale_scheduler": upscale_scheduler,
+                "upscale_denoise": upscale_denoise,
+                "upscale_seed": wf.get('38', {}).get('inputs', {}).get('seed', -1),
+                "output_format": output_format,
+                "image_url": image_url,
+                "depth_url": depth_url,
+                "thumbnail_url": thumbnail_url,
+                "depth_thumbnail_url": depth_thumbnail_url,
+                "depth_format": depth_format if depth_data else "webp",
+                "depth_data_url": self.spool.file_url(artifacts["depth_data"][1], bucket) if depth_data else None,
+                "depth_range": depth_range if depth_data else None,
+                "thumbnails": thumbnails["image"],
+                "depth_thumbnails": thumbnails["depth"],
+                "workflow_url": workflow_url,
+                # written by a background task shortly after the prediction
+                "tiles_url": self.spool.file_url(f"{image_hash}/tiles/manifest.json", bucket) if workflow_key in ('upscale', 'upscale-input') else None,
+                "preview": False,
+                "degraded": degraded,
+                **cache_stats
+            }
+
+            # grab seeds for base generation
+            if workflow_key in BASE_SAMPLER_NODES:
+                metadata['seed'] = wf[BASE_SAMPLER_NODES[workflow_key]]['inputs']['seed']
             else:
-                thumbnail_url = None
-
-        # depth thumbnail
-        depth_thumbnail = self.cloud.resize_image(saved_images[0])
-
-        # Save the resized image
-        Image.fromarray(depth_thumbnail).save('depth_thumbnail.webp', format='WEBP')
-
-        try:
-            depth_thumbnail_url = self.cloud.upload_file('depth_thumbnail.webp', f"{image_hash}/depth_thumbnail.webp", 'image/webp')
-            print(f"Depth thumbnail uploaded to: {depth_thumbnail_url}")
-        except Exception as e:            
-            print(f"Failed to upload depth thumbnail: {e}")
-
-            if 'duplicate' in str(e).lower():
-                depth_thumbnail_url = self.cloud.get_file_url(f"{image_hash}/depth_thumbnail.webp")
-            else:
-                depth_thumbnail_url = None
+                metadata['seed'] = -1
+
+            # stages finished so far, the uploads and background tasks go on
+            tracer.finish(finalize_span)
+            trace = tracer.current_trace()
+            metadata['timings'] = trace.summary() if trace is not None else {}
+            metadata['resources'] = usage.summary()
+
+            with open(f"{context.output_directory}/metadata.json", "w") as file:
+                file.write(json.dumps(metadata, indent=4))
+
+            self.catalog_metadata(metadata, bucket)
+            artifacts["metadata"] = (f"{context.output_directory}/metadata.json", f"{image_hash}/metadata.json", 'application/json')
+
+            # upload everything whose content isn't already stored, which
+            # for reprocessed inputs is usually only what changed
+            with tracer.span("upload_spool"):
+                urls = self.spool.upload_files(
+                    {key: (path, content_type) for path, key, content_type in artifacts.values()},
+                    bucket
+                )
+            for name, (_, key, _) in artifacts.items():
+                print(f"{name.replace('_', ' ').capitalize()} spooled for upload to: {urls[key]}")
+            metadata_url = urls[artifacts["metadata"][1]]
 
-        # save to same directory as saved_images[0]
-        with open(f"{saved_images[0].parent}/workflow.json", "w") as file:
-            file.write(json.dumps(wf, indent=4))
+            # create animations if upscale_by > 1
+            if workflow_key in ('upscale', 'upscale-input'):
 
+                # Create embeddings in background
+                future_embedding = tracer.submit(
+                    self.executor, self.run_background, "embedding", self.create_embeddings_background,
+                    str(saved_image), prompt, image_hash, self.spool, bucket
+                )
+                future_animation = tracer.submit(
+                    self.executor, self.run_background, "animation", self.create_animation_background,
+                    str(saved_image), image_hash, self.spool, bucket
+                )
+                future_tiles = tracer.submit(
+                    self.executor, self.run_background, "tiles", self.create_tiles_background,
+                    str(saved_image), image_hash, self.spool, bucket
+                )
+                context.cleanup_after([future_embedding, future_animation, future_tiles])
+
+            storage_calls = {
+                op: count - storage_calls.get(op, 0)
+                for op, count in self.cloud.get_stats().items()
+                if count != storage_calls.get(op, 0)
+            }
+            print(f"Storage calls: {storage_calls}")
+
+            yield depth_url
+            yield image_url
+            yield metadata_url
+
+    def run_background(self, name: str, function, *args):
+        """Run a background task in its own resource window"""
+        with self.resources.track(name) as usage:
+            result = function(*args)
+        print(f"{name.capitalize()} resources: {usage.summary()}")
+        return result
+
+    @tracer.traced("catalog")
+    def catalog_metadata(self, metadata: dict, bucket: str):
+        """Add metadata to the bucket's catalog without failing the prediction"""
         try:
-            workflow_url = self.cloud.upload_file(f"{saved_images[0].parent}/workflow.json", f"{image_hash}/workflow.json", 'application/json')
-            print(f"Workflow uploaded to: {workflow_url}")
+            self.catalogs[bucket].append(metadata)
         except Exception as e:
-            print(f"Failed to upload workflow: {e}")
-
-            if 'duplicate' in str(e).lower():
-                workflow_url = self.cloud.get_file_url(f"{image_hash}/workflow.json")
-            else:
-                workflow_url = None
-
-        # create a metadata json
-        metadata = {
-            "id": image_hash,
-            "width": sizes[1][0], # first is depth, second is rgb
-            "height": sizes[1][1],
-            "prompt": prompt,
-            "suffix_prompt": suffix_prompt,
-            "negative_prompt": negative_prompt,
-            "cfg": cfg,
-            "steps": steps,
-            "sampler": sampler,
-            "scheduler": scheduler,
-            "upscale_by": upscale_by,
-            "upscale_steps": upscale_steps,
-            "upscale_sampler": upscale_sampler,
-            "upscale_scheduler": upscale_scheduler,
-            "upscale_denoise": upscale_denoise,
-            "upscale_seed": wf.get('38', {}).get('inputs', {}).get('seed', -1),
-            "output_format": output_format,
-            "image_url": image_url,
-            "depth_url": depth_url,
-            "thumbnail_url": thumbnail_url,
-            "depth_thumbnail_url": depth_thumbnail_url,
-            "workflow_url": workflow_url
-        }
-
-        # grab seeds for base generation
-        if EXAMPLE_WORKFLOW_JSON == WORKFLOWS['upscale']:
-            metadata['seed'] = wf['97']['inputs']['seed']
-        elif EXAMPLE_WORKFLOW_JSON == WORKFLOWS['base']:
-            metadata['seed'] = wf['11']['inputs']['seed']
-        else:
-            metadata['seed'] = -1
-
-        with open(f"{saved_images[0].parent}/metadata.json", "w") as file:
-            file.write(json.dumps(metadata, indent=4))
+            print(f"Error cataloging metadata: {e}")
 
+    @tracer.traced("preview")
+    def publish_preview(self, preview_path: Path, output_format: str, bucket: str, **settings) -> dict:
+        """
+        Upload the base panorama and its thumbnail under the hash of the base
+        image, with metadata marked as a preview. The upscaled result is
+        uploaded to the same keys once it lands, replacing the preview.
+        """
         try:
-            metadata_url = self.cloud.upload_file(f"{saved_images[0].parent}/metadata.json", f"{image_hash}/metadata.json", 'application/json')
-            print(f"Metadata uploaded to: {metadata_url}")
+            saved, sizes = self.optimize_images([preview_path], output_format)
+            image_hash = self.cloud.hash_file(saved[0])
+
+            image_url = self.cloud.upload_file(saved[0], f"{image_hash}/image.webp", 'image/webp', bucket=bucket)
+
+            thumbnail_path = self.thumbnails.generate(saved[0], preview_path.parent, "preview")[THUMBNAIL_WIDTH]["path"]
+            thumbnail_url = self.cloud.upload_file(thumbnail_path, f"{image_hash}/image_thumbnail.webp", 'image/webp', bucket=bucket)
+
+            metadata = {
+                "id": image_hash,
+                "width": sizes[0][0],
+                "height": sizes[0][1],
+                **settings,
+                "output_format": output_format,
+                "image_url": image_url,
+                "thumbnail_url": thumbnail_url,
+                "preview": True
+            }
+            metadata_path = preview_path.parent / "metadata.json"
+            with open(metadata_path, "w") as file:
+                file.write(json.dumps(metadata, indent=4))
+            metadata_url = self.cloud.upload_file(metadata_path, f"{image_hash}/metadata.json", 'application/json', bucket=bucket)
+            self.catalog_metadata(metadata, bucket)
+            print(f"Preview uploaded to: {image_url}")
+
+            return {"id": image_hash, "image_url": image_url, "thumbnail_url": thumbnail_url, "metadata_url": metadata_url}
         except Exception as e:
-            print(f"Failed to upload metadata: {e}")
-
-            if 'duplicate' in str(e).lower():
-                metadata_url = self.cloud.get_file_url(f"{image_hash}/metadata.json")
-            else:
-                metadata_url = None
-
-        # create animations if upscale_by > 1
-        if EXAMPLE_WORKFLOW_JSON == WORKFLOWS['upscale'] or EXAMPLE_WORKFLOW_JSON == WORKFLOWS['upscale-input']:
-
-            # Create embeddings in background
-            future_embedding = self.executor.submit(
-                self.create_embeddings_background, 
-                str(saved_images[1]), prompt, image_hash, self.cloud
-            )
-            future_animation = self.executor.submit(
-                self.create_animation_background,
-                str(saved_images[1]), image_hash, self.cloud
-            )
+            print(f"Failed to upload preview: {e}")
+            return {}
 
-        return [depth_url, image_url, metadata_url]
+    def progress_message(self, event: dict, bucket: str) -> str:
+        """
+        Serialize a ComfyUI progress event for the output stream.
+        Images saved by intermediate nodes are uploaded before their event
+        is streamed, so clients get a URL that already resolves as soon as
+        each SaveImage node completes (None if the upload failed). The
+        bucket's lifecycle rule deletes them after PROGRESS_RETENTION_DAYS.
+        """
+        if event["type"] == "executed":
+            event = dict(event)
+            files = event.pop("files")
+            event["urls"] = []
+            for file in files:
+                try:
+                    url = self.cloud.upload_file(file, f"{PROGRESS_PREFIX}{event['prompt_id']}/{os.path.basename(file)}", bucket=bucket)
+                except Exception as e:
+                    print(f"Failed to upload intermediate image: {e}")
+                    url = None
+                event["urls"].append(url)
+        return json.dumps(event)
 
-    @staticmethod 
-    def create_embeddings_background(image_path: str, prompt: str, image_hash: str, cloud_manager):
+    @staticmethod
+    @tracer.traced("embedding")
+    def create_embeddings_background(image_path: str, prompt: str, image_hash: str, cloud_manager, bucket: str = None):
         """
         Background task to create and upload CLIP embeddings for the image and prompt.
         Takes multiple perspective crops (front, back, up, down) from the equirectangular image.
@@ -437,9 +840,11 @@ class Predictor(BasePredictor):
             image_path (str): Path to the input equirectangular image
             prompt (str): Text prompt used to generate the image
             image_hash (str): Hash/ID of the image
-            cloud_manager: Instance of CloudStorageManager
+            cloud_manager: CloudStorageManager or UploadSpool to upload with
+            bucket (str): Bucket to upload to
         """
         try:
+            from scripts.embedding import ImageTextEmbedding
 
             # Initialize CLIP model
             embedding_model = ImageTextEmbedding()
@@ -470,7 +875,8 @@ class Predictor(BasePredictor):
                 embeddings_url = cloud_manager.upload_file(
                     temp_path,
                     f"{image_hash}/embeddings.npy",
-                    'application/octet-stream'
+                    'application/octet-stream',
+                    bucket=bucket
                 )
                 print(f"Embeddings uploaded to: {embeddings_url}")
             except Exception as e:
@@ -485,16 +891,20 @@ class Predictor(BasePredictor):
             traceback.print_exc()
 
     @staticmethod
-    def create_animation_background(image_path, image_hash, cloud_manager):
+    @tracer.traced("animation")
+    def create_animation_background(image_path, image_hash, cloud_manager, bucket=None):
         """
         Background task to create and upload animation files.
         
         Args:
             image_path (str): Path to the input image
             image_hash (str): Hash/ID of the image
-            cloud_manager: Instance of CloudStorageManager
+            cloud_manager: CloudStorageManager or UploadSpool to upload with
+            bucket (str): Bucket to upload to
         """
         try:
+            from scripts.crop_animation import create_animation
+
             # Create temporary directory for animation
             animation_dir = os.path.join(ANIMATION_DIR, f"animation_{image_hash}")
             os.makedirs(animation_dir, exist_ok=True)
@@ -519,7 +929,8 @@ class Predictor(BasePredictor):
                     mp4_url = cloud_manager.upload_file(
                         mp4_path, 
                         f"{image_hash}/animation.mp4",
-                        'video/mp4'
+                        'video/mp4',
+                        bucket=bucket
                     )
                     print(f"Animation MP4 uploaded to: {mp4_url}")
 
@@ -532,6 +943,45 @@ class Predictor(BasePredictor):
         except Exception as e:
             print(f"Failed to create animation: {e}")
 
+    @staticmethod
+    @tracer.traced("tiles")
+    def create_tiles_background(image_path, image_hash, cloud_manager, bucket=None):
+        """
+        Background task to cut the panorama into a cube-map tile pyramid and
+        upload it under {image_hash}/tiles/.
+
+        Args:
+            image_path (str): Path to the input image
+            image_hash (str): Hash/ID of the image
+            cloud_manager: UploadSpool to upload with
+            bucket (str): Bucket to upload to
+        """
+        tiles_dir = os.path.join(TILES_DIR, f"tiles_{image_hash}")
+        try:
+            from scripts.tile_pyramid import create_tile_pyramid
+
+            manifest = create_tile_pyramid(input_path=image_path, output_dir=tiles_dir)
+
+            # tiles are checked for existing copies in one batch per level
+            files = {
+                f"{image_hash}/tiles/{path}": (os.path.join(tiles_dir, path), 'image/webp')
+                for path in manifest["tiles"]
+            }
+            cloud_manager.upload_files(files, bucket)
+            manifest_url = cloud_manager.upload_file(
+                os.path.join(tiles_dir, "manifest.json"),
+                f"{image_hash}/tiles/manifest.json",
+                'application/json',
+                bucket=bucket
+            )
+            print(f"Tile pyramid uploaded to: {manifest_url}")
+
+        except Exception as e:
+            print(f"Failed to create tiles: {e}")
+
+        finally:
+            shutil.rmtree(tiles_dir, ignore_errors=True)
+
     # Add batch processing for images
     def optimize_images(self, images, output_format):
         results = []
@@ -0,0 +1,231 @@
+import os
+import sys
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import psutil
+
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
+
+
+def directory_size(path: str) -> int:
+    """Bytes used by the files under a directory"""
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+                elif entry.is_dir(follow_symlinks=False):
+                    total += directory_size(entry.path)
+    except OSError:
+        pass
+    return total
+
+
+def parse_budgets(value: str) -> dict:
+    """
+    Limits from "metric=limit,..." (e.g. "rss_mb=24000,gpu_memory_mb=22000"),
+    skipping malformed entries with a warning
+    """
+    budgets = {}
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        metric, _, limit = item.partition("=")
+        try:
+            if not metric.strip():
+                raise ValueError("no metric")
+            budgets[metric.strip()] = float(limit)
+        except ValueError:
+            print(f"Warning: ignoring resource budget {item!r}, expected metric=limit")
+    return budgets
+
+
+class Usage:
+    """Peak and mean of every metric sampled while a request or job ran"""
+
+    def __init__(self, name):
+        self.name = name
+        self.peak = {}
+        self.total = {}
+        self.count = {}
+        self.start = time.time()
+        self.end = None
+        self.exceeded = []
+
+    def add(self, sample: dict):
+        for metric, value in sample.items():
+            if value is None:
+                continue
+            self.peak[metric] = max(self.peak.get(metric, value), value)
+            self.total[metric] = self.total.get(metric, 0) + value
+            self.count[metric] = self.count.get(metric, 0) + 1
+
+    def summary(self) -> dict:
+        return {
+            "peak": {metric: round(value, 1) for metric, value in self.peak.items()},
+            "mean": {metric: round(self.total[metric] / self.count[metric], 1) for metric in self.total},
+            "seconds": round((self.end or time.time()) - self.start, 3),
+            "exceeded": self.exceeded,
+        }
+
+
+class ResourceSampler:
+    """
+    Samples memory, CPU, disk and GPU use from a daemon thread every
+    `interval` seconds. It records:
+    - predictor_rss_mb: this process
+    - comfyui_rss_mb: the process trees of the pids `processes` returns
+    - rss_mb: the sum of the two
+    - cpu_percent: across those processes
+    - disk_mb: files under `directories`
+    - gpu_memory_mb: from NVML, or torch if it is already loaded
+
+    track() opens a window for a request or background job. The window
+    gets the peak and mean of every sample taken while it is open. A
+    window whose peak crosses one of `budgets` (metric -> limit) is
+    flagged and logged. Metrics a machine can't measure are left out, so
+    CPU-only nodes simply have no GPU figures.
+    """
+
+    def __init__(self, processes=None, directories=(), interval: float = 1.0, budgets: dict = None, history: int = 100):
+        self.processes = processes or (lambda: [])
+        self.directories = list(directories)
+        self.interval = interval
+        self.budgets = budgets or {}
+
+        self.lock = threading.Lock()
+        self.sample_lock = threading.Lock()
+        self.windows = set()
+        self.recent = deque(maxlen=history)  # finished windows, newest last
+        self.process_cache = {}  # pid -> psutil.Process, keeps cpu_percent state
+        self.last = (0.0, {})  # time and values of the latest sample
+        self.own_process = psutil.Process()
+        self.own_process.cpu_percent()
+
+        self.gpu_handles = []
+        if pynvml is not None:
+            try:
+                pynvml.nvmlInit()
+                self.gpu_handles = [pynvml.nvmlDeviceGetHandleByIndex(i) for i in range(pynvml.nvmlDeviceGetCount())]
+            except Exception as e:
+                print(f"GPU memory sampling unavailable: {e}")
+
+        self.stopped = threading.Event()
+        if interval > 0:
+            threading.Thread(target=self.run, daemon=True).start()
+
+    def process(self, pid: int) -> psutil.Process:
+        process = self.process_cache.get(pid)
+        if process is None:
+            process = self.process_cache[pid] = psutil.Process(pid)
+            process.cpu_percent()
+        return process
+
+    def process_tree(self, pid: int) -> tuple:
+        """RSS in bytes and CPU% of a process and its children"""
+        rss, cpu = 0, 0.0
+        try:
+            root = self.process(pid)
+            for process in [root] + root.children(recursive=True):
+                process = self.process(process.pid)
+                rss += process.memory_info().rss
+                cpu += process.cpu_percent()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            self.process_cache.pop(pid, None)
+        return rss, cpu
+
+    def gpu_memory(self):
+        if self.gpu_handles:
+            try:
+                return sum(pynvml.nvmlDeviceGetMemoryInfo(handle).used for handle in self.gpu_handles)
+            except Exception:
+                return None
+        # only if something else already paid for importing torch
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            return sum(torch.cuda.memory_reserved(i) for i in range(torch.cuda.device_count()))
+        return None
+
+    def sample(self) -> dict:
+        mb = 1024 * 1024
+        predictor_rss = self.own_process.memory_info().rss
+        cpu = self.own_process.cpu_percent()
+        comfyui_rss = 0
+        for pid in self.processes():
+            rss, process_cpu = self.process_tree(pid)
+            comfyui_rss += rss
+            cpu += process_cpu
+
+        gpu = self.gpu_memory()
+        return {
+            "predictor_rss_mb": predictor_rss / mb,
+            "comfyui_rss_mb": comfyui_rss / mb,
+            "rss_mb": (predictor_rss + comfyui_rss) / mb,
+            "cpu_percent": cpu,
+            "disk_mb": sum(directory_size(directory) for directory in self.directories) / mb,
+            "gpu_memory_mb": gpu / mb if gpu is not None else None,
+        }
+
+    def record(self):
+        with self.lock:
+            windows = list(self.windows)
+        if not windows:
+            return
+        # a sample from moments ago is reused, CPU% over a tiny interval is noise
+        with self.sample_lock:
+            sampled_at, sample = self.last
+            if time.time() - sampled_at > self.interval / 2:
+                try:
+                    sample = self.sample()
+                except Exception as e:
+                    print(f"Resource sampling failed: {e}")
+                    return
+                self.last = (time.time(), sample)
+        for usage in windows:
+            usage.add(sample)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.record()
+
+    @contextmanager
+    def track(self, name: str):
+        """Open a window over a request or job, sampled once more at each end"""
+        usage = Usage(name)
+        with self.lock:
+            self.windows.add(usage)
+        self.record()
+        try:
+            yield usage
+        finally:
+            self.record()
+            with self.lock:
+                self.windows.discard(usage)
+            usage.end = time.time()
+            self.check_budgets(usage)
+            with self.lock:
+                self.recent.append((name, usage.summary()))
+
+    def check_budgets(self, usage: Usage):
+        usage.exceeded = [
+            metric for metric, limit in self.budgets.items()
+            if usage.peak.get(metric, 0) > limit
+        ]
+        if usage.exceeded:
+            details = ", ".join(f"{metric} {usage.peak[metric]:.0f} > {self.budgets[metric]:.0f}" for metric in usage.exceeded)
+            print(f"{usage.name} exceeded its resource budget: {details}")
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {"active": [usage.name for usage in self.windows], "recent": list(self.recent)}
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Compare depth artifact formats on a synthetic panorama depth map.
+
+The current path quantizes to an 8-bit PNG (what SaveImage writes) and
+re-encodes it as WebP quality 99. It is measured against the 16-bit PNG and
+float16 containers from depth_format.py and the 8-bit preview. The report
+gives size, encode and decode time, and the worst error against the float
+depth:
+
+    python scripts/benchmark_depth.py --width 4096 --height 2048
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import depth_format
+from depth_format import save_png16, save_float16, save_preview, read_depth
+
+
+def synthetic_depth(width, height):
+    """Smooth depth with sharp object edges and a little noise, in [0, 1]"""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    depth = 0.5 + 0.25 * np.sin(x / width * 4 * np.pi) * np.cos(y / height * np.pi)
+    rng = np.random.default_rng(0)
+    for cx, cy, r in rng.uniform(0, 1, (40, 3)) * [width, height, height / 6]:
+        depth[(x - cx) ** 2 + (y - cy) ** 2 < r ** 2] -= 0.1
+    depth += rng.normal(0, 0.0005, depth.shape).astype(np.float32)
+    return np.clip(depth, 0, 1)
+
+
+def current_webp(depth, path):
+    png_path = f"{path}.png"
+    Image.fromarray(np.clip(depth * 255, 0, 255).astype(np.uint8)).save(png_path, compress_level=4)
+    with Image.open(png_path) as image:
+        image.save(path, format="WEBP", quality=99, method=6)
+
+
+def read_8bit(path):
+    with Image.open(path) as image:
+        return np.asarray(image.convert("L"), dtype=np.float32) / 255.0
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark depth artifact formats")
+    parser.add_argument("--width", type=int, default=4096)
+    parser.add_argument("--height", type=int, default=2048)
+    args = parser.parse_args()
+
+    depth = synthetic_depth(args.width, args.height)
+    low, high = depth_format.depth_range(depth)
+    formats = [
+        ("webp q99 (current)", "depth.webp", current_webp, read_8bit),
+        ("png16", "depth.png", save_png16, read_depth),
+        ("float16 zlib", "depth.f16z", lambda d, p: save_float16(d, p, "zlib"), read_depth),
+        ("preview webp q80", "preview.webp", save_preview, lambda p: low + read_8bit(p) * (high - low)),
+    ]
+    if depth_format.zstandard is not None:
+        formats.insert(3, ("float16 zstd", "depth_zstd.f16z", lambda d, p: save_float16(d, p, "zstd"), read_depth))
+
+    print(f"{args.width}x{args.height} depth, float32 {depth.nbytes / 2**20:.1f} MiB")
+    print(f"{'format':<20} {'size':>10} {'encode':>9} {'decode':>9} {'max error':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for label, name, write, read in formats:
+            path = os.path.join(directory, name)
+            encode_time, _ = timed(lambda: write(depth, path))
+            decode_time, decoded = timed(lambda: read(path))
+            error = np.abs(decoded - depth).max()
+            print(
+                f"{label:<20} {os.path.getsize(path) / 2**10:8.0f}KiB "
+                f"{encode_time * 1000:7.0f}ms {decode_time * 1000:7.0f}ms {error:10.5f}"
+            )
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Compare the import cost of the predictor with its heavy modules deferred
+(as it is now) against loading them up front (as it used to).
+
+Each scenario runs in a fresh interpreter under `python -X importtime`.
+The script reports:
+- the total import time, summed over the top-level imports
+- the peak RSS of the interpreter
+- the slowest top-level imports
+
+The median of --runs runs is kept, since the first run pays for a cold
+disk cache:
+
+    python scripts/benchmark_imports.py --runs 5
+    python scripts/benchmark_imports.py --scenario minio_manager
+"""
+
+import os
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (deferred imports, eager imports)
+SCENARIOS = {
+    "predict": (
+        "import predict",
+        "import predict, scripts.embedding, scripts.crop_animation, scripts.tile_pyramid",
+    ),
+    "minio_manager": (
+        "import minio_manager",
+        "import minio_manager, numpy, PIL.Image",
+    ),
+}
+
+LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+RSS = "import resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+
+
+def measure(statement: str, python: str = sys.executable) -> dict:
+    """Cumulative microseconds per top-level import, and peak RSS in MB"""
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", f"{statement}; {RSS}"],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()
+        raise RuntimeError(error[-1] if error else f"exit code {result.returncode}")
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        # one space of indent marks a top-level import, nested ones have more
+        if match and len(match.group(3)) == 1:
+            modules[match.group(4)] = int(match.group(2))
+    return {
+        "modules": modules,
+        "total_ms": sum(modules.values()) / 1000,
+        "rss_mb": int(result.stdout.strip().splitlines()[-1]) / 1024,
+    }
+
+
+def median_run(statement: str, runs: int, python: str) -> dict:
+    results = [measure(statement, python) for _ in range(runs)]
+    modules = {
+        name: statistics.median(result["modules"].get(name, 0) for result in results)
+        for name in results[-1]["modules"]
+    }
+    return {
+        "modules": modules,
+        "total_ms": statistics.median(result["total_ms"] for result in results),
+        "rss_mb": statistics.median(result["rss_mb"] for result in results),
+    }
+
+
+def report(name: str, label: str, result: dict, top: int):
+    print(f"{name} ({label}): {result['total_ms']:.0f} ms of imports, {result['rss_mb']:.0f} MB peak RSS")
+    slowest = sorted(result["modules"].items(), key=lambda item: item[1], reverse=True)[:top]
+    for module, microseconds in slowest:
+        print(f"    {microseconds / 1000:9.1f} ms  {module}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time of deferred vs eager heavy modules")
+    parser.add_argument("--scenario", type=str, nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=8, help="Slowest top-level imports to list")
+    parser.add_argument("--python", type=str, default=sys.executable)
+    args = parser.parse_args()
+
+    for name in args.scenario:
+        results = {}
+        for label, statement in zip(("deferred", "eager"), SCENARIOS[name]):
+            try:
+                results[label] = median_run(statement, args.runs, args.python)
+            except RuntimeError as e:
+                print(f"{name} ({label}): could not import: {e}")
+                continue
+            report(name, label, results[label], args.top)
+
+        if len(results) == 2:
+            saved_ms = results["eager"]["total_ms"] - results["deferred"]["total_ms"]
+            saved_mb = results["eager"]["rss_mb"] - results["deferred"]["rss_mb"]
+            print(f"{name}: deferring saves {saved_ms:.0f} ms and {saved_mb:.0f} MB at startup\n")
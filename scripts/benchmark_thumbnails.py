@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Compare MinioStorageManager.resize_image with the multi-size ThumbnailEngine.
+
+Synthetic 4K (4096x2048) and 8K (8192x4096) panoramas are written as WebP
+(what the predictor produces) and JPEG (where draft mode applies). For each,
+the current path (resize_image, Image.fromarray, save, once per size) is
+timed against one ThumbnailEngine.generate call for the same sizes:
+
+    python scripts/benchmark_thumbnails.py --widths 256 512 1024
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minio_manager import MinioStorageManager
+from thumbnails import ThumbnailEngine
+
+
+def panorama(width, height):
+    """Smooth gradients plus noise, so encoders can't shortcut flat areas"""
+    x = np.linspace(0, 4 * np.pi, width, dtype=np.float32)
+    y = np.linspace(0, np.pi, height, dtype=np.float32)[:, None]
+    base = np.stack([np.sin(x + y), np.cos(x - y), np.sin(2 * y) + 0 * x], axis=-1)
+    noise = np.random.default_rng(0).normal(0, 0.05, (height, width, 3)).astype(np.float32)
+    return Image.fromarray(((base + noise + 1) * 127).clip(0, 255).astype(np.uint8))
+
+
+def best_of(repeat, function):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark thumbnail generation")
+    parser.add_argument("--widths", type=int, nargs="+", default=[256, 512, 1024])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    engine = ThumbnailEngine(args.widths)
+    with tempfile.TemporaryDirectory() as directory:
+        for label, size in [("4K", (4096, 2048)), ("8K", (8192, 4096))]:
+            image = panorama(*size)
+            for extension, options in [("webp", {"quality": 90, "method": 4}), ("jpg", {"quality": 95})]:
+                source = os.path.join(directory, f"{label}.{extension}")
+                image.save(source, **options)
+
+                def current():
+                    for width in args.widths:
+                        thumbnail = MinioStorageManager.resize_image(source, (width, width // 2))
+                        Image.fromarray(thumbnail).save(os.path.join(directory, f"old_{width}.webp"), format="WEBP")
+
+                def engine_run():
+                    engine.generate(source, directory, "new")
+
+                old = best_of(args.repeat, current)
+                new = best_of(args.repeat, engine_run)
+                count = len(args.widths)
+                print(
+                    f"{label} {extension:<4} resize_image {old / count * 1000:7.1f} ms/thumbnail   "
+                    f"engine {new / count * 1000:7.1f} ms/thumbnail   speedup {old / new:.2f}x"
+                )
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Compare single-call fput_object uploads with the parallel multipart engine.
+
+Runs against any S3-compatible endpoint, e.g. a local stand-in:
+
+    minio server /tmp/minio-data          # or: moto_server -p 9000
+    python scripts/benchmark_upload.py --endpoint localhost:9000 --size-mb 256
+
+Reports throughput and the peak Python memory allocated during each upload.
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minio_manager import MinioStorageManager
+
+
+def measure(label, upload, size):
+    tracemalloc.start()
+    start = time.perf_counter()
+    upload()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<24} {elapsed:7.2f}s {size / elapsed / 2**20:8.1f} MiB/s  peak {peak / 2**20:7.1f} MiB")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark large-object uploads")
+    parser.add_argument("--endpoint", type=str, default="localhost:9000")
+    parser.add_argument("--access-key", type=str, default="ROOTUSER")
+    parser.add_argument("--secret-key", type=str, default="ROOTPASSWORD")
+    parser.add_argument("--bucket", type=str, default="benchmark")
+    parser.add_argument("--size-mb", type=int, default=256, help="Size of the test file in MiB")
+    parser.add_argument("--part-size-mb", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    manager = MinioStorageManager(
+        endpoint=args.endpoint,
+        access_key=args.access_key,
+        secret_key=args.secret_key,
+        bucket=args.bucket,
+        part_size=args.part_size_mb * 2**20,
+        upload_workers=args.workers
+    )
+    manager.ensure_bucket(args.bucket)
+
+    size = args.size_mb * 2**20
+    with tempfile.NamedTemporaryFile(suffix=".bin") as f:
+        for _ in range(args.size_mb):
+            f.write(os.urandom(2**20))
+        f.flush()
+
+        print(f"{args.size_mb} MiB file, {args.part_size_mb} MiB parts, {args.workers} workers")
+        single, multipart = [], []
+        for i in range(args.repeat):
+            single.append(measure(
+                "fput_object",
+                lambda: manager.call("fput_object", args.bucket, "benchmark/single.bin", f.name),
+                size
+            ))
+            multipart.append(measure(
+                "multipart engine",
+                lambda: manager.multipart.upload(f.name, args.bucket, "benchmark/multipart.bin"),
+                size
+            ))
+
+    print(f"speedup: {min(single) / min(multipart):.2f}x (best of {args.repeat})")
+    print(f"S3 calls: {manager.get_stats()}")
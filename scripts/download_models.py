@@ -1,85 +1,264 @@
 #!/usr/bin/env python3
+"""
+Download the models listed in custom_models.json into ComfyUI/models.
+
+Entries are either a URL or an object with a "url" and optional "filename"
+and "sha256":
+
+    "checkpoints": [
+        "https://example.com/model.safetensors",
+        {"url": "https://civitai.com/api/download/models/351306",
+         "filename": "dreamshaperXL_v21TurboDPMSDE.safetensors",
+         "sha256": "..."}
+    ]
+
+Files are fetched concurrently. Servers that accept byte ranges have large
+files split into segments downloaded in parallel into a .part file, with
+progress kept next to it so an interrupted download resumes where it
+stopped. Existing files are only skipped when their size (and sha256, if
+given) matches.
+"""
 
 import os
+import re
 import json
+import time
+import hashlib
+import argparse
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 from tqdm import tqdm
-import urllib.parse
+
+CHUNK_SIZE = 1024 * 1024
+MIN_SEGMENT_SIZE = 64 * 1024 * 1024
+
 
 def ensure_directory(path):
     """Create directory if it doesn't exist."""
     if not os.path.exists(path):
-        os.makedirs(path)
+        os.makedirs(path, exist_ok=True)
         print(f"Created directory: {path}")
 
-def download_file(url, destination_path):
+
+def load_entries(config="custom_models.json"):
+    """(directory, url, filename, sha256) for every model in the config"""
+    with open(config, "r") as file:
+        downloads = json.load(file)
+
+    entries = []
+    for directory, items in downloads.items():
+        for item in items:
+            if isinstance(item, str):
+                item = {"url": item}
+            entries.append((directory, item["url"], item.get("filename"), item.get("sha256")))
+    return entries
+
+
+def filename_from_headers(headers):
+    disposition = headers.get("content-disposition", "")
+    match = re.search(r"filename\*=(?:UTF-8'')?([^;]+)", disposition, re.IGNORECASE)
+    if match:
+        return urllib.parse.unquote(match.group(1).strip('"'))
+    match = re.search(r'filename="?([^";]+)"?', disposition, re.IGNORECASE)
+    if match:
+        return match.group(1)
+    return None
+
+
+def resolve(url):
     """
-    Download a file with progress bar.
-    Returns True if successful, False otherwise.
+    Follow redirects with a HEAD request (or a one-byte ranged GET for
+    servers that refuse HEAD) and return the final URL, filename, size and
+    whether byte ranges are supported.
     """
-    try:
-        # Get the filename from the URL
+    response = requests.head(url, allow_redirects=True, timeout=30)
+    if response.status_code in (403, 405) or "content-length" not in response.headers:
+        response = requests.get(url, headers={"Range": "bytes=0-0"}, stream=True, allow_redirects=True, timeout=30)
+        response.close()
+    response.raise_for_status()
+
+    size = None
+    accepts_ranges = response.headers.get("accept-ranges") == "bytes"
+    if response.status_code == 206 and "content-range" in response.headers:
+        size = int(response.headers["content-range"].rsplit("/", 1)[1])
+        accepts_ranges = True
+    elif "content-length" in response.headers:
+        size = int(response.headers["content-length"])
+
+    filename = filename_from_headers(response.headers)
+    if not filename:
         filename = os.path.basename(urllib.parse.urlparse(url).path)
-        if '?' in filename:  # Remove query parameters from filename
-            filename = filename.split('?')[0]
-        
-        # If filename is empty or doesn't have an extension, try to get it from content-disposition
-        if not filename or '.' not in filename:
-            response = requests.get(url, stream=True, allow_redirects=True)
-            if 'content-disposition' in response.headers:
-                content_disposition = response.headers['content-disposition']
-                if 'filename=' in content_disposition:
-                    filename = content_disposition.split('filename=')[1].strip('"')
+    if not filename or "." not in filename:
+        filename = os.path.basename(urllib.parse.urlparse(response.url).path) or filename
+
+    return response.url, filename, size, accepts_ranges
+
+
+def sha256_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def plan_segments(size, segments):
+    """[start, end] byte ranges splitting a file into up to `segments` parts"""
+    count = max(1, min(segments, size // MIN_SEGMENT_SIZE))
+    step = -(-size // count)
+    return [[start, min(start + step, size) - 1] for start in range(0, size, step)]
+
 
+def download_segment(url, part_path, segment, progress, state, lock, pbar):
+    """Download one byte range into its place in the .part file, resuming from its progress"""
+    start, end = segment
+    offset = start + progress[str(start)]
+    if offset > end:
+        return
+
+    headers = {"Range": f"bytes={offset}-{end}"}
+    with requests.get(url, headers=headers, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise IOError(f"Server ignored range request for {url}")
+
+        fd = os.open(part_path, os.O_WRONLY)
+        try:
+            for data in response.iter_content(chunk_size=CHUNK_SIZE):
+                os.pwrite(fd, data, offset)
+                offset += len(data)
+                pbar.update(len(data))
+                with lock:
+                    progress[str(start)] = offset - start
+                    state()
+        finally:
+            os.close(fd)
+
+    if offset != end + 1:
+        raise IOError(f"Segment {start}-{end} of {url} ended early")
+
+
+def download_file(url, destination_path, filename=None, sha256=None, segments=8):
+    """
+    Download a file, in parallel segments when the server supports ranges.
+    Returns the path of the file if successful, None otherwise.
+    """
+    try:
+        final_url, resolved_name, size, accepts_ranges = resolve(url)
+        filename = filename or resolved_name
         full_path = os.path.join(destination_path, filename)
-        
-        # Skip if file already exists
+        part_path = f"{full_path}.part"
+        state_path = f"{part_path}.json"
+
+        # Skip only complete files
         if os.path.exists(full_path):
-            print(f"File already exists: {full_path}")
-            return True
+            if (size is None or os.path.getsize(full_path) == size) and (not sha256 or sha256_file(full_path) == sha256):
+                print(f"File already exists: {full_path}")
+                return full_path
+            print(f"Existing {full_path} is incomplete or corrupt, downloading again")
+            os.remove(full_path)
 
-        # Make the request
-        response = requests.get(url, stream=True, allow_redirects=True)
-        response.raise_for_status()
+        with tqdm(desc=filename, total=size, unit='iB', unit_scale=True, unit_divisor=1024) as pbar:
+            if accepts_ranges and size:
+                # resume from the progress of a previous attempt if it matches
+                plan = None
+                if os.path.exists(part_path) and os.path.exists(state_path):
+                    with open(state_path, "r") as file:
+                        saved = json.load(file)
+                    if saved.get("size") == size:
+                        plan = saved
+                if plan is None:
+                    plan = {"size": size, "segments": plan_segments(size, segments)}
+                    plan["progress"] = {str(start): 0 for start, _ in plan["segments"]}
+                    with open(part_path, "wb") as file:
+                        file.truncate(size)
+                pbar.update(sum(plan["progress"].values()))
 
-        # Get the total file size
-        total_size = int(response.headers.get('content-length', 0))
+                lock = threading.Lock()
+                last_saved = [0.0]
 
-        # Open the local file to write the downloaded content
-        with open(full_path, 'wb') as file, tqdm(
-            desc=filename,
-            total=total_size,
-            unit='iB',
-            unit_scale=True,
-            unit_divisor=1024,
-        ) as pbar:
-            for data in response.iter_content(chunk_size=1024):
-                size = file.write(data)
-                pbar.update(size)
+                def save_state(force=False):
+                    # progress is flushed at most once a second
+                    if not force and time.time() - last_saved[0] < 1.0:
+                        return
+                    last_saved[0] = time.time()
+                    with open(state_path, "w") as file:
+                        json.dump(plan, file)
 
-        return True
+                save_state(force=True)
+                try:
+                    with ThreadPoolExecutor(max_workers=len(plan["segments"])) as pool:
+                        futures = [
+                            pool.submit(download_segment, final_url, part_path, segment, plan["progress"], save_state, lock, pbar)
+                            for segment in plan["segments"]
+                        ]
+                        for future in futures:
+                            future.result()
+                finally:
+                    # once every segment stopped, so none of their progress is lost
+                    with lock:
+                        save_state(force=True)
+            else:
+                # no ranges: a single stream from the start
+                with requests.get(final_url, stream=True, timeout=60) as response:
+                    response.raise_for_status()
+                    with open(part_path, "wb") as file:
+                        for data in response.iter_content(chunk_size=CHUNK_SIZE):
+                            pbar.update(file.write(data))
+
+        if size is not None and os.path.getsize(part_path) != size:
+            raise IOError(f"Expected {size} bytes, got {os.path.getsize(part_path)}")
+        if sha256 and sha256_file(part_path) != sha256:
+            os.remove(part_path)
+            if os.path.exists(state_path):
+                os.remove(state_path)
+            raise IOError(f"sha256 mismatch for {filename}")
+
+        os.replace(part_path, full_path)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        return full_path
 
     except Exception as e:
         print(f"Error downloading {url}: {str(e)}")
-        return False
-
-if __name__ == "__main__":
-    # Base directory
-    base_dir = "ComfyUI/models"
+        return None
 
-    # Dictionary of directories and their corresponding URLs
-    with open("custom_models.json", "r") as file:
-        downloads = json.load(file) 
 
-    # Process each directory and its downloads
-    for directory, urls in downloads.items():
+def download_all(entries, base_dir="ComfyUI/models", workers=4, segments=8):
+    """Download (directory, url, filename, sha256) entries concurrently, returning the failed URLs"""
+    def download(entry):
+        directory, url, filename, sha256 = entry
         full_path = os.path.join(base_dir, directory)
         ensure_directory(full_path)
-        
-        for url in urls:
-            print(f"\nDownloading to {directory}:")
-            success = download_file(url, full_path)
-            if success:
-                print(f"Successfully downloaded to {directory}")
-            else:
-                print(f"Failed to download {url}")
\ No newline at end of file
+        path = download_file(url, full_path, filename, sha256, segments)
+        if path:
+            print(f"Successfully downloaded to {directory}")
+        else:
+            print(f"Failed to download {url}")
+        return path
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(download, entries))
+    return [entry[1] for entry, path in zip(entries, results) if path is None]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Download the models listed in custom_models.json')
+    parser.add_argument('--config', type=str, default='custom_models.json')
+    parser.add_argument('--base-dir', type=str, default='ComfyUI/models')
+    parser.add_argument('--workers', type=int, default=4, help='Files downloaded at once')
+    parser.add_argument('--segments', type=int, default=8, help='Parallel ranges per large file')
+    parser.add_argument('--only', type=str, nargs='*', help='Only these model directories, e.g. checkpoints vae')
+    args = parser.parse_args()
+
+    entries = load_entries(args.config)
+    if args.only:
+        entries = [entry for entry in entries if entry[0] in args.only]
+
+    failed = download_all(entries, args.base_dir, args.workers, args.segments)
+    if failed:
+        print(f"Failed to download: {failed}")
+        exit(1)
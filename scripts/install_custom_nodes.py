@@ -1,111 +1,232 @@
 #!/usr/bin/env python3
+"""
+Install the custom nodes pinned in custom_nodes.json into ComfyUI/custom_nodes.
 
-import json
-import os
-import subprocess
+Repositories are installed concurrently, and only the pinned commit is
+fetched. A full 40 character hash is fetched at depth 1. A short hash can't
+be asked for by name, so its history is fetched without file contents
+(--filter=blob:none) and only the pinned commit's files are downloaded.
+Submodules are fetched shallow where the server allows it.
 
-def add_safe_directory(path):
-    """Add a directory to Git's safe.directory configuration."""
-    subprocess.run(["git", "config", "--global", "--add", "safe.directory", path])
+What got installed is written to custom_nodes.lock.json in the custom nodes
+directory. A repository whose lock entry and checked out commit still
+match its pin is skipped without running git. Repositories checked out at
+another commit are handled by --on-mismatch: "update" checks out the pin,
+"keep" leaves them, and "fail" reports them as errors. Nothing prompts, so
+the script can run in automated builds:
 
-json_file = "custom_nodes.json"
-comfy_dir = "ComfyUI"
-custom_nodes_dir = f"{comfy_dir}/custom_nodes/"
-
-# check if the comfy directory exists
-if not os.path.isdir(custom_nodes_dir):
-    raise FileNotFoundError(
-        f"Directory {custom_nodes_dir} does not exist. Make sure you have the correct path to the ComfyUI directory."
-    )
+    python scripts/install_custom_nodes.py --workers 8 --on-mismatch update
+"""
 
-# Read the JSON file containing the repositories and commit hashes
-with open(json_file, "r") as file:
-    repos = json.load(file)
-
-# Disable the detached head warning
-subprocess.run(["git", "config", "--global", "advice.detachedHead", "false"])
+import os
+import json
+import time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
-# Loop over each repository in the list
-for repo in repos:
-    repo_url = repo["repo"]
-    commit_hash = repo["commit"]
-    repo_name = os.path.basename(repo_url.replace(".git", ""))
+LOCK_FILE = "custom_nodes.lock.json"
 
-    # Check if the repository directory already exists
-    repo_path = os.path.join(custom_nodes_dir, repo_name)
-    absolute_repo_path = os.path.abspath(repo_path)
+# Copied into place once their node is installed
+CONFIG_FILES = {
+    "was_suite_config": ("custom_node_configs/was_suite_config.json", "custom_nodes/was-node-suite-comfyui"),
+    "rgthree_config": ("custom_node_configs/rgthree_config.json", "custom_nodes/rgthree-comfy"),
+    "comfy_settings": ("custom_node_configs/comfy.settings.json", "user/default"),
+}
 
-    # Add the repository path to safe.directory
-    add_safe_directory(absolute_repo_path)
 
-    if not os.path.isdir(repo_path):
-        # Clone the repository into the destination directory
-        print(
-            f"Cloning {repo_url} into {repo_path} and checking out to commit {commit_hash}"
+def git(path, *args):
+    """Run git in a repository, returning its stripped output"""
+    result = subprocess.run(
+        ["git", "-c", "advice.detachedHead=false", *args],
+        cwd=path, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"git {' '.join(args)} failed in {path}: {result.stderr.strip()}")
+    return result.stdout.strip()
+
+
+def add_safe_directories(paths):
+    """Add directories to Git's safe.directory configuration, once each"""
+    result = subprocess.run(["git", "config", "--global", "--get-all", "safe.directory"], capture_output=True, text=True)
+    existing = set(result.stdout.split())
+    for path in paths:
+        if path not in existing:
+            subprocess.run(["git", "config", "--global", "--add", "safe.directory", path])
+
+
+def repo_name(url):
+    return os.path.basename(url.rstrip("/").replace(".git", ""))
+
+
+def head_commit(path):
+    """Checked out commit read from .git/HEAD, without running git"""
+    try:
+        with open(os.path.join(path, ".git", "HEAD"), "r") as file:
+            head = file.read().strip()
+    except OSError:
+        return None
+    if head.startswith("ref: "):
+        try:
+            with open(os.path.join(path, ".git", head[5:]), "r") as file:
+                return file.read().strip()
+        except OSError:
+            return None  # packed ref, let git answer
+    return head
+
+
+def load_lock(custom_nodes_dir):
+    path = os.path.join(custom_nodes_dir, LOCK_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def save_lock(custom_nodes_dir, lock):
+    path = os.path.join(custom_nodes_dir, LOCK_FILE)
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(lock, file, indent=2, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+def fetch_commit(path, commit):
+    """Fetch a pinned commit into a repository and check it out with its submodules"""
+    full_hash = len(commit) == 40
+    try:
+        git(path, "rev-parse", "--verify", "--quiet", f"{commit}^{{commit}}")
+        found = True
+    except RuntimeError:
+        found = False
+
+    if not found:
+        if full_hash:
+            try:
+                git(path, "fetch", "--depth", "1", "origin", commit)
+            except RuntimeError:
+                # servers that refuse fetching a commit by hash
+                git(path, "fetch", "--filter=blob:none", "origin")
+        else:
+            git(path, "fetch", "--filter=blob:none", "--tags", "origin")
+
+    git(path, "checkout", git(path, "rev-parse", f"{commit}^{{commit}}"))
+    try:
+        git(path, "submodule", "update", "--init", "--recursive", "--depth", "1")
+    except RuntimeError:
+        git(path, "submodule", "update", "--init", "--recursive")
+    return git(path, "rev-parse", "HEAD")
+
+
+def install(repo, custom_nodes_dir, lock, on_mismatch="update"):
+    """
+    Install one custom node repository at its pinned commit.
+    Returns (name, status, lock entry) with status installed, updated,
+    unchanged, kept or an error message.
+    """
+    url, commit = repo["repo"], repo["commit"]
+    name = repo_name(url)
+    path = os.path.join(custom_nodes_dir, name)
+    entry = lock.get(name)
+
+    try:
+        current = head_commit(path) if os.path.isdir(path) else None
+        # kept repositories are recorded off their pin, so they are never skipped here
+        if current and entry and entry["repo"] == url and entry["commit"] == commit \
+                and entry["resolved"] == current and current.startswith(commit):
+            return name, "unchanged", entry
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+            try:
+                git(path, "init", "--quiet")
+                git(path, "remote", "add", "origin", url)
+                resolved = fetch_commit(path, commit)
+            except Exception:
+                subprocess.run(["rm", "-rf", path])
+                raise
+            status = "installed"
+        else:
+            current = current or git(path, "rev-parse", "HEAD")
+            if current.startswith(commit):
+                resolved, status = current, "unchanged"
+            elif on_mismatch == "keep":
+                resolved, status = current, "kept"
+            elif on_mismatch == "fail":
+                return name, f"at {current[:7]}, pinned {commit[:7]}", entry
+            else:
+                resolved, status = fetch_commit(path, commit), "updated"
+
+        return name, status, {
+            "repo": url,
+            "commit": commit,
+            "resolved": resolved,
+            "installed_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+    except Exception as e:
+        return name, f"error: {e}", entry
+
+
+def install_all(repos, custom_nodes_dir, workers=4, on_mismatch="update"):
+    """Install repositories concurrently and update the lock file, returning {name: status}"""
+    lock = load_lock(custom_nodes_dir)
+    add_safe_directories([os.path.abspath(os.path.join(custom_nodes_dir, repo_name(r["repo"]))) for r in repos])
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda repo: install(repo, custom_nodes_dir, lock, on_mismatch), repos))
+
+    statuses = {}
+    for name, status, entry in results:
+        statuses[name] = status
+        if entry:
+            lock[name] = entry
+        print(f"{name}: {status} {entry['resolved'][:7] if entry else ''}")
+    save_lock(custom_nodes_dir, lock)
+    return statuses
+
+
+def link_local_nodes(custom_nodes_dir, local_nodes_dir="comfyui_nodes"):
+    """Link the nodes that live in this repository"""
+    for node in sorted(os.listdir(local_nodes_dir)):
+        node_path = os.path.join(custom_nodes_dir, node)
+        if not os.path.exists(node_path):
+            print(f"Linking {local_nodes_dir}/{node} into {custom_nodes_dir}")
+            os.symlink(os.path.abspath(os.path.join(local_nodes_dir, node)), node_path)
+
+
+def copy_config_files(comfy_dir):
+    """Copy custom node config files into place, without replacing existing ones"""
+    os.makedirs(os.path.join(comfy_dir, "user", "default"), exist_ok=True)
+    for config_file, (src, dest) in CONFIG_FILES.items():
+        dest = os.path.join(comfy_dir, dest)
+        if os.path.isfile(src) and os.path.isdir(dest) and not os.path.exists(os.path.join(dest, os.path.basename(src))):
+            print(f"Copying {config_file} to {dest}")
+            subprocess.run(["cp", src, dest])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Install the custom nodes pinned in custom_nodes.json')
+    parser.add_argument('--config', type=str, default='custom_nodes.json')
+    parser.add_argument('--comfy-dir', type=str, default='ComfyUI')
+    parser.add_argument('--workers', type=int, default=4, help='Repositories installed at once')
+    parser.add_argument('--on-mismatch', choices=['update', 'keep', 'fail'], default='update',
+                        help='What to do with a repository checked out at another commit than its pin')
+    args = parser.parse_args()
+
+    custom_nodes_dir = os.path.join(args.comfy_dir, "custom_nodes")
+    # check if the comfy directory exists
+    if not os.path.isdir(custom_nodes_dir):
+        raise FileNotFoundError(
+            f"Directory {custom_nodes_dir} does not exist. Make sure you have the correct path to the ComfyUI directory."
         )
-        subprocess.run(["git", "clone", "--recursive", repo_url, repo_path])
 
-        # Store the current directory and change to the repository's directory
-        current_dir = os.getcwd()
-        os.chdir(repo_path)
-        subprocess.run(["git", "checkout", commit_hash])
-        subprocess.run(["git", "submodule", "update", "--init", "--recursive"])
+    with open(args.config, "r") as file:
+        repos = json.load(file)
 
-        # Change back to the original directory after operations
-        os.chdir(current_dir)
+    statuses = install_all(repos, custom_nodes_dir, args.workers, args.on_mismatch)
+    link_local_nodes(custom_nodes_dir)
+    copy_config_files(args.comfy_dir)
 
-    # If the repository already exists, check if the commit hash is the same
-    else:
-        current_dir = os.getcwd()
-        os.chdir(repo_path)
-
-        current_commit = (
-            subprocess.check_output(["git", "rev-parse", "HEAD"]).decode().strip()
-        )
-        print(f"Custom node installed for {repo_name} at {current_commit[:7]}")
-
-        if current_commit[:7] != commit_hash[:7]:
-            response = input(
-                f"Do you want to update {repo_name}? Current ({current_commit[:7]}) is different from ({commit_hash[:7]}) (y/n): "
-            )
-            if response.lower() == "y":
-                print(f"Checking out to commit {commit_hash}")
-                subprocess.run(["git", "fetch"])
-                subprocess.run(["git", "checkout", commit_hash])
-                subprocess.run(["git", "submodule", "update", "--init", "--recursive"])
-            else:
-                print("Skipping checkout, keeping current commit")
-
-        os.chdir(current_dir)
-
-# Copy custom node config files to the correct directory
-config_files = {
-    "was_suite_config": {
-        "src": "custom_node_configs/was_suite_config.json",
-        "dest": os.path.join(custom_nodes_dir, "was-node-suite-comfyui/"),
-    },
-    "rgthree_config": {
-        "src": "custom_node_configs/rgthree_config.json",
-        "dest": os.path.join(custom_nodes_dir, "rgthree-comfy/"),
-    },
-    "comfy_settings": {
-        "src": "custom_node_configs/comfy.settings.json",
-        "dest": os.path.join(comfy_dir, "user", "default"),
-    },
-}
-
-if "comfy_settings" in config_files:
-    paths = config_files["comfy_settings"]
-    if not os.path.exists(paths["dest"]):
-        os.makedirs(paths["dest"])
-
-for config_file, paths in config_files.items():
-    if (
-        os.path.isfile(paths["src"])
-        and os.path.isdir(paths["dest"])
-        and not os.path.exists(
-            os.path.join(paths["dest"], os.path.basename(paths["src"]))
-        )
-    ):
-        print(f"Copying {config_file} to {paths['dest']}")
-        subprocess.run(["cp", paths["src"], paths["dest"]])
\ No newline at end of file
+    failed = [name for name, status in statuses.items() if status not in ("installed", "updated", "unchanged", "kept")]
+    if failed:
+        print(f"Failed to install: {failed}")
+        exit(1)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Load test the cog HTTP endpoint at several concurrency levels.
+
+Each level sends --requests predictions from --concurrency client threads,
+drawing a seeded mix of base, upscale and upscale-input requests, so every
+run and every level sends the same sequence. For each level, and for each
+request kind within it, the report gives:
+
+- client-side latency percentiles
+- throughput and error rates
+- cog's predict_time
+- per-stage timings, read from the metadata.json of every prediction
+- ComfyUI cache hits: the nodes cached and executed, also from metadata.json,
+  and with scripts/stub_predictor.py the models loaded
+
+Busy answers (409) are retried until --timeout, the way a queueing client
+would. The time spent retrying counts towards the latency.
+
+The report is written as JSON, with the git commit and settings included.
+--compare prints the latency and throughput changes against an earlier
+report. Runs against the real server or scripts/stub_predictor.py:
+
+    python scripts/stub_predictor.py --port 5000 --concurrency 2 &
+    python scripts/load_test.py --url http://localhost:5000 --concurrency 1 2 4 \\
+        --mix base=6,upscale=3,upscale-input=1 --requests 40 --output report.json
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+PROMPT = "Studio Ghibli-inspired scenic picture featuring gentle hills and mountains in the distance, serene forests with golden light, traditional architecture like shrines or temples, lanterns floating on ponds"
+
+# predictor inputs each request kind adds to the common ones
+KINDS = {
+    "base": {},
+    "upscale": {"upscale_by": 2.0},
+    "upscale-input": {"upscale_by": 2.0},  # plus input_file_id
+}
+
+
+def parse_mix(mix):
+    """'base=6,upscale=3' -> {'base': 6.0, 'upscale': 3.0}"""
+    weights = {}
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in KINDS:
+            raise ValueError(f"Unknown request kind {kind}, expected one of {list(KINDS)}")
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+def summarize(values):
+    """Count, mean and latency percentiles of a list of seconds"""
+    if not values:
+        return {"count": 0}
+    values = np.asarray(values, dtype=np.float64)
+    p50, p90, p95, p99 = np.percentile(values, [50, 90, 95, 99])
+    return {
+        "count": int(values.size),
+        "mean": round(float(values.mean()), 4),
+        "p50": round(float(p50), 4),
+        "p90": round(float(p90), 4),
+        "p95": round(float(p95), 4),
+        "p99": round(float(p99), 4),
+        "max": round(float(values.max()), 4),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+class LoadTest:
+    def __init__(self, url, base_input, timeout=600.0, retry_busy=True):
+        self.url = url.rstrip("/")
+        self.base_input = base_input
+        self.timeout = timeout
+        self.retry_busy = retry_busy
+        self.session = requests.Session()
+        self.ids = []  # image ids produced so far, inputs for upscale-input requests
+        self.lock = threading.Lock()
+
+    def build_input(self, kind, index):
+        prediction_input = {**self.base_input, **KINDS[kind], "seed": self.base_input.get("seed", 0) + index}
+        if kind == "upscale-input":
+            with self.lock:
+                prediction_input["input_file_id"] = self.ids[index % len(self.ids)]
+        return prediction_input
+
+    def predict(self, kind, index):
+        """Send one prediction and return its result record"""
+        prediction_input = self.build_input(kind, index)
+        record = {"kind": kind, "error": None, "busy_retries": 0}
+        start = time.perf_counter()
+        try:
+            while True:
+                response = self.session.post(f"{self.url}/predictions", json={"input": prediction_input}, timeout=self.timeout)
+                if response.status_code == 409 and self.retry_busy and time.perf_counter() - start < self.timeout:
+                    record["busy_retries"] += 1
+                    time.sleep(min(0.02 * record["busy_retries"], 0.2))
+                    continue
+                break
+            record["latency"] = time.perf_counter() - start
+
+            if response.status_code != 200:
+                record["error"] = f"http {response.status_code}"
+                return record
+            body = response.json()
+            if body.get("status") != "succeeded":
+                record["error"] = body.get("status") or "unknown"
+                return record
+
+            record["predict_time"] = body.get("metrics", {}).get("predict_time")
+            outputs = body.get("output") or []
+            record["metadata_url"] = outputs[-1] if outputs else None
+        except requests.RequestException as e:
+            record["latency"] = time.perf_counter() - start
+            record["error"] = type(e).__name__
+        return record
+
+    def fetch_metadata(self, record, attempts=5):
+        """Stage timings from a prediction's metadata.json, which may still be uploading"""
+        for attempt in range(attempts):
+            try:
+                response = self.session.get(record["metadata_url"], timeout=30)
+                if response.status_code == 200:
+                    metadata = response.json()
+                    if metadata.get("id"):
+                        with self.lock:
+                            self.ids.append(metadata["id"])
+                    record["timings"] = metadata.get("timings") or {}
+                    record["cached_nodes"] = metadata.get("cached_nodes")
+                    record["executed_nodes"] = metadata.get("executed_nodes")
+                    record["model_loads"] = metadata.get("model_loads")
+                    return
+            except (requests.RequestException, ValueError):
+                pass
+            time.sleep(0.5 * (attempt + 1))
+
+    def run_level(self, concurrency, kinds, offset=0):
+        """Send the requests of `kinds` from `concurrency` threads and summarize them"""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            records = list(pool.map(lambda item: self.predict(item[1], offset + item[0]), enumerate(kinds)))
+        duration = time.perf_counter() - start
+
+        succeeded = [record for record in records if record["error"] is None]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(self.fetch_metadata, [record for record in succeeded if record.get("metadata_url")]))
+
+        return {
+            "concurrency": concurrency,
+            "requests": len(records),
+            "succeeded": len(succeeded),
+            "errors": dict(Counter(record["error"] for record in records if record["error"])),
+            "error_rate": round(1 - len(succeeded) / len(records), 4) if records else 0.0,
+            "busy_retries": sum(record["busy_retries"] for record in records),
+            "duration": round(duration, 3),
+            "throughput": round(len(succeeded) / duration, 4) if duration else 0.0,
+            "latency": summarize([record["latency"] for record in succeeded]),
+            "predict_time": summarize([record["predict_time"] for record in succeeded if record.get("predict_time") is not None]),
+            "stages": self.stage_summary(succeeded),
+            "cache": self.cache_summary(succeeded),
+            "kinds": {
+                kind: {
+                    "requests": sum(1 for record in records if record["kind"] == kind),
+                    "errors": sum(1 for record in records if record["kind"] == kind and record["error"]),
+                    "latency": summarize([record["latency"] for record in succeeded if record["kind"] == kind]),
+                    "stages": self.stage_summary([record for record in succeeded if record["kind"] == kind]),
+                }
+                for kind in sorted(set(kinds))
+            },
+        }
+
+    @staticmethod
+    def cache_summary(records):
+        """Nodes ComfyUI served from its cache and nodes it executed, summed over records"""
+        cached = sum(record.get("cached_nodes") or 0 for record in records)
+        executed = sum(record.get("executed_nodes") or 0 for record in records)
+        summary = {
+            "cached_nodes": cached,
+            "executed_nodes": executed,
+            "hit_rate": round(cached / (cached + executed), 4) if cached + executed else 0.0,
+        }
+        # reported by scripts/stub_predictor.py only
+        if any(record.get("model_loads") is not None for record in records):
+            summary["model_loads"] = sum(record.get("model_loads") or 0 for record in records)
+        return summary
+
+    @staticmethod
+    def stage_summary(records):
+        stages = {}
+        for record in records:
+            for stage, seconds in (record.get("timings") or {}).items():
+                if isinstance(seconds, (int, float)):
+                    stages.setdefault(stage, []).append(seconds)
+        return {stage: summarize(values) for stage, values in sorted(stages.items())}
+
+
+def print_level(level):
+    latency = level["latency"]
+    print(
+        f"concurrency {level['concurrency']:>3}: {level['succeeded']}/{level['requests']} ok, "
+        f"{level['throughput']:.3f} req/s, p50 {latency.get('p50', 0):.2f}s p95 {latency.get('p95', 0):.2f}s "
+        f"p99 {latency.get('p99', 0):.2f}s, errors {level['errors'] or 0}"
+    )
+    cache = level.get("cache") or {}
+    if cache.get("cached_nodes") or cache.get("executed_nodes"):
+        loads = f", {cache['model_loads']} model loads" if "model_loads" in cache else ""
+        print(f"    cache: {cache['cached_nodes']} nodes cached, {cache['executed_nodes']} executed ({cache['hit_rate']:.0%}){loads}")
+    for stage, summary in level["stages"].items():
+        print(f"    {stage:<16} p50 {summary['p50']:.3f}s p95 {summary['p95']:.3f}s")
+
+
+def compare(report, previous):
+    """Print latency and throughput changes against an earlier report, level by level"""
+    earlier = {level["concurrency"]: level for level in previous["levels"]}
+    print(f"Compared with {(previous.get('git_commit') or '')[:7]} ({previous.get('started_at')}):")
+    for level in report["levels"]:
+        before = earlier.get(level["concurrency"])
+        if not before or not before["latency"].get("count") or not level["latency"].get("count"):
+            continue
+        changes = [
+            f"{name} {(level['latency'][name] / before['latency'][name] - 1) * 100:+.1f}%"
+            for name in ("p50", "p95", "p99") if before["latency"][name]
+        ]
+        if before["throughput"]:
+            changes.append(f"throughput {(level['throughput'] / before['throughput'] - 1) * 100:+.1f}%")
+        print(f"concurrency {level['concurrency']:>3}: {', '.join(changes)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the predictor HTTP endpoint")
+    parser.add_argument("--url", type=str, default=f"http://localhost:{os.environ.get('INTERNAL_PORT', 5000)}")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=20, help="Requests per concurrency level")
+    parser.add_argument("--mix", type=str, default="base=1", help="Weighted request kinds, e.g. base=6,upscale=3,upscale-input=1")
+    parser.add_argument("--input-id", type=str, nargs="*", default=[], help="Image ids for upscale-input requests, otherwise from a warm-up request")
+    parser.add_argument("--warmup", type=int, default=1, help="Base requests sent before measuring")
+    parser.add_argument("--steps", type=int, default=12)
+    parser.add_argument("--upscale-steps", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0, help="Seeds the request mix and the predictor seeds")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Seconds per request, including busy retries")
+    parser.add_argument("--no-retry-busy", action="store_true", help="Count 409 answers as errors instead of retrying")
+    parser.add_argument("--label", type=str, default="")
+    parser.add_argument("--output", type=str, default=None, help="Report path, load_test_<time>.json by default")
+    parser.add_argument("--compare", type=str, default=None, help="Earlier report to compare against")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    base_input = {
+        "prompt": PROMPT,
+        "steps": args.steps,
+        "upscale_steps": args.upscale_steps,
+        "seed": args.seed,
+        "output_format": "webp",
+    }
+    test = LoadTest(args.url, base_input, args.timeout, retry_busy=not args.no_retry_busy)
+    test.ids.extend(args.input_id)
+
+    # warm up the server, which also gives upscale-input requests an image
+    warmup = args.warmup or (1 if "upscale-input" in weights and not test.ids else 0)
+    if warmup:
+        print(f"Warming up with {warmup} base requests")
+        test.run_level(1, ["base"] * warmup, offset=-warmup)
+    if "upscale-input" in weights and not test.ids:
+        raise SystemExit("No image id for upscale-input requests, pass --input-id")
+
+    # the same sequence of request kinds for every level and every run
+    kinds = random.Random(args.seed).choices(list(weights), list(weights.values()), k=args.requests)
+
+    report = {
+        "version": 1,
+        "label": args.label,
+        "url": args.url,
+        "git_commit": git_commit(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "mix": weights,
+        "requests_per_level": args.requests,
+        "input": base_input,
+        "levels": [],
+    }
+    for concurrency in args.concurrency:
+        level = test.run_level(concurrency, kinds)
+        report["levels"].append(level)
+        print_level(level)
+
+    output = args.output or f"load_test_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Report written to {output}")
+
+    if args.compare:
+        with open(args.compare, "r") as file:
+            compare(report, json.load(file))
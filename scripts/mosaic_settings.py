@@ -1,12 +1,45 @@
 #!/usr/bin/env python3
+"""
+Sweep samplers and schedulers and lay the results out as a mosaic.
+
+Every result is cached under --cache-dir, keyed by the hash of the full
+request input (prompt, seed, sampler, scheduler, steps, cfg...). Only
+combinations missing from the cache are requested. An interrupted sweep
+therefore resumes where it stopped, and adding a sampler or scheduler only
+generates the new row or column.
+
+The cache keeps two small images per result, and never the full
+panorama:
+- a thumbnail, from the smallest one the predictor uploads that is at
+  least a cell wide
+- a center crop at the same size, cut from the smallest thumbnail that
+  covers it at full resolution, or else the largest one (raise the
+  predictor's THUMBNAIL_WIDTHS for sharper crops)
+
+The full panorama is only downloaded from predictors that upload no
+thumbnails.
+
+Cached cells are resized to --cell-width when the mosaic is laid out, so a
+cache is reused across cell widths.
+
+The mosaics are tiled from them into a preallocated canvas, so memory
+grows with the cell size and the grid, not with the panoramas:
+
+    ./scripts/mosaic_settings.py --samplers euler dpmpp_sde --schedulers karras beta
+    ./scripts/mosaic_settings.py --render-only
+"""
 
 import os
-import glob
-import requests
+import io
+import json
+import time
+import hashlib
+import argparse
+
 import numpy as np
+import requests
 from tqdm import tqdm
-import PIL.Image as Image
-import matplotlib.pyplot as plt
+from PIL import Image, ImageDraw
 
 samplers = [
     'euler',
@@ -30,100 +63,207 @@ schedulers = [
     'beta'
 ]
 
-# Seed for the model
-SEED = np.random.randint(2**20, 2**22)
+PROMPT = "Studio Ghibli-inspired scenic picture featuring gentle hills and mountains in the distance, serene forests with golden light, traditional architecture like shrines or temples, lanterns floating on ponds, magical foxes playing in fields, and sweeping landscapes. The sky should be painted with vivid colors including orange, pink, purple against clear blue skies"
+
+# zoomed view: a quarter of the panorama around a point left of the center
+ZOOM = 0.25
+ZOOM_OFFSET_X = -300
+
+LABEL_HEIGHT = 18
+HEADER = 24
+GAP = 4
+
+
+def cache_key(prediction_input):
+    return hashlib.sha256(json.dumps(prediction_input, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def cell_paths(cache_dir, key):
+    return {
+        "entry": os.path.join(cache_dir, f"{key}.json"),
+        "thumbnail": os.path.join(cache_dir, f"{key}_thumbnail.webp"),
+        "crop": os.path.join(cache_dir, f"{key}_crop.webp"),
+    }
+
+
+def fit(image, width):
+    """Resize to the cell size, width x width/2"""
+    size = (width, width // 2)
+    if image.size == size:
+        return image.convert("RGB")
+    image.draft("RGB", size)
+    return image.convert("RGB").resize(size, Image.BILINEAR)
+
+
+def center_crop(image, width):
+    """The zoomed region of a panorama, at the cell size"""
+    w, h = image.size
+    crop_w, crop_h = int(w * ZOOM), int(h * ZOOM)
+    x = min(max(w // 2 + ZOOM_OFFSET_X - crop_w // 2, 0), w - crop_w)
+    y = (h - crop_h) // 2
+    return fit(image.crop((x, y, x + crop_w, y + crop_h)), width)
 
-# Directory to save the generated images
-output_dir = 'images'
-os.makedirs(output_dir, exist_ok=True)
 
-for sampler in tqdm(samplers, desc="Generating images"):
-    for scheduler in schedulers:
-        data = {
-            "input": {
-                "prompt": "Studio Ghibli-inspired scenic picture featuring gentle hills and mountains in the distance, serene forests with golden light, traditional architecture like shrines or temples, lanterns floating on ponds, magical foxes playing in fields, and sweeping landscapes. The sky should be painted with vivid colors including orange, pink, purple against clear blue skies",
+def fetch(session, url, timeout, attempts=5):
+    """GET an output, which may still be uploading, retrying with backoff"""
+    for attempt in range(attempts):
+        try:
+            response = session.get(url, timeout=timeout)
+            response.raise_for_status()
+            return response
+        except requests.RequestException:
+            if attempt == attempts - 1:
+                raise
+        time.sleep(0.5 * (attempt + 1))
+
+
+def source_url(thumbnails, width, image_url):
+    """
+    Smallest thumbnail at least `width` wide, else the largest one, and the
+    full image only if there are no thumbnails
+    """
+    if not thumbnails:
+        return image_url
+    return next((thumbnails[w] for w in sorted(thumbnails) if w >= width), thumbnails[max(thumbnails)])
+
+
+def generate(url, prediction_input, cache_dir, width, session):
+    """Run one prediction and cache its thumbnail, center crop and timing"""
+    response = session.post(f"{url}/predictions", json={"input": prediction_input}, timeout=1800)
+    response.raise_for_status()
+    body = response.json()
+    if body.get("status") != "succeeded":
+        raise RuntimeError(body.get("error") or body.get("status"))
+    depth_url, image_url, metadata_url = body["output"][-3:]
+    metadata = fetch(session, metadata_url, timeout=60).json() if metadata_url else {}
+
+    paths = cell_paths(cache_dir, cache_key(prediction_input))
+    thumbnails = {int(w): t["url"] for w, t in (metadata.get("thumbnails") or {}).items()}
+    # the crop is a ZOOM wide part of the image it is cut from
+    sources = {
+        "thumbnail": source_url(thumbnails, width, image_url),
+        "crop": source_url(thumbnails, int(width / ZOOM), image_url),
+    }
+    images = {}
+    try:
+        for source in set(sources.values()):
+            images[source] = Image.open(io.BytesIO(fetch(session, source, timeout=300).content))
+        fit(images[sources["thumbnail"]], width).save(paths["thumbnail"], quality=90)
+        center_crop(images[sources["crop"]], width).save(paths["crop"], quality=90)
+    finally:
+        for image in images.values():
+            image.close()
+
+    entry = {
+        "input": prediction_input,
+        "predict_time": body.get("metrics", {}).get("predict_time"),
+        "image_url": image_url,
+        "metadata_url": metadata_url,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    with open(paths["entry"], "w") as file:
+        json.dump(entry, file, indent=2)
+    return entry
+
+
+def load_cell(cache_dir, key):
+    """Cached entry of a combination, or None if it hasn't been generated"""
+    paths = cell_paths(cache_dir, key)
+    if not all(os.path.exists(path) for path in paths.values()):
+        return None
+    with open(paths["entry"], "r") as file:
+        return json.load(file)
+
+
+def render_mosaic(grid, row_labels, column_labels, cache_dir, kind, width, path):
+    """
+    Tile the cached cells of one kind (thumbnail or crop) into a labelled
+    grid. grid[row][column] is a cache key, or None for a missing cell.
+    """
+    cell_h = width // 2
+    left = max(len(label) for label in row_labels) * 7 + 10
+    canvas = np.full(
+        (HEADER + len(row_labels) * (cell_h + LABEL_HEIGHT), left + len(column_labels) * (width + GAP), 3),
+        255, dtype=np.uint8
+    )
+
+    captions = []
+    for row, keys in enumerate(grid):
+        for column, key in enumerate(keys):
+            x = left + column * (width + GAP)
+            y = HEADER + row * (cell_h + LABEL_HEIGHT) + LABEL_HEIGHT
+            entry = load_cell(cache_dir, key) if key else None
+            if entry is None:
+                canvas[y:y + cell_h, x:x + width] = 200
+                captions.append((x + 4, y - LABEL_HEIGHT + 3, "missing"))
+                continue
+            with Image.open(cell_paths(cache_dir, key)[kind]) as cell:
+                # the cache may have been filled at another cell width
+                canvas[y:y + cell_h, x:x + width] = np.asarray(fit(cell, width))
+            predict_time = entry.get("predict_time")
+            captions.append((x + 4, y - LABEL_HEIGHT + 3, f"{predict_time:.2f}s" if predict_time else ""))
+
+    image = Image.fromarray(canvas)
+    draw = ImageDraw.Draw(image)
+    for column, label in enumerate(column_labels):
+        draw.text((left + column * (width + GAP) + 4, 6), label, fill=(0, 0, 0))
+    for row, label in enumerate(row_labels):
+        draw.text((4, HEADER + row * (cell_h + LABEL_HEIGHT) + LABEL_HEIGHT + cell_h // 2), label, fill=(0, 0, 0))
+    for x, y, text in captions:
+        draw.text((x, y), text, fill=(80, 80, 80))
+    image.save(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sampler/scheduler sweep with cached results")
+    parser.add_argument("--url", type=str, default=f"http://localhost:{os.environ.get('INTERNAL_PORT', 5000)}")
+    parser.add_argument("--samplers", type=str, nargs="+", default=samplers)
+    parser.add_argument("--schedulers", type=str, nargs="+", default=schedulers)
+    parser.add_argument("--prompt", type=str, default=PROMPT)
+    parser.add_argument("--seed", type=int, default=2**21, help="Fixed so cached results are reused across runs")
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--cfg", type=float, default=3.20)
+    parser.add_argument("--cell-width", type=int, default=512, help="Width of a mosaic cell in pixels")
+    parser.add_argument("--output-dir", type=str, default="images")
+    parser.add_argument("--cache-dir", type=str, default=None, help="Defaults to <output-dir>/sweep_cache")
+    parser.add_argument("--render-only", action="store_true", help="Only lay out what is cached")
+    args = parser.parse_args()
+
+    cache_dir = args.cache_dir or os.path.join(args.output_dir, "sweep_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    grid = []
+    session = requests.Session()
+    missing = []
+    for sampler in args.samplers:
+        row = []
+        for scheduler in args.schedulers:
+            prediction_input = {
+                "prompt": args.prompt,
                 "suffix_prompt": "equirectangular, 360 panorama",
                 "negative_prompt": "boring, text, signature, watermark, low quality, bad quality, grainy, blurry",
-                #"width": 2048,
-                #"height": 1024,
-                "seed": SEED,
-                #"lora_strength": 1.0,
-                "cfg": 3.20,
-                "steps": 10,
+                "seed": args.seed,
+                "cfg": args.cfg,
+                "steps": args.steps,
                 "sampler": sampler,
                 "scheduler": scheduler,
-                # "upscale_by": 0.0,
-                # "upscale_steps": 10,
-                # "upscale_sampler": "dpmpp_sde_gpu",
-                # "upscale_scheduler": "karras",
-                # "upscale_denoise": 0.3,
-                # "upscale_seed": -1,
                 "output_format": "webp"
             }
-        }
-
-        response = requests.post(
-            f"http://localhost:{os.environ.get('INTERNAL_PORT',5000)}/predictions",
-            headers={"Content-Type": "application/json"},
-            json=data
-        ).json()
-
-        depth_url, image_url, _ = response['output']
-        predict_time = response['metrics']['predict_time']
-        image_response = requests.get(image_url)
-        
-        # Format the predict_time as a string in the filename
-        output_filename = f"{sampler}_{scheduler}_{predict_time:.2f}s.webp"
-        
-        with open(os.path.join(output_dir, output_filename), 'wb') as f:
-            f.write(image_response.content)
-
-# Load the images into a list
-images = []
-for sampler in samplers:
-    for scheduler in schedulers:
-        img_path = os.path.join(output_dir, f"{sampler}_{scheduler}_*.webp")
-        matching_files = glob.glob(img_path)
-        if matching_files:
-            img = Image.open(matching_files[0])
-            images.append(img)
-
-
-# Create a grid of images
-fig, axs = plt.subplots(len(samplers), len(schedulers), figsize=(20, 20))
-axs = axs.flatten()
-
-for ax, img in zip(axs, images):
-    ax.imshow(img, aspect='auto', interpolation='none', origin='upper')
-    # Extract basename without extension and prediction timestamp from filename
-    basename_without_extension = os.path.splitext(os.path.basename(img.filename))[0]
-    ax.set_title(basename_without_extension, fontsize=10)
-    ax.axis('off')
-
-plt.tight_layout()
-plt.savefig(os.path.join(output_dir, 'mosaic.png'), dpi=420)
-plt.close()
-
-
-# Create a grid of images zoomed in
-fig, axs = plt.subplots(len(samplers), len(schedulers), figsize=(20, 20))
-axs = axs.flatten()
-
-for ax, img in zip(axs, images):
-    ax.imshow(img, aspect='auto', interpolation='none', origin='upper')
-    # middle of image
-    x = img.width // 2 - 300
-    y = img.height // 2 
-    # zoom in
-    zoom = 0.25
-    ax.set_xlim(x - img.width * zoom / 2, x + img.width * zoom / 2)
-    ax.set_ylim(y + img.height * zoom / 2, y - img.height * zoom / 2)
-
-    # Extract basename without extension and prediction timestamp from filename
-    basename_without_extension = os.path.splitext(os.path.basename(img.filename))[0]
-    ax.set_title(basename_without_extension, fontsize=10)
-    ax.axis('off')
-
-plt.tight_layout()
-plt.savefig(os.path.join(output_dir, 'mosaic_zoomed.png'), dpi=420)
-plt.close()
\ No newline at end of file
+            key = cache_key(prediction_input)
+            row.append(key)
+            if load_cell(cache_dir, key) is None:
+                missing.append((sampler, scheduler, prediction_input))
+        grid.append(row)
+
+    print(f"{len(args.samplers) * len(args.schedulers) - len(missing)} cached, {len(missing)} to generate")
+    if not args.render_only:
+        for sampler, scheduler, prediction_input in tqdm(missing, desc="Generating images"):
+            try:
+                generate(args.url, prediction_input, cache_dir, args.cell_width, session)
+            except Exception as e:
+                print(f"Failed {sampler}/{scheduler}: {e}")
+
+    for kind, name in (("thumbnail", "mosaic.png"), ("crop", "mosaic_zoomed.png")):
+        path = os.path.join(args.output_dir, name)
+        render_mosaic(grid, args.samplers, args.schedulers, cache_dir, kind, args.cell_width, path)
+        print(f"Saved {path}")
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Lightweight stand-in for the ComfyUI server, for exercising the client,
+backend pool and benchmarks on CPU-only machines.
+
+It accepts the same command line flags as ComfyUI/main.py and implements the
+parts of the API the predictor uses: /prompt, /queue, /interrupt, /history
+and the /ws progress websocket. Each node of a queued prompt "executes" for
+--node-time seconds; SaveImage nodes write a small PNG to the output directory
+and SaveDepthRaw nodes a float16 .npy. Loader nodes take --load-time seconds
+instead, unless the previous prompt loaded the same model: like ComfyUI, they
+are then reported in execution_cached and not run again.
+
+Use it in place of ComfyUI with ComfyUI(..., main_script="scripts/stub_comfyui.py").
+"""
+
+import os
+import json
+import time
+import uuid
+import zlib
+import base64
+import struct
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+WS_MAGIC = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# nodes whose outputs (model weights) stay cached between prompts
+LOADERS = {"CheckpointLoaderSimple", "ControlNetLoader", "UpscaleModelLoader", "VAELoader", "LoraLoader", "DepthAnything_V2"}
+
+
+def png_bytes(width, height, color=(128, 128, 128)):
+    """Encode a solid RGB image as PNG using only the standard library"""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    row = b"\x00" + bytes(color) * width
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(row * height))
+        + chunk(b"IEND", b"")
+    )
+
+
+def npy_bytes(width, height):
+    """Encode a float16 depth ramp as a .npy file using only the standard library"""
+    header = f"{{'descr': '<f2', 'fortran_order': False, 'shape': ({height}, {width}), }}"
+    header += " " * (63 - (len(header) + 10) % 64) + "\n"
+    row = struct.pack(f"<{width}e", *(x / width for x in range(width)))
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode() + row * height
+
+
+class StubComfyUI:
+    def __init__(self, output_directory, node_time, image_size, load_time=0.0):
+        self.output_directory = output_directory
+        self.node_time = node_time
+        self.image_size = image_size
+        self.load_time = load_time
+        self.loaded = set()  # loader nodes of the previous prompt, as (class_type, inputs)
+
+        self.lock = threading.Condition()
+        self.clients = {}  # client_id -> websocket handler
+        self.pending = []  # (prompt_id, prompt, client_id)
+        self.running = None
+        self.interrupted = False
+        self.history = {}
+        self.counters = {}
+
+        threading.Thread(target=self.worker, daemon=True).start()
+
+    def send(self, client_id, message):
+        handler = self.clients.get(client_id)
+        if handler is None:
+            return
+        try:
+            handler.send_ws_text(json.dumps(message))
+        except OSError:
+            self.clients.pop(client_id, None)
+
+    def save_image(self, prefix, extension="png", data=None):
+        subfolder, _, name = prefix.rpartition("/")
+        directory = os.path.join(self.output_directory, subfolder)
+        os.makedirs(directory, exist_ok=True)
+        count = self.counters.get(prefix, 0) + 1
+        self.counters[prefix] = count
+        filename = f"{name}_{count:05d}_.{extension}"
+        with open(os.path.join(directory, filename), "wb") as f:
+            f.write(data or png_bytes(*self.image_size))
+        return {"filename": filename, "subfolder": subfolder, "type": "output"}
+
+    def worker(self):
+        while True:
+            with self.lock:
+                while not self.pending:
+                    self.lock.wait()
+                prompt_id, prompt, client_id = self.pending.pop(0)
+                self.running = (prompt_id, prompt, client_id)
+                self.interrupted = False
+
+            loaders = {
+                node_id: (node["class_type"], json.dumps(node.get("inputs", {}), sort_keys=True))
+                for node_id, node in prompt.items() if node.get("class_type") in LOADERS
+            }
+            cached = [node_id for node_id, loader in loaders.items() if loader in self.loaded]
+            self.loaded = set(loaders.values())
+            if cached:
+                self.send(client_id, {"type": "execution_cached", "data": {"nodes": cached, "prompt_id": prompt_id}})
+
+            outputs = {}
+            for node_id, node in prompt.items():
+                if self.interrupted:
+                    break
+                if node_id in cached:
+                    continue
+                self.send(client_id, {"type": "executing", "data": {"node": node_id, "prompt_id": prompt_id}})
+                time.sleep(self.load_time if node_id in loaders else self.node_time)
+                if node.get("class_type") == "SaveImage":
+                    image = self.save_image(node["inputs"].get("filename_prefix", "ComfyUI"))
+                    outputs[node_id] = {"images": [image]}
+                    self.send(client_id, {"type": "executed", "data": {"node": node_id, "output": outputs[node_id], "prompt_id": prompt_id}})
+                elif node.get("class_type") == "SaveDepthRaw":
+                    depth = self.save_image(node["inputs"].get("filename_prefix", "depth_raw"), "npy", npy_bytes(*self.image_size))
+                    outputs[node_id] = {"depth": [depth]}
+
+            with self.lock:
+                self.running = None
+                self.history[prompt_id] = {
+                    "outputs": outputs,
+                    "status": {"status_str": "success", "completed": not self.interrupted, "messages": []},
+                }
+
+            if self.interrupted:
+                self.send(client_id, {"type": "execution_interrupted", "data": {"prompt_id": prompt_id}})
+            self.send(client_id, {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "StubComfyUI/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def send_ws_text(self, text):
+        payload = text.encode("utf-8")
+        header = bytes([0x81])
+        if len(payload) < 126:
+            header += bytes([len(payload)])
+        elif len(payload) < 2**16:
+            header += bytes([126]) + struct.pack(">H", len(payload))
+        else:
+            header += bytes([127]) + struct.pack(">Q", len(payload))
+        with self.ws_lock:
+            self.wfile.write(header + payload)
+            self.wfile.flush()
+
+    def handle_websocket(self, client_id):
+        key = self.headers["Sec-WebSocket-Key"]
+        accept = base64.b64encode(hashlib.sha1((key + WS_MAGIC).encode()).digest()).decode()
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.ws_lock = threading.Lock()
+
+        stub = self.server.stub
+        stub.clients[client_id] = self
+        self.send_ws_text(json.dumps({"type": "status", "data": {"sid": client_id}}))
+
+        # hold the connection open until the client closes it
+        while True:
+            header = self.rfile.read(2)
+            if len(header) < 2 or header[0] & 0x0F == 0x8:
+                break
+            length = header[1] & 0x7F
+            if length == 126:
+                length = struct.unpack(">H", self.rfile.read(2))[0]
+            elif length == 127:
+                length = struct.unpack(">Q", self.rfile.read(8))[0]
+            self.rfile.read(4 + length if header[1] & 0x80 else length)
+        stub.clients.pop(client_id, None)
+
+    def do_GET(self):
+        stub = self.server.stub
+        url = urlparse(self.path)
+
+        if url.path == "/ws":
+            client_id = parse_qs(url.query).get("clientId", [str(uuid.uuid4())])[0]
+            return self.handle_websocket(client_id)
+
+        if url.path == "/queue":
+            with stub.lock:
+                running = [[0, stub.running[0]]] if stub.running else []
+                pending = [[i + 1, p[0]] for i, p in enumerate(stub.pending)]
+            return self.send_json({"queue_running": running, "queue_pending": pending})
+
+        if url.path.startswith("/history/"):
+            prompt_id = url.path[len("/history/"):]
+            with stub.lock:
+                entry = stub.history.get(prompt_id)
+            return self.send_json({prompt_id: entry} if entry else {})
+
+        self.send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        stub = self.server.stub
+        url = urlparse(self.path)
+        data = self.read_json()
+
+        if url.path == "/prompt":
+            prompt_id = str(uuid.uuid4())
+            with stub.lock:
+                stub.pending.append((prompt_id, data["prompt"], data.get("client_id")))
+                stub.lock.notify_all()
+                number = len(stub.pending)
+            return self.send_json({"prompt_id": prompt_id, "number": number, "node_errors": {}})
+
+        if url.path == "/queue":
+            with stub.lock:
+                if data.get("clear"):
+                    stub.pending.clear()
+                if data.get("delete"):
+                    stub.pending = [p for p in stub.pending if p[0] not in data["delete"]]
+            return self.send_json({})
+
+        if url.path == "/interrupt":
+            stub.interrupted = True
+            return self.send_json({})
+
+        self.send_json({"error": "not found"}, status=404)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub ComfyUI server")
+    parser.add_argument("--listen", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--output-directory", type=str, default="/tmp/outputs")
+    parser.add_argument("--input-directory", type=str, default="/tmp/inputs")
+    parser.add_argument("--temp-directory", type=str, default=None)
+    parser.add_argument("--cuda-device", type=int, default=None)
+    parser.add_argument("--disable-metadata", action="store_true")
+    parser.add_argument("--node-time", type=float, default=float(os.environ.get("STUB_NODE_TIME", 0.01)),
+                        help="Seconds each node takes to execute")
+    parser.add_argument("--load-time", type=float, default=float(os.environ.get("STUB_LOAD_TIME", 0)),
+                        help="Seconds a loader node takes when its model isn't cached from the previous prompt")
+    parser.add_argument("--image-size", type=int, nargs=2, default=[256, 128],
+                        help="Width and height of images written by SaveImage nodes")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_directory, exist_ok=True)
+    os.makedirs(args.input_directory, exist_ok=True)
+
+    server = ThreadingHTTPServer((args.listen, args.port), Handler)
+    server.daemon_threads = True
+    server.stub = StubComfyUI(args.output_directory, args.node_time, tuple(args.image_size), args.load_time)
+    print(f"Stub ComfyUI listening on {args.listen}:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Lightweight stand-in for the cog HTTP server, for running the load test
+harness on CPU-only machines.
+
+POST /predictions sleeps for the time configured for the request's workflow
+(base, upscale or upscale-input, picked from the input the same way
+predict.py does). It answers like cog: an output holding the depth, image
+and metadata URLs, plus metrics.predict_time. Like cog, it runs
+--concurrency predictions at a time and answers 409 when all of them are
+busy. The URLs point back at this server. Its metadata.json carries
+per-stage timings that add up to the predict time. --error-rate makes a
+share of predictions fail.
+
+    python scripts/stub_predictor.py --port 5000 --base-time 2 --upscale-time 8
+    python scripts/load_test.py --url http://localhost:5000 --concurrency 1 2 4
+
+With --comfyui-backends, predictions instead run a small workflow per
+request kind on a pool of scripts/stub_comfyui.py servers, ordered by the
+AffinityScheduler like predict.py does (first come, first served with
+--no-affinity). Loader nodes cost --load-time unless the server ran the
+same model for its previous prompt, and metadata.json counts the cached
+and executed nodes and the models loaded, so scheduling can be compared by
+its cache hits:
+
+    python scripts/stub_predictor.py --concurrency 8 --comfyui-backends 2 --load-time 1
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import atexit
+import random
+import argparse
+import tempfile
+import threading
+from urllib.parse import urlparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from stub_comfyui import png_bytes, LOADERS
+
+# share of the predict time spent in each stage
+STAGES = {
+    "base": {"workflow_load": 0.01, "queue": 0.04, "execution": 0.85, "finalize": 0.06, "upload": 0.04},
+    "upscale": {"workflow_load": 0.01, "queue": 0.02, "execution": 0.90, "finalize": 0.04, "upload": 0.03},
+    "upscale-input": {"input": 0.05, "workflow_load": 0.01, "queue": 0.02, "execution": 0.85, "finalize": 0.03, "upload": 0.03},
+}
+
+
+# the same checkpoint for every kind, the upscalers only for upscales
+CHECKPOINT = {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "dreamshaperXL_v21TurboDPMSDE.safetensors"}}
+UPSCALERS = {
+    "11": {"class_type": "UpscaleModelLoader", "inputs": {"model_name": "4x-UltraSharp.pth"}},
+    "12": {"class_type": "ControlNetLoader", "inputs": {"control_net_name": "controlnet-tile-sdxl.safetensors"}},
+    "13": {"class_type": "KSampler", "inputs": {}},
+    "14": {"class_type": "VAEDecode", "inputs": {}},
+    "15": {"class_type": "SaveImage", "inputs": {"filename_prefix": "upscaled"}},
+}
+WORKFLOWS = {
+    "base": {
+        "1": CHECKPOINT,
+        "2": {"class_type": "CLIPTextEncode", "inputs": {}},
+        "3": {"class_type": "KSampler", "inputs": {}},
+        "4": {"class_type": "VAEDecode", "inputs": {}},
+        "5": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI"}},
+    },
+}
+WORKFLOWS["upscale"] = {**WORKFLOWS["base"], **UPSCALERS}
+WORKFLOWS["upscale-input"] = {
+    "1": CHECKPOINT,
+    "2": {"class_type": "CLIPTextEncode", "inputs": {}},
+    "10": {"class_type": "LoadImage", "inputs": {"image": "input.png"}},
+    **UPSCALERS,
+}
+
+
+def workflow_key(prediction_input):
+    if prediction_input.get("input_file") or prediction_input.get("input_file_id"):
+        return "upscale-input"
+    if float(prediction_input.get("upscale_by", 0)) > 1:
+        return "upscale"
+    return "base"
+
+
+class StubPredictor:
+    def __init__(self, times, jitter, error_rate, concurrency, pool=None, scheduler=None, affinity=True):
+        self.times = times
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.pool = pool
+        self.scheduler = scheduler
+        self.affinity = affinity
+        self.metadata = {}  # id -> metadata
+        self.lock = threading.Lock()
+        self.random = random.Random(0)
+
+    def predict(self, prediction_input, base_url):
+        key = workflow_key(prediction_input)
+        with self.lock:
+            duration = max(0.0, self.times[key] * (1 + self.random.uniform(-self.jitter, self.jitter)))
+            fail = self.random.random() < self.error_rate
+            image_id = uuid.uuid4().hex
+
+        start = time.time()
+        if self.pool is not None:
+            timings, cache_stats = self.run_workflow(key)
+        else:
+            time.sleep(duration)
+            timings = {stage: round(duration * share, 4) for stage, share in STAGES[key].items()}
+            cache_stats = {"cached_nodes": 0, "executed_nodes": 12}
+        if fail:
+            raise RuntimeError("Stub prediction failed")
+
+        metadata = {
+            "id": image_id,
+            **{name: value for name, value in prediction_input.items() if isinstance(value, (str, int, float))},
+            "image_url": f"{base_url}/files/{image_id}/image.png",
+            "depth_url": f"{base_url}/files/{image_id}/depth.png",
+            "timings": timings,
+            **cache_stats,
+        }
+        with self.lock:
+            self.metadata[image_id] = metadata
+        output = [metadata["depth_url"], metadata["image_url"], f"{base_url}/files/{image_id}/metadata.json"]
+        return output, time.time() - start
+
+    def run_workflow(self, key):
+        """Run the workflow of a request kind on the pool, the way predict.py schedules it"""
+        workflow = json.loads(json.dumps(WORKFLOWS[key]))
+        loaders = {node_id for node_id, node in workflow.items() if node["class_type"] in LOADERS}
+        cache_stats = {"cached_nodes": 0, "executed_nodes": 0, "model_loads": 0}
+        executed = threading.Event()
+        start = time.time()
+        # without affinity the scheduler is first come, first served and the pool only balances load
+        with self.scheduler.slot(key) as release_slot, \
+                self.pool.backend(key if self.affinity else None, executed) as comfyUI, \
+                comfyUI.request_context() as context:
+            scheduled = time.time()
+            context.connect()
+            for event in comfyUI.run_workflow_iter(context.prepare_workflow(workflow), context):
+                if event["type"] == "cached":
+                    cache_stats["cached_nodes"] += len(event["nodes"])
+                elif event["type"] == "executing":
+                    cache_stats["executed_nodes"] += 1
+                    cache_stats["model_loads"] += event["node"] in loaders
+            executed.set()
+            release_slot()
+        timings = {"schedule": round(scheduled - start, 4), "execution": round(time.time() - scheduled, 4)}
+        return timings, cache_stats
+
+
+def start_pool(size, base_port, node_time, load_time):
+    """Launch stub ComfyUI servers behind the predictor's pool"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, root)
+    from comfyui_pool import ComfyUIPool
+
+    os.environ["STUB_NODE_TIME"] = str(node_time)
+    os.environ["STUB_LOAD_TIME"] = str(load_time)
+    directory = tempfile.mkdtemp(prefix="stub_predictor_")
+    pool = ComfyUIPool(
+        size,
+        os.path.join(directory, "outputs"),
+        os.path.join(directory, "inputs"),
+        base_port=base_port,
+        main_script=os.path.join(root, "scripts", "stub_comfyui.py")
+    )
+    atexit.register(lambda: [backend.stop_server() for backend in pool.backends])
+    pool.start()
+    return pool
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "StubPredictor/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data, status=200):
+        self.send_body(json.dumps(data).encode("utf-8"), "application/json", status)
+
+    def do_POST(self):
+        stub = self.server.stub
+        if urlparse(self.path).path.rstrip("/") != "/predictions":
+            return self.send_json({"detail": "Not Found"}, status=404)
+
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length)) if length else {}
+        prediction_input = request.get("input", {})
+
+        if not stub.slots.acquire(blocking=False):
+            return self.send_json({"detail": "Already running a prediction"}, status=409)
+        try:
+            host = self.headers.get("Host", f"localhost:{self.server.server_port}")
+            output, predict_time = stub.predict(prediction_input, f"http://{host}")
+            response = {"status": "succeeded", "output": output, "metrics": {"predict_time": predict_time}}
+        except Exception as e:
+            response = {"status": "failed", "output": None, "error": str(e), "metrics": {}}
+        finally:
+            stub.slots.release()
+        self.send_json({"id": request.get("id") or uuid.uuid4().hex, "input": prediction_input, **response})
+
+    def do_GET(self):
+        stub = self.server.stub
+        path = urlparse(self.path).path
+        if path == "/health-check":
+            return self.send_json({"status": "READY"})
+
+        if path.startswith("/files/"):
+            image_id, _, name = path[len("/files/"):].partition("/")
+            with stub.lock:
+                metadata = stub.metadata.get(image_id)
+            if metadata and name == "metadata.json":
+                return self.send_json(metadata)
+            if metadata:
+                return self.send_body(png_bytes(64, 32), "image/png")
+
+        self.send_json({"detail": "Not Found"}, status=404)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub cog predictor server")
+    parser.add_argument("--listen", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--base-time", type=float, default=2.0, help="Seconds per base prediction")
+    parser.add_argument("--upscale-time", type=float, default=8.0, help="Seconds per upscale from a prompt")
+    parser.add_argument("--upscale-input-time", type=float, default=6.0, help="Seconds per upscale of an input image")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Relative random variation of the times")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of predictions that fail")
+    parser.add_argument("--concurrency", type=int, default=1, help="Predictions run at once, like cog's max concurrency")
+    parser.add_argument("--comfyui-backends", type=int, default=0, help="Run workflows on this many stub ComfyUI servers")
+    parser.add_argument("--comfyui-port", type=int, default=8188, help="Port of the first stub ComfyUI server")
+    parser.add_argument("--node-time", type=float, default=0.05, help="Seconds per workflow node on the stub servers")
+    parser.add_argument("--load-time", type=float, default=1.0, help="Seconds per loader node whose model isn't cached")
+    parser.add_argument("--no-affinity", action="store_true", help="Schedule first come, first served")
+    args = parser.parse_args()
+
+    pool = scheduler = None
+    if args.comfyui_backends:
+        pool = start_pool(args.comfyui_backends, args.comfyui_port, args.node_time, args.load_time)
+        from scheduler import AffinityScheduler
+
+        scheduler = AffinityScheduler(capacity=args.comfyui_backends)
+        if args.no_affinity:
+            # the oldest request always goes next
+            scheduler.max_wait = 0
+
+    server = ThreadingHTTPServer((args.listen, args.port), Handler)
+    server.daemon_threads = True
+    server.stub = StubPredictor(
+        {"base": args.base_time, "upscale": args.upscale_time, "upscale-input": args.upscale_input_time},
+        args.jitter, args.error_rate, args.concurrency,
+        pool, scheduler, affinity=not args.no_affinity
+    )
+    print(f"Stub predictor listening on {args.listen}:{args.port}")
+    server.serve_forever()
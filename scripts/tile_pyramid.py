@@ -0,0 +1,125 @@
+import os
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+from equilib import Equi2Cube
+
+from scripts.crop_animation import load_image
+
+# Pannellum's face letters and the matching equilib cube keys
+FACES = {"f": "F", "r": "R", "b": "B", "l": "L", "u": "U", "d": "D"}
+
+
+def cube_faces(equi_img, face_size):
+    """Remap an equirectangular (C, H, W) image to six square PIL faces"""
+    equi2cube = Equi2Cube(w_face=face_size, cube_format="dict", mode="bilinear")
+    cube = equi2cube(equi=equi_img, rots={'roll': 0.0, 'pitch': 0.0, 'yaw': 0.0})
+    return {
+        name: Image.fromarray(np.ascontiguousarray(np.transpose(cube[key], (1, 2, 0))))
+        for name, key in FACES.items()
+    }
+
+
+def level_sizes(face_size, tile_size):
+    """Face resolution of every zoom level, level 1 being the smallest"""
+    max_level = max(1, math.ceil(math.log2(face_size / tile_size)) + 1)
+    return {
+        level: math.ceil(face_size / 2 ** (max_level - level))
+        for level in range(1, max_level + 1)
+    }
+
+
+def create_tile_pyramid(input_path, output_dir, tile_size=512, face_size=None, quality=85, workers=8):
+    """
+    Cut an equirectangular panorama into a multi-resolution cube-map tile pyramid.
+
+    Tiles are written as {level}/{face}{y}_{x}.webp next to a manifest.json in
+    the multiRes format of Pannellum, so a viewer only fetches the tiles that
+    are visible at the current zoom.
+
+    Args:
+        input_path (str): Path to input equirectangular image
+        output_dir (str): Directory for tiles and manifest
+        tile_size (int): Width and height of every full tile
+        face_size (int): Cube face resolution at the deepest level (optional,
+            defaults to the equirectangular width / pi, which keeps full detail)
+        quality (int): WebP quality of the tiles
+        workers (int): Tiles encoded in parallel
+    """
+    equi_img = load_image(input_path)
+    if face_size is None:
+        face_size = int(equi_img.shape[2] / math.pi) // 8 * 8
+
+    faces = cube_faces(equi_img, face_size)
+    del equi_img
+    sizes = level_sizes(face_size, tile_size)
+
+    tiles = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        # deepest level first, each level halving the one before it
+        for level in sorted(sizes, reverse=True):
+            size = sizes[level]
+            os.makedirs(os.path.join(output_dir, str(level)), exist_ok=True)
+            for name, face in faces.items():
+                if face.size != (size, size):
+                    face = face.reduce(2) if face.width == 2 * size else face.resize((size, size), Image.BILINEAR)
+                    faces[name] = face
+
+                for y in range(math.ceil(size / tile_size)):
+                    for x in range(math.ceil(size / tile_size)):
+                        box = (x * tile_size, y * tile_size, min((x + 1) * tile_size, size), min((y + 1) * tile_size, size))
+                        tile = face.crop(box)
+                        path = f"{level}/{name}{y}_{x}.webp"
+                        futures.append(pool.submit(tile.save, os.path.join(output_dir, path), quality=quality))
+                        tiles.append(path)
+
+        for future in futures:
+            future.result()
+
+    manifest = {
+        "type": "multires",
+        "multiRes": {
+            "path": "/%l/%s%y_%x",
+            "extension": "webp",
+            "tileResolution": tile_size,
+            "maxLevel": max(sizes),
+            "cubeResolution": face_size
+        },
+        "levels": sizes,
+        "tiles": tiles
+    }
+    with open(os.path.join(output_dir, "manifest.json"), "w") as file:
+        file.write(json.dumps(manifest, indent=4))
+
+    print(f"Created {len(tiles)} tiles over {len(sizes)} levels")
+    return manifest
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate a cube-map tile pyramid from an equirectangular image')
+    parser.add_argument('--input_path', type=str, required=True,
+                        help='Path to the input equirectangular image')
+    parser.add_argument('--output_dir', type=str, default='tiles',
+                        help='Directory to store tiles (default: tiles)')
+    parser.add_argument('--tile_size', type=int, default=512,
+                        help='Tile width and height (default: 512)')
+    parser.add_argument('--face_size', type=int, default=None,
+                        help='Cube face resolution (default: image width / pi)')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.input_path):
+        print(f"Error: Input file '{args.input_path}' does not exist.")
+        exit(1)
+
+    create_tile_pyramid(
+        input_path=args.input_path,
+        output_dir=args.output_dir,
+        tile_size=args.tile_size,
+        face_size=args.face_size
+    )
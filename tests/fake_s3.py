@@ -0,0 +1,146 @@
+import io
+import hashlib
+import datetime
+from collections import Counter
+from types import SimpleNamespace
+
+from minio.error import S3Error
+
+
+class FakeS3:
+    """
+    In-process stand-in for the Minio client: buckets of in-memory objects,
+    with every call counted in `calls`. fail() makes the next call of an
+    operation raise an S3Error. Objects uploaded in parts report S3's
+    multipart ETag.
+    """
+
+    def __init__(self):
+        self.buckets = {}  # bucket -> {name: (data, last modified)}
+        self.etags = {}  # (bucket, name) -> ETag of objects uploaded in parts
+        self.uploads = {}  # upload id -> {part number: data}
+        self.lifecycles = {}
+        self.calls = Counter()
+        self.failures = {}  # operation -> S3Error codes to raise, in order
+
+    def fail(self, operation: str, code: str = "InternalError"):
+        self.failures.setdefault(operation, []).append(code)
+
+    def record(self, operation: str, bucket: str = None, name: str = None):
+        self.calls[operation] += 1
+        if self.failures.get(operation):
+            raise self.error(self.failures[operation].pop(0), bucket, name)
+
+    @staticmethod
+    def error(code: str, bucket: str = None, name: str = None) -> S3Error:
+        return S3Error(
+            response=None, code=code, message=code, resource=f"/{bucket}/{name or ''}",
+            request_id="fake", host_id="fake", bucket_name=bucket, object_name=name
+        )
+
+    def objects(self, bucket: str, name: str = None) -> dict:
+        if bucket not in self.buckets:
+            raise self.error("NoSuchBucket", bucket, name)
+        return self.buckets[bucket]
+
+    def get(self, bucket: str, name: str):
+        objects = self.objects(bucket, name)
+        if name not in objects:
+            raise self.error("NoSuchKey", bucket, name)
+        data, modified = objects[name]
+        etag = self.etags.get((bucket, name)) or hashlib.md5(data).hexdigest()
+        return SimpleNamespace(object_name=name, size=len(data), etag=f'"{etag}"', last_modified=modified), data
+
+    def bucket_exists(self, bucket):
+        self.record("bucket_exists", bucket)
+        return bucket in self.buckets
+
+    def make_bucket(self, bucket):
+        self.record("make_bucket", bucket)
+        self.buckets.setdefault(bucket, {})
+
+    def list_buckets(self):
+        self.record("list_buckets")
+        return [SimpleNamespace(name=bucket, creation_date=None) for bucket in self.buckets]
+
+    def set_bucket_policy(self, bucket, policy):
+        self.record("set_bucket_policy", bucket)
+
+    def get_bucket_lifecycle(self, bucket):
+        self.record("get_bucket_lifecycle", bucket)
+        self.objects(bucket)
+        return self.lifecycles.get(bucket)
+
+    def set_bucket_lifecycle(self, bucket, config):
+        self.record("set_bucket_lifecycle", bucket)
+        self.objects(bucket)
+        self.lifecycles[bucket] = config
+
+    def put_object(self, bucket_name, object_name, data, length, content_type=None):
+        self.record("put_object", bucket_name, object_name)
+        self.etags.pop((bucket_name, object_name), None)
+        self.objects(bucket_name, object_name)[object_name] = (data.read(length), datetime.datetime.now(datetime.timezone.utc))
+
+    def fput_object(self, bucket, name, path, content_type=None):
+        self.record("fput_object", bucket, name)
+        self.etags.pop((bucket, name), None)
+        with open(path, "rb") as file:
+            self.objects(bucket, name)[name] = (file.read(), datetime.datetime.now(datetime.timezone.utc))
+
+    def _create_multipart_upload(self, bucket, name, headers):
+        self.record("_create_multipart_upload", bucket, name)
+        self.objects(bucket, name)
+        upload_id = f"upload-{len(self.uploads) + 1}"
+        self.uploads[upload_id] = {}
+        return upload_id
+
+    def _upload_part(self, bucket, name, data, headers, upload_id, part_number):
+        self.record("_upload_part", bucket, name)
+        self.uploads[upload_id][part_number] = data
+        return f'"{hashlib.md5(data).hexdigest()}"'
+
+    def _complete_multipart_upload(self, bucket, name, upload_id, parts):
+        self.record("_complete_multipart_upload", bucket, name)
+        uploaded = self.uploads.pop(upload_id)
+        data = b"".join(uploaded[part.part_number] for part in parts)
+        # S3's multipart ETag: the MD5 of the part MD5s and the part count
+        digests = b"".join(hashlib.md5(uploaded[part.part_number]).digest() for part in parts)
+        self.etags[(bucket, name)] = f"{hashlib.md5(digests).hexdigest()}-{len(parts)}"
+        self.objects(bucket, name)[name] = (data, datetime.datetime.now(datetime.timezone.utc))
+        return SimpleNamespace(etag=self.etags[(bucket, name)])
+
+    def _abort_multipart_upload(self, bucket, name, upload_id):
+        self.record("_abort_multipart_upload", bucket, name)
+        self.uploads.pop(upload_id, None)
+
+    def fget_object(self, bucket, name, path):
+        self.record("fget_object", bucket, name)
+        _, data = self.get(bucket, name)
+        with open(path, "wb") as file:
+            file.write(data)
+
+    def get_object(self, bucket, name):
+        self.record("get_object", bucket, name)
+        _, data = self.get(bucket, name)
+        stream = io.BytesIO(data)
+        return SimpleNamespace(data=data, read=stream.read, close=stream.close, release_conn=lambda: None)
+
+    def stat_object(self, bucket, name):
+        self.record("stat_object", bucket, name)
+        return self.get(bucket, name)[0]
+
+    def list_objects(self, bucket, prefix=None, recursive=False, start_after=None):
+        self.record("list_objects", bucket)
+        for name in sorted(self.objects(bucket)):
+            if prefix and not name.startswith(prefix):
+                continue
+            if start_after is not None and name <= start_after:
+                continue
+            if not recursive and "/" in name[len(prefix or ""):]:
+                continue
+            yield self.get(bucket, name)[0]
+
+    def presigned_get_object(self, bucket, name, expires=None):
+        self.record("presigned_get_object", bucket, name)
+        signature = self.calls["presigned_get_object"]
+        return f"http://fake/{bucket}/{name}?X-Amz-Expires={int(expires.total_seconds())}&X-Amz-Signature={signature}"
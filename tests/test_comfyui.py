@@ -0,0 +1,98 @@
+import json
+import socket
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+import websocket
+
+from comfyui import ComfyUI, PromptTimeoutError
+
+WORKFLOW = {"1": {"class_type": "KSampler", "inputs": {}}}
+
+
+class Handler(BaseHTTPRequestHandler):
+    """/history/{prompt_id} and /queue of a ComfyUI server"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith("/history/"):
+            prompt_id = self.path.rpartition("/")[2]
+            body = {prompt_id: self.server.history[prompt_id]} if prompt_id in self.server.history else {}
+        else:
+            body = {"queue_running": [], "queue_pending": []}
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class Socket:
+    """A websocket whose recv raises the given exceptions in turn"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv(self):
+        raise self.errors.pop(0) if len(self.errors) > 1 else self.errors[0]
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.history = {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def comfyUI(server, tmp_path):
+    comfyUI = ComfyUI(f"127.0.0.1:{server.server_address[1]}")
+    comfyUI.output_directory = str(tmp_path)
+    return comfyUI
+
+
+def history(status_str, messages=()):
+    return {"outputs": {}, "status": {"status_str": status_str, "completed": status_str == "success", "messages": list(messages)}}
+
+
+ERROR = history("error", [
+    ["execution_start", {"prompt_id": "p"}],
+    ["execution_error", {"prompt_id": "p", "node_id": "1", "exception_message": "CUDA out of memory"}],
+])
+
+
+@pytest.mark.parametrize("lost", [websocket.WebSocketTimeoutException("quiet"), websocket.WebSocketConnectionClosedException("closed")])
+def test_failed_prompt_in_history_raises(comfyUI, server, lost):
+    server.history["p"] = ERROR
+    with pytest.raises(Exception, match="CUDA out of memory"):
+        list(comfyUI.prompt_events(WORKFLOW, "p", Socket(lost)))
+
+
+@pytest.mark.parametrize("lost", [websocket.WebSocketTimeoutException("quiet"), websocket.WebSocketConnectionClosedException("closed")])
+def test_succeeded_prompt_in_history_completes(comfyUI, server, lost):
+    server.history["p"] = history("success")
+    assert list(comfyUI.prompt_events(WORKFLOW, "p", Socket(lost))) == []
+    # entries written before the status field existed
+    server.history["p"] = {"outputs": {}}
+    assert list(comfyUI.prompt_events(WORKFLOW, "p", Socket(lost))) == []
+
+
+def test_deadline_with_server_down(tmp_path):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    # nothing listens on the port any more
+    comfyUI = ComfyUI(f"127.0.0.1:{port}")
+    comfyUI.output_directory = str(tmp_path)
+    with pytest.raises(PromptTimeoutError) as error:
+        list(comfyUI.prompt_events(WORKFLOW, "p", Socket(websocket.WebSocketTimeoutException("quiet")), deadline=0))
+    assert error.value.prompt_id == "p"
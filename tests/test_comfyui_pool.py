@@ -0,0 +1,159 @@
+import os
+import time
+import socket
+import threading
+
+import pytest
+
+from comfyui_pool import ComfyUIPool
+
+STUB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "stub_comfyui.py")
+NODE_TIME = 0.2
+
+
+def free_ports(count: int) -> int:
+    """First of count consecutive free local ports"""
+    for base in range(20000, 60000, 97):
+        sockets = []
+        try:
+            for port in range(base, base + count):
+                sock = socket.socket()
+                sockets.append(sock)
+                sock.bind(("127.0.0.1", port))
+            return base
+        except OSError:
+            continue
+        finally:
+            for sock in sockets:
+                sock.close()
+    raise RuntimeError("No free ports")
+
+
+def workflow(nodes: int = 4) -> dict:
+    prompt = {str(i): {"class_type": "KSampler", "inputs": {}} for i in range(1, nodes)}
+    prompt[str(nodes)] = {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI"}}
+    return prompt
+
+
+def wait_until(condition, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.1)
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    monkeypatch.setenv("STUB_NODE_TIME", str(NODE_TIME))
+    pool = ComfyUIPool(
+        2,
+        str(tmp_path / "outputs"),
+        str(tmp_path / "inputs"),
+        base_port=free_ports(2),
+        health_interval=3600,  # checks are run by the tests
+        main_script=STUB
+    )
+    pool.start()
+    yield pool
+    for backend in pool.backends:
+        backend.stop_server()
+
+
+def run(pool, key, results, executed=None):
+    with pool.backend(key, executed) as comfyUI, comfyUI.request_context() as context:
+        context.connect()
+        start = time.time()
+        comfyUI.run_workflow(context.prepare_workflow(workflow()), context)
+        results.append((comfyUI, start, time.time()))
+        if executed is not None:
+            executed.set()
+
+
+def test_concurrent_predictions_spread_over_servers(pool):
+    results = []
+    threads = [threading.Thread(target=run, args=(pool, "a", results)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    (first, start_1, end_1), (second, start_2, end_2) = results
+    assert first is not second
+    # both workflows ran at the same time
+    assert max(start_1, start_2) < min(end_1, end_2)
+    assert [stats["dispatched"] for stats in pool.get_stats()] == [1, 1]
+    assert all(stats["in_flight"] == 0 for stats in pool.get_stats())
+
+
+def test_dispatch_prefers_idle_then_same_key(pool):
+    first = pool.acquire("a")
+    # the busy server is avoided even though it last ran the same key
+    second = pool.acquire("a")
+    assert second is not first
+    pool.release(first)
+    pool.release(second)
+
+    pool.release(pool.acquire("b"))
+    # with both idle, the server that last ran the key is reused
+    chosen = pool.acquire("a")
+    assert pool.stats[chosen]["last_key"] == "a"
+    assert [stats["last_key"] for stats in pool.get_stats()].count("b") == 1
+
+
+def test_executed_hold_does_not_count_as_load(pool):
+    executed = threading.Event()
+    held = pool.acquire("a", executed)
+    other = pool.acquire("b")
+    assert other is not held
+    pool.release(other)
+
+    # still running its workflow, so the idle server is chosen over the key
+    assert pool.acquire("a") is other
+    pool.release(other)
+    assert pool.acquire("b") is other
+    pool.release(other)
+
+    # only finalizing, so the server with the key's models is chosen
+    executed.set()
+    assert pool.acquire("a") is held
+
+
+def test_killed_server_is_restarted(pool):
+    dead, alive = pool.backends
+    dead.server_process.kill()
+    dead.server_process.wait()
+
+    pool.check(dead)
+    assert not pool.stats[dead]["healthy"]
+    # requests go to the remaining server while it restarts
+    results = []
+    run(pool, "a", results)
+    assert results[0][0] is alive
+
+    wait_until(lambda: pool.stats[dead]["healthy"] and not pool.stats[dead]["restarting"])
+    assert pool.stats[dead]["restarts"] == 1
+    assert dead.is_alive() and dead.is_server_running()
+
+    pool.check(dead)
+    assert pool.stats[dead]["healthy"] and pool.stats[dead]["failed_checks"] == 0
+
+
+def test_hung_server_restarted_after_failed_checks(pool, monkeypatch):
+    hung = pool.backends[0]
+    responding = hung.is_server_running
+    hanging = [True]
+    monkeypatch.setattr(hung, "is_server_running", lambda: not hanging[0] and responding())
+
+    for checks in range(1, pool.max_failed_checks):
+        pool.check(hung)
+        assert pool.stats[hung]["failed_checks"] == checks
+        assert not pool.stats[hung]["restarting"]
+    assert not pool.stats[hung]["healthy"]
+
+    pool.check(hung)
+    assert pool.stats[hung]["restarting"]
+    # the restarted server answers again
+    hanging[0] = False
+
+    wait_until(lambda: not pool.stats[hung]["restarting"])
+    assert pool.stats[hung]["healthy"] and pool.stats[hung]["restarts"] == 1
@@ -0,0 +1,98 @@
+import os
+import time
+import threading
+
+import pytest
+
+import download_cache
+from download_cache import DownloadCache
+from minio_manager import MinioStorageManager
+from fake_s3 import FakeS3
+
+
+@pytest.fixture
+def cloud():
+    s3 = FakeS3()
+    s3.buckets["test"] = {}
+    storage = MinioStorageManager(bucket="test", client=s3)
+    for name in ("id/image.webp", "id/workflow.json"):
+        s3.buckets["test"][name] = (name.encode(), None)
+    return storage
+
+
+def test_fetch_reuses_current_copies(cloud, tmp_path):
+    cache = DownloadCache(cloud, str(tmp_path / "cache"))
+    files = {"id/image.webp": str(tmp_path / "a.webp"), "id/workflow.json": str(tmp_path / "a.json")}
+    assert cache.fetch(files) == {key: True for key in files}
+    assert cache.fetch(files) == {key: True for key in files}
+
+    assert cloud.client.calls["fget_object"] == 2
+    assert cache.get_stats()["hits"] == 2
+    assert (tmp_path / "a.webp").read_bytes() == b"id/image.webp"
+
+
+def test_fetch_deadline(cloud, tmp_path, monkeypatch):
+    release = threading.Event()
+    fget_object = cloud.client.fget_object
+
+    def slow_fget_object(bucket, name, path):
+        release.wait(5)
+        fget_object(bucket, name, path)
+
+    monkeypatch.setattr(cloud.client, "fget_object", slow_fget_object)
+    cache = DownloadCache(cloud, str(tmp_path / "cache"))
+
+    start = time.time()
+    with pytest.raises(TimeoutError, match="id/image.webp"):
+        cache.fetch({"id/image.webp": str(tmp_path / "a.webp")}, deadline=start + 0.2)
+    assert time.time() - start < 1.0
+    release.set()
+
+
+def test_vanished_entry_is_a_miss(cloud, tmp_path):
+    cache = DownloadCache(cloud, str(tmp_path / "cache"))
+    assert cache.get("id/image.webp", str(tmp_path / "a.webp"))
+    # the file went away but its sidecar still names the current ETag
+    os.remove(cache.entry_path("test", "id/image.webp"))
+
+    assert cache.get("id/image.webp", str(tmp_path / "b.webp"))
+    assert (tmp_path / "b.webp").read_bytes() == b"id/image.webp"
+    assert cache.get_stats()["misses"] == 2
+
+
+def test_entry_being_linked_is_not_evicted(cloud, tmp_path, monkeypatch):
+    cache = DownloadCache(cloud, str(tmp_path / "cache"), max_bytes=0)
+    linking, proceed = threading.Event(), threading.Event()
+    link = os.link
+
+    def slow_link(source, destination):
+        linking.set()
+        proceed.wait(5)
+        link(source, destination)
+
+    monkeypatch.setattr(download_cache.os, "link", slow_link)
+    results = []
+    thread = threading.Thread(target=lambda: results.append(cache.get("id/image.webp", str(tmp_path / "a.webp"))))
+    thread.start()
+    assert linking.wait(5)
+    cache.evict()
+    assert os.path.exists(cache.entry_path("test", "id/image.webp"))
+    proceed.set()
+    thread.join()
+
+    assert results == [True]
+    assert (tmp_path / "a.webp").read_bytes() == b"id/image.webp"
+    # over budget once the link is done
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_evicted_entries_release_their_locks(cloud, tmp_path):
+    for i in range(20):
+        cloud.client.buckets["test"][f"id/tiles/{i}.webp"] = (b"tile" * 64, None)
+    cache = DownloadCache(cloud, str(tmp_path / "cache"), max_bytes=3 * 256)
+    for i in range(20):
+        assert cache.get(f"id/tiles/{i}.webp", str(tmp_path / f"{i}.webp"))
+
+    assert len(cache.entries()) == 3
+    assert len(cache.key_locks) <= 3
+    assert cache.get_stats()["evictions"] == 17
@@ -0,0 +1,157 @@
+import os
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+pytest.importorskip("tqdm")
+
+from scripts import download_models
+
+DATA = os.urandom(1024 * 1024 + 123)
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves DATA at /model.bin with byte ranges, behind a redirect at /download"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def do_GET(self):
+        self.respond(head=False)
+
+    def respond(self, head):
+        server = self.server
+        server.requests.append((self.command, self.path, self.headers.get("Range")))
+        if self.path == "/download":
+            self.send_response(302)
+            self.send_header("Location", "/model.bin")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if head and not server.allow_head:
+            self.send_response(405)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start, end = 0, len(DATA) - 1
+        requested = self.headers.get("Range")
+        if requested and server.ranges:
+            first, _, last = requested.removeprefix("bytes=").partition("-")
+            start, end = int(first), min(int(last or end), end)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(DATA)}")
+        else:
+            self.send_response(200)
+        if server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Content-Disposition", 'attachment; filename="model.safetensors"')
+        self.end_headers()
+        if head:
+            return
+
+        body = DATA[start:end + 1]
+        if server.cut_after is not None:
+            # the connection drops partway through the body
+            self.wfile.write(body[:server.cut_after])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(download_models, "MIN_SEGMENT_SIZE", 128 * 1024)
+    monkeypatch.setattr(download_models, "CHUNK_SIZE", 16 * 1024)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.requests = []
+    server.allow_head = True
+    server.ranges = True
+    server.cut_after = None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def ranged_bytes(server):
+    """Bytes asked for by ranged GETs"""
+    total = 0
+    for command, _, requested in server.requests:
+        if command == "GET" and requested and requested != "bytes=0-0":
+            first, _, last = requested.removeprefix("bytes=").partition("-")
+            total += int(last) - int(first) + 1
+    return total
+
+
+def test_resolve_follows_redirects(server):
+    url, filename, size, accepts_ranges = download_models.resolve(f"{server.url}/download")
+    assert (url, filename, size, accepts_ranges) == (f"{server.url}/model.bin", "model.safetensors", len(DATA), True)
+    assert [command for command, _, _ in server.requests] == ["HEAD", "HEAD"]
+
+
+def test_resolve_without_head(server):
+    server.allow_head = False
+    url, filename, size, accepts_ranges = download_models.resolve(f"{server.url}/download")
+    assert (url, filename, size, accepts_ranges) == (f"{server.url}/model.bin", "model.safetensors", len(DATA), True)
+    assert server.requests[-1] == ("GET", "/model.bin", "bytes=0-0")
+
+
+def test_segmented_download(server, tmp_path):
+    path = download_models.download_file(f"{server.url}/download", str(tmp_path), sha256=SHA256, segments=4)
+    assert path == str(tmp_path / "model.safetensors")
+    with open(path, "rb") as file:
+        assert file.read() == DATA
+    assert sorted(os.listdir(tmp_path)) == ["model.safetensors"]
+    assert len([request for request in server.requests if request[0] == "GET"]) == 4
+
+
+def test_interrupted_download_resumes(server, tmp_path):
+    server.cut_after = 64 * 1024
+    assert download_models.download_file(f"{server.url}/download", str(tmp_path), segments=4) is None
+    part_path = tmp_path / "model.safetensors.part"
+    assert part_path.exists() and (tmp_path / "model.safetensors.part.json").exists()
+    assert not (tmp_path / "model.safetensors").exists()
+
+    server.cut_after = None
+    server.requests.clear()
+    path = download_models.download_file(f"{server.url}/download", str(tmp_path), sha256=SHA256, segments=4)
+    with open(path, "rb") as file:
+        assert file.read() == DATA
+    assert not part_path.exists() and not (tmp_path / "model.safetensors.part.json").exists()
+    # only what the first attempt didn't get was asked for again
+    assert 0 < ranged_bytes(server) <= len(DATA) - 4 * 48 * 1024
+
+
+def test_download_without_ranges(server, tmp_path):
+    server.ranges = False
+    path = download_models.download_file(f"{server.url}/model.bin", str(tmp_path), filename="model.bin", sha256=SHA256)
+    with open(path, "rb") as file:
+        assert file.read() == DATA
+
+
+def test_checksum_mismatch(server, tmp_path):
+    assert download_models.download_file(f"{server.url}/download", str(tmp_path), sha256="0" * 64, segments=4) is None
+    # nothing is kept to resume from
+    assert os.listdir(tmp_path) == []
+
+
+def test_existing_file_checked(server, tmp_path):
+    (tmp_path / "model.safetensors").write_bytes(DATA)
+    assert download_models.download_file(f"{server.url}/download", str(tmp_path), sha256=SHA256) == str(tmp_path / "model.safetensors")
+    assert all(command == "HEAD" for command, _, _ in server.requests)
+
+    # a corrupt copy of the right size is replaced
+    (tmp_path / "model.safetensors").write_bytes(bytes(len(DATA)))
+    server.requests.clear()
+    path = download_models.download_file(f"{server.url}/download", str(tmp_path), sha256=SHA256, segments=4)
+    with open(path, "rb") as file:
+        assert file.read() == DATA
@@ -0,0 +1,149 @@
+import os
+import json
+import shutil
+import subprocess
+
+import pytest
+
+if shutil.which("git") is None:
+    pytest.skip("git is not installed", allow_module_level=True)
+
+from scripts import install_custom_nodes
+
+
+def run(path, *args):
+    return subprocess.run(["git", *args], cwd=path, check=True, capture_output=True, text=True).stdout.strip()
+
+
+@pytest.fixture(autouse=True)
+def git_environment(tmp_path, monkeypatch):
+    # safe.directory entries go to a throwaway global config
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    monkeypatch.setenv("GIT_CONFIG_GLOBAL", str(tmp_path / "home" / ".gitconfig"))
+    for name in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv(f"GIT_{name}_NAME", "test")
+        monkeypatch.setenv(f"GIT_{name}_EMAIL", "test@example.com")
+    os.makedirs(tmp_path / "home")
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Arguments of every git call the installer makes"""
+    calls = []
+    git = install_custom_nodes.git
+
+    def recording_git(path, *args):
+        calls.append(args)
+        return git(path, *args)
+
+    monkeypatch.setattr(install_custom_nodes, "git", recording_git)
+    return calls
+
+
+@pytest.fixture
+def remote(tmp_path):
+    """Bare repository of a node with three commits, and its commits oldest first"""
+    work = tmp_path / "work"
+    work.mkdir()
+    run(work, "init", "--quiet", "--initial-branch", "main")
+    commits = []
+    for version in range(3):
+        (work / "nodes.py").write_text(f"VERSION = {version}\n")
+        run(work, "add", "nodes.py")
+        run(work, "commit", "--quiet", "-m", f"version {version}")
+        commits.append(run(work, "rev-parse", "HEAD"))
+
+    bare = tmp_path / "remotes" / "ComfyUI-Node.git"
+    run(tmp_path, "clone", "--quiet", "--bare", str(work), str(bare))
+    run(bare, "config", "uploadpack.allowFilter", "true")
+    return f"file://{bare}", commits
+
+
+@pytest.fixture
+def custom_nodes(tmp_path):
+    path = tmp_path / "ComfyUI" / "custom_nodes"
+    path.mkdir(parents=True)
+    return path
+
+
+def installed(custom_nodes):
+    path = custom_nodes / "ComfyUI-Node"
+    return run(path, "rev-parse", "HEAD"), (path / "nodes.py").read_text()
+
+
+def lock_file(custom_nodes):
+    with open(custom_nodes / install_custom_nodes.LOCK_FILE) as file:
+        return json.load(file)
+
+
+def fetches(calls):
+    return [args for args in calls if args[0] == "fetch"]
+
+
+def test_full_hash_fetched_at_depth_one(remote, custom_nodes, calls):
+    url, commits = remote
+    statuses = install_custom_nodes.install_all([{"repo": url, "commit": commits[1]}], str(custom_nodes))
+
+    assert statuses == {"ComfyUI-Node": "installed"}
+    assert installed(custom_nodes) == (commits[1], "VERSION = 1\n")
+    assert fetches(calls) == [("fetch", "--depth", "1", "origin", commits[1])]
+    # only the pinned commit was fetched
+    assert run(custom_nodes / "ComfyUI-Node", "rev-list", "--count", "HEAD") == "1"
+
+    entry = lock_file(custom_nodes)["ComfyUI-Node"]
+    assert (entry["repo"], entry["commit"], entry["resolved"]) == (url, commits[1], commits[1])
+
+
+def test_short_hash_fetched_without_blobs(remote, custom_nodes, calls):
+    url, commits = remote
+    statuses = install_custom_nodes.install_all([{"repo": url, "commit": commits[0][:7]}], str(custom_nodes))
+
+    assert statuses == {"ComfyUI-Node": "installed"}
+    assert installed(custom_nodes) == (commits[0], "VERSION = 0\n")
+    assert fetches(calls) == [("fetch", "--filter=blob:none", "--tags", "origin")]
+    assert lock_file(custom_nodes)["ComfyUI-Node"]["resolved"] == commits[0]
+
+
+def test_locked_install_skips_git(remote, custom_nodes, calls):
+    url, commits = remote
+    repos = [{"repo": url, "commit": commits[0][:7]}]
+    install_custom_nodes.install_all(repos, str(custom_nodes))
+    installed_at = lock_file(custom_nodes)["ComfyUI-Node"]["installed_at"]
+    calls.clear()
+
+    assert install_custom_nodes.install_all(repos, str(custom_nodes)) == {"ComfyUI-Node": "unchanged"}
+    assert calls == []
+    assert lock_file(custom_nodes)["ComfyUI-Node"]["installed_at"] == installed_at
+
+
+@pytest.mark.parametrize("on_mismatch", ["update", "keep", "fail"])
+def test_on_mismatch(remote, custom_nodes, calls, on_mismatch):
+    url, commits = remote
+    install_custom_nodes.install_all([{"repo": url, "commit": commits[0]}], str(custom_nodes))
+    # the pin moves on, and the checkout is still at the old one
+    repos = [{"repo": url, "commit": commits[2]}]
+    statuses = install_custom_nodes.install_all(repos, str(custom_nodes), on_mismatch=on_mismatch)
+    entry = lock_file(custom_nodes)["ComfyUI-Node"]
+
+    if on_mismatch == "update":
+        assert statuses == {"ComfyUI-Node": "updated"}
+        assert installed(custom_nodes) == (commits[2], "VERSION = 2\n")
+        assert (entry["commit"], entry["resolved"]) == (commits[2], commits[2])
+    elif on_mismatch == "keep":
+        assert statuses == {"ComfyUI-Node": "kept"}
+        assert installed(custom_nodes)[0] == commits[0]
+        # recorded off its pin, so the next run checks it again
+        assert (entry["commit"], entry["resolved"]) == (commits[2], commits[0])
+    else:
+        assert statuses == {"ComfyUI-Node": f"at {commits[0][:7]}, pinned {commits[2][:7]}"}
+        assert installed(custom_nodes)[0] == commits[0]
+        assert (entry["commit"], entry["resolved"]) == (commits[0], commits[0])
+
+
+def test_unknown_commit_leaves_nothing_behind(remote, custom_nodes):
+    url, _ = remote
+    statuses = install_custom_nodes.install_all([{"repo": url, "commit": "0" * 40}], str(custom_nodes))
+
+    assert statuses["ComfyUI-Node"].startswith("error: ")
+    assert not (custom_nodes / "ComfyUI-Node").exists()
+    assert lock_file(custom_nodes) == {}
@@ -0,0 +1,54 @@
+import pytest
+
+from metadata_catalog import MetadataCatalog
+from minio_manager import MinioStorageManager
+from fake_s3 import FakeS3
+
+
+@pytest.fixture
+def cloud():
+    s3 = FakeS3()
+    s3.buckets["test"] = {}
+    return MinioStorageManager(bucket="test", client=s3)
+
+
+def catalog(cloud, tmp_path, node):
+    return MetadataCatalog(cloud, str(tmp_path / node), "test", compact_every=2, node=node)
+
+
+def test_nodes_mirror_to_their_own_keys(cloud, tmp_path):
+    first = catalog(cloud, tmp_path, "gpu-0")
+    second = catalog(cloud, tmp_path, "gpu-1")
+    first.append({"id": "a", "cfg": 3.5, "created": 1.0})
+    first.append({"id": "b", "cfg": 4.0, "created": 2.0})
+    second.append({"id": "c", "sampler": "euler", "created": 3.0})
+    second.append({"id": "d", "sampler": "dpmpp_sde", "created": 4.0})
+
+    assert {"catalog/gpu-0.npz", "catalog/gpu-1.npz"} <= set(cloud.client.buckets["test"])
+    # neither node's rows were overwritten by the other's upload
+    fresh = catalog(cloud, tmp_path, "gpu-2")
+    assert sorted(row["id"] for row in fresh.query()) == ["a", "b", "c", "d"]
+    assert fresh.query({"id": "a"}, columns=["cfg", "sampler"]) == [{"cfg": 3.5, "sampler": ""}]
+    assert fresh.aggregate("cfg", "count") == {"all": 2}
+
+
+def test_newest_copy_of_a_row_wins(cloud, tmp_path):
+    first = catalog(cloud, tmp_path, "gpu-0")
+    second = catalog(cloud, tmp_path, "gpu-1")
+    # gpu-1 holds a newer version of "a", but uploads before gpu-0
+    second.append({"id": "a", "steps": 20, "created": 5.0})
+    second.append({"id": "x", "steps": 1, "created": 6.0})
+    first.append({"id": "a", "steps": 12, "created": 1.0})
+    first.append({"id": "y", "steps": 1, "created": 2.0})
+
+    assert first.sync() == 4
+    assert first.query({"id": "a"}, columns=["steps"]) == [{"steps": 20}]
+    assert len(first) == 3
+
+
+def test_sync_reads_legacy_mirror(cloud, tmp_path):
+    legacy = MetadataCatalog(cloud, str(tmp_path / "legacy"), "test", compact_every=1, mirror_key="catalog/metadata.npz")
+    legacy.append({"id": "old", "created": 1.0})
+
+    fresh = catalog(cloud, tmp_path, "gpu-0")
+    assert [row["id"] for row in fresh.query()] == ["old"]
@@ -0,0 +1,226 @@
+import os
+import time
+
+import pytest
+
+import minio_manager
+from minio_manager import MinioStorageManager
+from multipart_upload import MIN_PART_SIZE
+from fake_s3 import FakeS3
+
+
+class Clock:
+    """Replaces minio_manager's time module so TTLs can be stepped through"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def perf_counter(self):
+        return time.perf_counter()
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(minio_manager, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def s3():
+    s3 = FakeS3()
+    s3.buckets["test"] = {}
+    return s3
+
+
+@pytest.fixture
+def storage(s3, clock):
+    return MinioStorageManager(bucket="test", client=s3, bucket_ttl=300)
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "image.webp"
+    path.write_bytes(b"panorama")
+    return path
+
+
+def test_bucket_checked_once_within_ttl(storage, s3, image):
+    for index in range(5):
+        assert storage.upload_file(image, f"id/{index}.webp") is not None
+
+    assert s3.calls["bucket_exists"] == 1
+    assert s3.calls["fput_object"] == 5
+    assert storage.get_stats()["bucket_cache_hits"] == 4
+    assert set(s3.buckets["test"]) == {f"id/{index}.webp" for index in range(5)}
+
+
+def test_bucket_rechecked_after_ttl(storage, s3, clock, image):
+    storage.upload_file(image, "id/a.webp")
+    clock.sleep(299)
+    storage.upload_file(image, "id/b.webp")
+    assert s3.calls["bucket_exists"] == 1
+
+    clock.sleep(2)
+    storage.upload_file(image, "id/c.webp")
+    assert s3.calls["bucket_exists"] == 2
+    assert s3.calls["make_bucket"] == 0
+
+
+def test_failed_upload_invalidates_bucket(storage, s3, image):
+    storage.upload_file(image, "id/a.webp")
+    # the bucket is deleted behind the cache's back
+    del s3.buckets["test"]
+
+    assert storage.upload_file(image, "id/b.webp") is None
+    assert s3.calls["bucket_exists"] == 1
+
+    # the next upload checks again and creates the bucket
+    assert storage.upload_file(image, "id/b.webp") is not None
+    assert s3.calls["bucket_exists"] > 1
+    assert s3.calls["make_bucket"] == 1
+    assert "id/b.webp" in s3.buckets["test"]
+
+
+def test_presigned_url_reused_until_near_expiry(storage, s3, clock):
+    first = storage.get_file_url("id/a.webp", expires=1000)
+    assert storage.get_file_url("id/a.webp", expires=1000) == first
+    # a different lifetime is signed separately
+    assert storage.get_file_url("id/a.webp", expires=60) != first
+    assert s3.calls["presigned_get_object"] == 2
+
+    clock.sleep(899)
+    assert storage.get_file_url("id/a.webp", expires=1000) == first
+    clock.sleep(1)
+    assert storage.get_file_url("id/a.webp", expires=1000) != first
+    assert s3.calls["presigned_get_object"] == 3
+    assert storage.get_stats()["url_cache_hits"] == 2
+
+
+def test_presigned_urls_dropped_with_bucket(storage, s3, image):
+    first = storage.get_file_url("id/a.webp", expires=1000)
+    s3.fail("fput_object")
+    assert storage.upload_file(image, "id/b.webp") is None
+
+    assert storage.get_file_url("id/a.webp", expires=1000) != first
+    assert s3.calls["presigned_get_object"] == 2
+
+
+def test_presigned_url_cache_is_bounded(s3, clock):
+    storage = MinioStorageManager(bucket="test", client=s3, max_presigned_urls=3)
+    storage.get_file_url("id/short.webp", expires=10)
+    clock.sleep(20)
+    for name in "abc":
+        storage.get_file_url(f"id/{name}.webp", expires=1000)
+
+    # the expired URL goes first, without counting as an eviction
+    assert len(storage.presigned_urls) == 3
+    assert ("test", "id/short.webp", 10) not in storage.presigned_urls
+    assert storage.get_stats().get("url_cache_evictions", 0) == 0
+
+    storage.get_file_url("id/d.webp", expires=1000)
+    # then the oldest signed one
+    assert len(storage.presigned_urls) == 3
+    assert ("test", "id/a.webp", 1000) not in storage.presigned_urls
+    assert storage.get_stats()["url_cache_evictions"] == 1
+
+    calls = s3.calls["presigned_get_object"]
+    storage.get_file_url("id/b.webp", expires=1000)
+    assert s3.calls["presigned_get_object"] == calls
+    storage.get_file_url("id/a.webp", expires=1000)
+    assert s3.calls["presigned_get_object"] == calls + 1
+
+
+def test_multipart_is_opt_in(storage, s3, image, monkeypatch):
+    uploads = []
+    monkeypatch.setattr(storage.multipart, "upload", lambda *args: uploads.append(args))
+    storage.upload_file(image, "id/a.webp")
+    assert s3.calls["fput_object"] == 1 and not uploads
+
+    storage.multipart_threshold = 4
+    storage.upload_file(image, "id/b.webp")
+    assert s3.calls["fput_object"] == 1 and len(uploads) == 1
+
+
+def test_expire_prefix_keeps_other_rules(storage, s3):
+    from minio.commonconfig import ENABLED, Filter
+    from minio.lifecycleconfig import LifecycleConfig, Rule, Expiration
+
+    s3.lifecycles["test"] = LifecycleConfig([
+        Rule(ENABLED, rule_filter=Filter(prefix="tmp/"), rule_id="tmp", expiration=Expiration(days=7))
+    ])
+    assert storage.expire_prefix("progress/", 1)
+    assert storage.expire_prefix("progress/", 1)
+    assert s3.calls["set_bucket_lifecycle"] == 1
+
+    assert storage.expire_prefix("progress/", 3)
+    rules = {rule.rule_id: rule for rule in s3.lifecycles["test"].rules}
+    assert set(rules) == {"tmp", "expire-progress"}
+    assert rules["expire-progress"].rule_filter.prefix == "progress/"
+    assert rules["expire-progress"].expiration.days == 3
+
+
+def test_unchanged_files_match_stored_content(storage, s3, tmp_path):
+    files = {}
+    for name, data in (("image.webp", b"panorama"), ("depth.webp", b"depth"), ("metadata.json", b"{}")):
+        files[f"id/{name}"] = tmp_path / name
+        files[f"id/{name}"].write_bytes(data)
+    storage.upload_file(files["id/image.webp"], "id/image.webp")
+    storage.upload_file(files["id/depth.webp"], "id/depth.webp")
+    calls = s3.calls["list_objects"]
+
+    assert storage.unchanged_files(files) == {"id/image.webp", "id/depth.webp"}
+    # one listing for the shared prefix, no HEAD per key
+    assert s3.calls["list_objects"] == calls + 1
+    assert s3.calls["stat_object"] == 0
+    assert storage.get_stats()["dedup_hits"] == 2
+
+
+def test_changed_content_is_uploaded(storage, s3, tmp_path):
+    path = tmp_path / "metadata.json"
+    path.write_bytes(b'{"preview": true}')
+    storage.upload_file(path, "id/metadata.json")
+
+    # same size, different bytes
+    path.write_bytes(b'{"preview": 1111}')
+    assert storage.unchanged_files({"id/metadata.json": path}) == set()
+    path.write_bytes(b'{"preview": false}')
+    assert storage.unchanged_files({"id/metadata.json": path}) == set()
+
+
+def test_unchanged_files_without_bucket(storage, s3, image):
+    assert storage.unchanged_files({"id/image.webp": image}, bucket="missing") == set()
+
+
+def test_multipart_etags(storage, s3, tmp_path):
+    path = tmp_path / "depth.exr"
+    data = bytearray(os.urandom(2 * MIN_PART_SIZE + 100))
+    path.write_bytes(data)
+    storage.multipart_threshold = MIN_PART_SIZE
+    storage.upload_file(path, "id/depth.exr")
+    etag = s3.stat_object("test", "id/depth.exr").etag.strip('"')
+    # two 8 MiB parts, whose ETag is no MD5 of the content
+    assert etag.endswith("-2") and etag != storage.local_etag(path)
+    assert storage.unchanged_files({"id/depth.exr": path}) == {"id/depth.exr"}
+
+    # one byte changed in one part
+    data[MIN_PART_SIZE + 7] ^= 0xFF
+    path.write_bytes(data)
+    assert storage.unchanged_files({"id/depth.exr": path}) == set()
+
+    # split by fput_object into 5 MiB parts
+    path.write_bytes(bytes(data))
+    s3.etags[("test", "id/depth.exr")] = storage.local_etag(path, 3)
+    s3.buckets["test"]["id/depth.exr"] = (bytes(data), None)
+    assert storage.unchanged_files({"id/depth.exr": path}) == {"id/depth.exr"}
+
+    # parts of a size that can't be told, so never skipped
+    s3.etags[("test", "id/depth.exr")] = "0" * 32 + "-5"
+    assert storage.local_etag(path, 5) is None
+    assert storage.unchanged_files({"id/depth.exr": path}) == set()
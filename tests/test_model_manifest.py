@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+import model_manifest
+from model_manifest import ModelManifest
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    workflows = {}
+    for key, files in {"base": ["base.safetensors"], "upscale": ["base.safetensors", "upscaler.pth"]}.items():
+        workflow = {
+            str(i): {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": name}}
+            for i, name in enumerate(files)
+        }
+        workflows[key] = tmp_path / f"{key}.json"
+        workflows[key].write_text(json.dumps(workflow))
+
+    config = tmp_path / "models.json"
+    config.write_text(json.dumps({"checkpoints": [
+        {"url": "http://models/base.safetensors", "filename": "base.safetensors"},
+        {"url": "http://models/upscaler.pth", "filename": "upscaler.pth"},
+    ]}))
+    return ModelManifest(workflows, str(config), base_dir=str(tmp_path / "models"))
+
+
+def test_failed_download_is_released(manifest, monkeypatch):
+    def download_file(url, destination, filename, sha256):
+        if filename == "upscaler.pth":
+            raise ConnectionError("reset by peer")
+        (open(f"{destination}/{filename}", "w")).close()
+        return filename
+
+    monkeypatch.setattr(model_manifest, "download_file", download_file)
+    manifest.start()
+
+    manifest.wait_for("base", timeout=5)
+    with pytest.raises(RuntimeError, match="upscaler.pth"):
+        manifest.wait_for("upscale", timeout=5)
+    assert manifest.failed == {"upscaler.pth"}
+
+
+def test_fetch_error_releases_every_model(manifest, monkeypatch):
+    # the fetch thread fails before any download starts
+    monkeypatch.setattr(manifest, "entries", None)
+    manifest.start()
+
+    with pytest.raises(RuntimeError, match="failed to download"):
+        manifest.wait_for("base", timeout=5)
+    assert manifest.failed == {"base.safetensors", "upscaler.pth"}
@@ -0,0 +1,119 @@
+import io
+import json
+
+import numpy as np
+import pytest
+import requests
+from PIL import Image
+
+from scripts import mosaic_settings
+
+
+class Session:
+    """Answers with the given status codes in turn"""
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def get(self, url, timeout=None):
+        self.calls += 1
+        response = requests.Response()
+        response.status_code = self.statuses.pop(0)
+        response.url = url
+        response._content = b"{}"
+        return response
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(mosaic_settings.time, "sleep", lambda seconds: None)
+
+
+def test_fetch_retries_until_uploaded():
+    session = Session(404, 503, 200)
+    assert mosaic_settings.fetch(session, "http://minio/id/metadata.json", timeout=5).status_code == 200
+    assert session.calls == 3
+
+
+def test_fetch_raises_after_last_attempt():
+    session = Session(*[404] * 3)
+    with pytest.raises(requests.HTTPError):
+        mosaic_settings.fetch(session, "http://minio/id/image.webp", timeout=5, attempts=3)
+    assert session.calls == 3
+
+
+class Predictor:
+    """A prediction endpoint and the bucket its outputs are served from"""
+
+    def __init__(self, thumbnail_widths=(256, 512, 1024)):
+        self.files = {}
+        for width in thumbnail_widths:
+            self.files[f"http://minio/id/image_thumbnail_{width}.webp"] = panorama(width)
+        self.files["http://minio/id/image.webp"] = panorama(4096)
+        self.files["http://minio/id/metadata.json"] = json.dumps({
+            "thumbnails": {str(w): {"url": f"http://minio/id/image_thumbnail_{w}.webp"} for w in thumbnail_widths}
+        }).encode()
+        self.requested = []
+
+    def post(self, url, json=None, timeout=None):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"status": "succeeded", "metrics": {"predict_time": 1.5}, "output": ' \
+            b'["http://minio/id/depth.webp", "http://minio/id/image.webp", "http://minio/id/metadata.json"]}'
+        return response
+
+    def get(self, url, timeout=None):
+        self.requested.append(url)
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = self.files[url]
+        return response
+
+
+def panorama(width):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, width // 2), (40, 120, 200)).save(buffer, "webp")
+    return buffer.getvalue()
+
+
+def prediction_input(sampler, scheduler):
+    return {"prompt": "hills", "seed": 1, "sampler": sampler, "scheduler": scheduler}
+
+
+def test_generate_downloads_thumbnails_only(tmp_path):
+    predictor = Predictor()
+    mosaic_settings.generate("http://cog", prediction_input("euler", "karras"), str(tmp_path), 256, predictor)
+    # a 256 wide cell, and a crop cut from the 1024 thumbnail a quarter of which is 256 wide
+    assert sorted(predictor.requested) == [
+        "http://minio/id/image_thumbnail_1024.webp",
+        "http://minio/id/image_thumbnail_256.webp",
+        "http://minio/id/metadata.json",
+    ]
+    key = mosaic_settings.cache_key(prediction_input("euler", "karras"))
+    for kind in ("thumbnail", "crop"):
+        with Image.open(mosaic_settings.cell_paths(str(tmp_path), key)[kind]) as cell:
+            assert cell.size == (256, 128)
+
+
+def test_cache_renders_at_other_cell_widths(tmp_path):
+    predictor = Predictor()
+    grid = []
+    for sampler in ("euler", "ddim"):
+        row = []
+        for scheduler in ("karras", "beta"):
+            mosaic_settings.generate("http://cog", prediction_input(sampler, scheduler), str(tmp_path), 256, predictor)
+            row.append(mosaic_settings.cache_key(prediction_input(sampler, scheduler)))
+        grid.append(row + [None])
+
+    # cached at 256, laid out narrower and wider
+    for width in (256, 128, 512):
+        for kind in ("thumbnail", "crop"):
+            path = tmp_path / f"{kind}_{width}.png"
+            mosaic_settings.render_mosaic(grid, ["euler", "ddim"], ["karras", "beta", "lcm"], str(tmp_path), kind, width, str(path))
+            with Image.open(path) as mosaic:
+                assert mosaic.width > 3 * width
+                # centre of the first cell, right of the row labels
+                centre = np.asarray(mosaic.convert("RGB"))[mosaic_settings.HEADER + mosaic_settings.LABEL_HEIGHT + width // 4, 50 + width // 2]
+                assert np.abs(centre.astype(int) - (40, 120, 200)).max() < 12
@@ -0,0 +1,95 @@
+import sys
+import time
+import subprocess
+
+import pytest
+
+pytest.importorskip("psutil")
+
+from resource_sampler import ResourceSampler, parse_budgets
+
+
+def test_parse_budgets():
+    assert parse_budgets("rss_mb=24000, gpu_memory_mb=22000.5") == {"rss_mb": 24000.0, "gpu_memory_mb": 22000.5}
+    assert parse_budgets("") == {}
+
+
+def test_malformed_budgets_are_skipped(capsys):
+    budgets = parse_budgets("rss_mb=,gpu_memory_mb=22000,disk_mb,=5,cpu_percent=lots,,")
+    assert budgets == {"gpu_memory_mb": 22000.0}
+    warnings = capsys.readouterr().out
+    for item in ("rss_mb=", "disk_mb", "=5", "cpu_percent=lots"):
+        assert repr(item) in warnings
+
+
+def burn_cpu(seconds: float):
+    end = time.time() + seconds
+    while time.time() < end:
+        sum(range(1000))
+
+
+@pytest.fixture
+def child():
+    """A process standing in for a ComfyUI server"""
+    process = subprocess.Popen([sys.executable, "-c", "import time; data = bytearray(20 * 1024 * 1024); time.sleep(60)"])
+    time.sleep(0.3)
+    yield process
+    process.kill()
+    process.wait()
+
+
+def test_track_records_usage_and_budgets(tmp_path, child, capsys):
+    sampler = ResourceSampler(
+        processes=lambda: [child.pid],
+        directories=[str(tmp_path)],
+        interval=0.05,
+        budgets={"disk_mb": 2, "rss_mb": 1e9},
+    )
+    try:
+        with sampler.track("request") as usage:
+            (tmp_path / "image.webp").write_bytes(bytes(3 * 1024 * 1024))
+            burn_cpu(0.5)
+            assert sampler.get_stats()["active"] == ["request"]
+    finally:
+        sampler.stop()
+
+    summary = usage.summary()
+    peak, mean = summary["peak"], summary["mean"]
+    assert {"predictor_rss_mb", "comfyui_rss_mb", "rss_mb", "cpu_percent", "disk_mb"} <= set(peak)
+    if sampler.gpu_memory() is None:
+        # metrics the machine can't measure are left out
+        assert "gpu_memory_mb" not in peak
+    assert peak["comfyui_rss_mb"] > 20
+    # the sum of this process and the server tree
+    assert peak["rss_mb"] > max(peak["predictor_rss_mb"], peak["comfyui_rss_mb"])
+    assert peak["cpu_percent"] > 20
+    assert 3 <= peak["disk_mb"] < 4
+    assert all(mean[metric] <= peak[metric] + 0.1 for metric in mean)
+    assert usage.count["rss_mb"] > 5
+    assert summary["seconds"] >= 0.5
+
+    assert summary["exceeded"] == ["disk_mb"]
+    assert "request exceeded its resource budget: disk_mb 3 > 2" in capsys.readouterr().out
+    stats = sampler.get_stats()
+    assert stats["active"] == []
+    assert stats["recent"] == [("request", summary)]
+
+
+def test_overlapping_windows(tmp_path):
+    sampler = ResourceSampler(directories=[str(tmp_path)], interval=0.05, budgets={"disk_mb": 2})
+    try:
+        with sampler.track("request") as request:
+            with sampler.track("job") as job:
+                (tmp_path / "tiles.bin").write_bytes(bytes(3 * 1024 * 1024))
+                time.sleep(0.2)
+            (tmp_path / "tiles.bin").unlink()
+            time.sleep(0.2)
+    finally:
+        sampler.stop()
+
+    # both saw the job's files, only the request outlived them
+    assert request.peak["disk_mb"] >= 3 and job.peak["disk_mb"] >= 3
+    assert request.exceeded == job.exceeded == ["disk_mb"]
+    assert request.count["disk_mb"] > job.count["disk_mb"]
+    assert request.summary()["mean"]["disk_mb"] < job.summary()["mean"]["disk_mb"]
+    assert [name for name, _ in sampler.get_stats()["recent"]] == ["job", "request"]
@@ -0,0 +1,67 @@
+import time
+import threading
+
+import pytest
+
+from comfyui import PromptTimeoutError
+from scheduler import AffinityScheduler
+
+
+def test_release_lets_next_request_run():
+    scheduler = AffinityScheduler(capacity=1)
+    started = threading.Event()
+
+    def second():
+        with scheduler.slot("b"):
+            started.set()
+
+    with scheduler.slot("a") as release:
+        thread = threading.Thread(target=second)
+        thread.start()
+        assert not started.wait(0.2)
+
+        release()
+        # the slot is free while the first request is still finishing up
+        assert started.wait(2)
+        release()
+    thread.join()
+    assert scheduler.running == 0
+
+
+def test_same_key_runs_ahead_of_older_request():
+    scheduler = AffinityScheduler(capacity=1, max_batch=2)
+    order = []
+
+    def run(key):
+        with scheduler.slot(key):
+            order.append(key)
+
+    with scheduler.slot("a"):
+        workers = []
+        for key in ("b", "a"):
+            workers.append(threading.Thread(target=run, args=(key,)))
+            workers[-1].start()
+            while len(scheduler.waiting) < len(workers):
+                threading.Event().wait(0.01)
+    for worker in workers:
+        worker.join()
+
+    assert order == ["a", "b"]
+    assert scheduler.stats["affinity_hits"] == 1
+    assert scheduler.stats["fairness_overrides"] == 0
+
+
+def test_slot_deadline():
+    scheduler = AffinityScheduler(capacity=1)
+    with scheduler.slot("a"):
+        start = time.time()
+        with pytest.raises(PromptTimeoutError) as error:
+            with scheduler.slot("b", deadline=start + 0.2):
+                pass
+        assert error.value.prompt_id is None and error.value.last_node is None
+        assert 0.2 <= time.time() - start < 1.0
+        assert not scheduler.waiting
+
+    # an expired deadline doesn't stop a request that can run at once
+    with scheduler.slot("b", deadline=time.time() - 1):
+        assert scheduler.running == 1
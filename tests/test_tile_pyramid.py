@@ -0,0 +1,91 @@
+import math
+
+import numpy as np
+import pytest
+
+pytest.importorskip("equilib")
+pytest.importorskip("cv2")
+pytest.importorskip("tqdm")
+
+from PIL import Image
+
+from scripts.tile_pyramid import cube_faces, create_tile_pyramid
+
+WIDTH, HEIGHT, FACE = 1024, 512, 128
+
+
+def direction_panorama() -> np.ndarray:
+    """
+    (C, H, W) equirectangular image whose colour is the view direction,
+    x right, y up and z back, with yaw 0 at the image centre as in Pannellum
+    """
+    lon = ((np.arange(WIDTH) + 0.5) / WIDTH - 0.5) * 2 * np.pi
+    lat = (0.5 - (np.arange(HEIGHT) + 0.5) / HEIGHT) * np.pi
+    lon, lat = np.meshgrid(lon, lat)
+    direction = np.stack([np.cos(lat) * np.sin(lon), np.sin(lat), -np.cos(lat) * np.cos(lon)])
+    return (127.5 + 127.5 * direction).astype(np.uint8)
+
+
+def pannellum_faces(size: int) -> dict:
+    """
+    Directions Pannellum samples on each face, as seen from inside the cube
+    with u growing to the right and v downwards: f, r, b, l going right
+    from yaw 0, and u and d reached by pitching up and down from f
+    """
+    u = 2 * (np.arange(size) + 0.5) / size - 1
+    u, v = np.meshgrid(u, u)
+    one = np.ones_like(u)
+    faces = {
+        "f": (u, -v, -one), "r": (one, -v, u), "b": (-u, -v, one),
+        "l": (-one, -v, -u), "u": (u, one, -v), "d": (u, -one, v),
+    }
+    return {
+        name: np.stack(axes, -1) / np.linalg.norm(np.stack(axes, -1), axis=-1, keepdims=True) * 127.5 + 127.5
+        for name, axes in faces.items()
+    }
+
+
+def test_faces_match_pannellum_layout():
+    faces = cube_faces(direction_panorama(), FACE)
+    expected = pannellum_faces(FACE)
+    assert set(faces) == set(expected)
+
+    for name, face in faces.items():
+        error = np.abs(np.asarray(face, dtype=np.float64) - expected[name]).mean()
+        # interpolation error only; a wrong face, rotation or mirroring is off by tens
+        assert error < 2, f"face {name} is off by {error:.1f}"
+
+
+def test_labelled_panorama_centres():
+    """Each face's centre sees the label painted around its axis"""
+    labels = {"f": (255, 0, 0), "r": (0, 255, 0), "b": (0, 0, 255), "l": (255, 255, 0), "u": (255, 0, 255), "d": (0, 255, 255)}
+    direction = direction_panorama().astype(np.float64) - 127.5
+    axis = np.argmax(np.abs(direction), axis=0)
+    sign = np.take_along_axis(direction, axis[None], 0)[0] > 0
+    regions = {"r": (0, True), "l": (0, False), "u": (1, True), "d": (1, False), "b": (2, True), "f": (2, False)}
+    panorama = np.zeros((3, HEIGHT, WIDTH), dtype=np.uint8)
+    for name, (index, positive) in regions.items():
+        panorama[:, (axis == index) & (sign == positive)] = np.array(labels[name])[:, None]
+
+    faces = cube_faces(panorama, FACE)
+    for name, face in faces.items():
+        centre = np.asarray(face)[FACE // 4: 3 * FACE // 4, FACE // 4: 3 * FACE // 4]
+        assert (centre == labels[name]).all(axis=-1).mean() > 0.95, f"face {name}"
+
+
+def test_tiles_reassemble_faces(tmp_path):
+    path = tmp_path / "panorama.png"
+    Image.fromarray(np.transpose(direction_panorama(), (1, 2, 0))).save(path)
+
+    manifest = create_tile_pyramid(str(path), str(tmp_path / "tiles"), tile_size=48, face_size=FACE, quality=100)
+    level = manifest["multiRes"]["maxLevel"]
+    count = math.ceil(FACE / 48)
+    expected = pannellum_faces(FACE)
+    for name in "frblud":
+        face = np.zeros((FACE, FACE, 3))
+        for y in range(count):
+            for x in range(count):
+                # Pannellum's %y is the tile row and %x the column
+                tile = np.asarray(Image.open(tmp_path / "tiles" / str(level) / f"{name}{y}_{x}.webp").convert("RGB"))
+                face[y * 48: y * 48 + tile.shape[0], x * 48: x * 48 + tile.shape[1]] = tile
+        assert np.abs(face - expected[name]).mean() < 4, f"face {name}"
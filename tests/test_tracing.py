@@ -0,0 +1,110 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tracing import tracer
+from upload_spool import UploadSpool
+from minio_manager import MinioStorageManager
+from fake_s3 import FakeS3
+
+
+@tracer.traced("embedding")
+def embedding():
+    with tracer.span("encode"):
+        pass
+
+
+@tracer.traced("predict", root=True)
+def predict(spool, executor, path):
+    with tracer.span("workflow_load"):
+        pass
+    queue_span = tracer.start("queue")
+    yield "queued"
+    tracer.finish(queue_span)
+    execution_span = tracer.start("execution")
+    yield "progress"
+    tracer.finish(execution_span)
+    with tracer.span("finalize"):
+        future = tracer.submit(executor, embedding)
+        spool.upload_file(path, "id/image.webp")
+    trace = tracer.current_trace()
+    yield trace.summary() if trace is not None else None
+    yield trace, future
+
+
+def resumed_elsewhere(generator):
+    """Run every step of a generator on a new thread, each with an empty context"""
+    items = []
+    while True:
+        result = {}
+
+        def step():
+            try:
+                result["item"] = next(generator)
+            except StopIteration:
+                pass
+
+        thread = threading.Thread(target=step)
+        thread.start()
+        thread.join()
+        if "item" not in result:
+            return items
+        items.append(result["item"])
+
+
+@pytest.fixture
+def spool(tmp_path):
+    s3 = FakeS3()
+    s3.buckets["test"] = {}
+    return UploadSpool(MinioStorageManager(bucket="test", client=s3), str(tmp_path / "spool"), workers=1)
+
+
+def test_spans_survive_resuming_from_other_contexts(spool, tmp_path):
+    path = tmp_path / "image.webp"
+    path.write_bytes(b"panorama")
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        items = resumed_elsewhere(predict(spool, executor, path))
+        trace, future = items[-1]
+        future.result()
+    assert spool.flush(timeout=5)
+
+    summary = items[2]
+    assert summary is not None
+    assert {"workflow_load", "queue", "execution", "finalize"} <= set(summary)
+
+    spans = {span.name: span for span in trace.spans}
+    assert {"predict", "workflow_load", "queue", "execution", "finalize", "upload", "embedding", "encode"} <= set(spans)
+    assert all(span.end is not None for span in trace.spans)
+    root = trace.root
+    assert root is spans["predict"]
+    for name in ("workflow_load", "queue", "execution", "finalize"):
+        assert spans[name].parent is root
+    # background work stays under the stage it was started from
+    assert spans["embedding"].parent is spans["finalize"]
+    assert spans["upload"].parent is spans["finalize"]
+    assert spans["encode"].parent is spans["embedding"]
+    assert not trace.incomplete()
+
+
+def test_closing_from_another_context_ends_spans():
+    traces = []
+
+    @tracer.traced("predict", root=True)
+    def cancelled():
+        traces.append(tracer.current_trace())
+        with tracer.span("execution"):
+            yield "progress"
+            yield "never"
+
+    generator = cancelled()
+    assert next(generator) == "progress"
+    # e.g. the client went away and the generator is closed elsewhere
+    thread = threading.Thread(target=generator.close)
+    thread.start()
+    thread.join()
+
+    trace, = traces
+    assert [span.name for span in trace.spans] == ["predict", "execution"]
+    assert all(span.end is not None for span in trace.spans)
+    assert tracer.current_trace() is None
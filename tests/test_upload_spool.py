@@ -0,0 +1,149 @@
+import os
+import threading
+
+import pytest
+
+from upload_spool import UploadSpool
+from minio_manager import MinioStorageManager
+from fake_s3 import FakeS3
+
+
+@pytest.fixture
+def s3():
+    s3 = FakeS3()
+    s3.buckets["test"] = {}
+    return s3
+
+
+@pytest.fixture
+def storage(s3):
+    return MinioStorageManager(bucket="test", client=s3)
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return path
+
+
+def stored(s3, key):
+    return s3.buckets["test"][key][0]
+
+
+def assert_forgotten(spool):
+    """No bookkeeping is left behind once the journal is empty"""
+    assert spool.pending() == 0
+    assert not spool.key_locks and not spool.outstanding
+    assert not spool.latest and not spool.contexts
+
+
+def test_uploads_and_returns_url_right_away(tmp_path, s3, storage):
+    spool = UploadSpool(storage, str(tmp_path / "spool"), workers=2)
+    url = spool.upload_file(write(tmp_path, "image.webp", b"panorama"), "id/image.webp", "image/webp")
+    assert url == storage.get_file_url("id/image.webp")
+
+    assert spool.flush(timeout=5)
+    spool.queue.join()
+    assert stored(s3, "id/image.webp") == b"panorama"
+    assert spool.get_stats()["uploaded"] == 1
+    # the spooled copy is gone, the original is left alone
+    assert os.listdir(spool.data_directory) == []
+    assert (tmp_path / "image.webp").exists()
+    assert_forgotten(spool)
+
+
+def test_unique_keys_do_not_accumulate(tmp_path, s3, storage):
+    spool = UploadSpool(storage, str(tmp_path / "spool"), workers=4)
+    path = write(tmp_path, "tile.webp", b"tile")
+    for i in range(50):
+        spool.upload_file(path, f"id/tiles/{i}.webp")
+    assert spool.flush(timeout=10)
+    spool.queue.join()
+
+    assert len([key for key in s3.buckets["test"] if key.startswith("id/tiles/")]) == 50
+    assert_forgotten(spool)
+
+
+def test_failed_uploads_are_retried_with_backoff(tmp_path, s3, storage, monkeypatch):
+    delays = []
+    timer = threading.Timer
+    monkeypatch.setattr("upload_spool.threading.Timer", lambda delay, *args, **kwargs: delays.append(delay) or timer(0.01, *args, **kwargs))
+    s3.fail("fput_object")
+    s3.fail("fput_object")
+    s3.fail("fput_object")
+
+    spool = UploadSpool(storage, str(tmp_path / "spool"), workers=1, base_delay=1, max_delay=3)
+    spool.upload_file(write(tmp_path, "depth.webp", b"depth"), "id/depth.webp")
+    assert spool.flush(timeout=5)
+    spool.queue.join()
+
+    assert stored(s3, "id/depth.webp") == b"depth"
+    assert delays == [1, 2, 3]
+    stats = spool.get_stats()
+    assert stats["retries"] == 3 and stats["uploaded"] == 1
+    assert_forgotten(spool)
+
+
+def test_gives_up_into_failed_directory(tmp_path, s3, storage):
+    for _ in range(3):
+        s3.fail("fput_object")
+    spool = UploadSpool(storage, str(tmp_path / "spool"), workers=1, base_delay=0.01, max_attempts=3)
+    spool.upload_file(write(tmp_path, "image.webp", b"panorama"), "id/image.webp")
+    assert spool.flush(timeout=5)
+    spool.queue.join()
+
+    assert "id/image.webp" not in s3.buckets["test"]
+    assert spool.get_stats()["failed"] == 1
+    failed = sorted(os.listdir(spool.failed_directory))
+    assert len(failed) == 2 and failed[1] == failed[0] + ".json"
+    with open(os.path.join(spool.failed_directory, failed[0]), "rb") as file:
+        assert file.read() == b"panorama"
+    assert_forgotten(spool)
+
+
+def test_replay_uploads_what_a_crash_left(tmp_path, s3, storage):
+    crashed = UploadSpool(storage, str(tmp_path / "spool"), workers=0)
+    crashed.upload_file(write(tmp_path, "image.webp", b"panorama"), "id/image.webp")
+    crashed.upload_file(write(tmp_path, "metadata.json", b"{}"), "id/metadata.json")
+    # an entry torn while being written is skipped
+    with open(os.path.join(crashed.journal_directory, "torn.json"), "w") as file:
+        file.write('{"id": ')
+    assert crashed.pending() == 3
+
+    spool = UploadSpool(storage, str(tmp_path / "spool"), workers=1)
+    assert spool.replay() == 2
+    spool.queue.join()
+    assert stored(s3, "id/image.webp") == b"panorama"
+    assert stored(s3, "id/metadata.json") == b"{}"
+    assert spool.pending() == 1
+
+
+def test_newest_content_supersedes_pending_upload(tmp_path, s3, storage):
+    spool = UploadSpool(storage, str(tmp_path / "spool"), workers=0)
+    spool.upload_file(write(tmp_path, "old.json", b"old"), "id/metadata.json")
+    spool.upload_file(write(tmp_path, "new.json", b"new"), "id/metadata.json")
+    threading.Thread(target=spool.worker, daemon=True).start()
+    assert spool.flush(timeout=5)
+    spool.queue.join()
+
+    assert stored(s3, "id/metadata.json") == b"new"
+    assert s3.calls["fput_object"] == 1
+    stats = spool.get_stats()
+    assert stats["superseded"] == 1 and stats["uploaded"] == 1
+    assert_forgotten(spool)
+
+
+def test_stored_content_supersedes_pending_upload(tmp_path, s3, storage):
+    spool = UploadSpool(storage, str(tmp_path / "spool"), workers=0)
+    spool.upload_file(write(tmp_path, "old.json", b"old"), "id/metadata.json")
+    s3.buckets["test"]["id/metadata.json"] = (b"new", None)
+    # already stored, so nothing is spooled and the older entry is skipped
+    spool.upload_files({"id/metadata.json": (write(tmp_path, "new.json", b"new"), "application/json")})
+    threading.Thread(target=spool.worker, daemon=True).start()
+    assert spool.flush(timeout=5)
+    spool.queue.join()
+
+    assert stored(s3, "id/metadata.json") == b"new"
+    stats = spool.get_stats()
+    assert stats["deduplicated"] == 1 and stats["superseded"] == 1
+    assert_forgotten(spool)
@@ -0,0 +1,85 @@
+import os
+from pathlib import Path
+from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+
+class ThumbnailEngine:
+    """
+    Renders a set of thumbnail sizes from one decode of an image.
+
+    Sizes are produced largest first and each one is derived from the
+    previous thumbnail rather than the full image: an integer Image.reduce
+    does the bulk of the shrinking cheaply and a resample finishes it off.
+    JPEG sources are decoded at reduced scale via draft mode. The images stay
+    in PIL throughout and are encoded in parallel (PIL releases the GIL while
+    encoding).
+
+    Each width is the width of a box twice as wide as it is high (the shape
+    of an equirectangular panorama); thumbnails keep the source aspect ratio
+    and are never larger than the source.
+    """
+
+    def __init__(
+        self,
+        widths: List[int] = (256, 512, 1024),
+        box_ratio: float = 2.0,
+        resample=Image.BILINEAR,
+        quality: int = 90,
+        workers: int = 4
+    ):
+        self.widths = sorted(set(widths), reverse=True)
+        self.box_ratio = box_ratio
+        self.resample = resample
+        self.quality = quality
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def target_size(self, size, width: int):
+        w, h = size
+        scale = min(width / w, width / self.box_ratio / h, 1.0)
+        return max(1, int(w * scale)), max(1, int(h * scale))
+
+    def render(self, image_path) -> Dict[int, Image.Image]:
+        """Thumbnails by box width, from a single decode of the image"""
+        with Image.open(str(image_path)) as image:
+            size = image.size
+            largest = self.target_size(size, self.widths[0])
+            # only JPEG supports decoding at a reduced scale
+            image.draft(image.mode, largest)
+            current = image.convert("RGB") if image.mode not in ("RGB", "L") else image.copy()
+
+        thumbnails = {}
+        for width in self.widths:
+            target = self.target_size(size, width)
+            # shrink by whole factors first, leaving at least 2x for the resample
+            factor = min(current.width // target[0], current.height // target[1]) // 2
+            if factor >= 2:
+                current = current.reduce(factor)
+            if current.size != target:
+                current = current.resize(target, self.resample)
+            thumbnails[width] = current
+        return thumbnails
+
+    def generate(self, image_path, output_directory, name: str) -> Dict[int, Dict]:
+        """
+        Write {name}_thumbnail_{width}.webp for every width, returning the path
+        and pixel size of each by box width.
+        """
+        thumbnails = self.render(image_path)
+        paths = {
+            width: Path(os.path.join(output_directory, f"{name}_thumbnail_{width}.webp"))
+            for width in thumbnails
+        }
+        futures = [
+            self.executor.submit(thumbnail.save, paths[width], format="WEBP", quality=self.quality)
+            for width, thumbnail in thumbnails.items()
+        ]
+        for future in futures:
+            future.result()
+
+        return {
+            width: {"path": paths[width], "width": thumbnail.width, "height": thumbnail.height}
+            for width, thumbnail in thumbnails.items()
+        }
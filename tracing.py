@@ -0,0 +1,243 @@
+import os
+import time
+import inspect
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# upper bounds of the duration histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, float("inf"))
+METRIC = "panorama_stage_duration_seconds"
+
+_current = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "trace", "parent", "labels", "thread", "start", "end")
+
+    def __init__(self, name, trace, parent, labels):
+        self.name = name
+        self.trace = trace
+        self.parent = parent
+        self.labels = labels
+        self.thread = threading.get_ident()
+        self.start = time.perf_counter()
+        self.end = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+
+class Trace:
+    """The spans of one request, including those of its background tasks"""
+
+    def __init__(self, name):
+        self.name = name
+        self.spans = []
+        self.lock = threading.Lock()
+        self.root = None
+
+    def add(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def summary(self) -> dict:
+        """Seconds per stage of the spans finished so far, repeated stages summed"""
+        timings = {}
+        with self.lock:
+            spans = [span for span in self.spans if span.end is not None and span is not self.root]
+        for span in spans:
+            timings[span.name] = round(timings.get(span.name, 0.0) + span.end - span.start, 4)
+        if self.root is not None:
+            timings["total"] = round(self.root.duration, 4)
+        return timings
+
+    def incomplete(self) -> list:
+        """Spans opened by the request's own thread that were never closed"""
+        with self.lock:
+            return [
+                span.name for span in self.spans
+                if span.end is None and span is not self.root and span.thread == self.root.thread
+            ]
+
+
+class Tracer:
+    """
+    Stage timings for the predict pipeline. span() times a block, nested
+    under the block that encloses it. Spans opened outside of a request
+    only feed the histograms. Background work submitted through submit()
+    keeps the span it was submitted from as its parent.
+
+    Every finished span is observed in a histogram of its name (and labels).
+    render() returns the histograms in the Prometheus text format. serve()
+    exposes them on /metrics, and write() saves them to a file.
+    """
+
+    def __init__(self, buckets=BUCKETS, metrics_file: str = None):
+        self.buckets = buckets
+        self.metrics_file = metrics_file
+        self.lock = threading.Lock()
+        self.histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+
+    @contextmanager
+    def trace(self, name: str, **labels):
+        """Open a request's root span and yield its Trace"""
+        trace = Trace(name)
+        try:
+            with self.span(name, _trace=trace, **labels) as root:
+                trace.root = root
+                try:
+                    yield trace
+                finally:
+                    incomplete = trace.incomplete()
+                    if incomplete:
+                        print(f"Trace {name} finished with open spans: {incomplete}")
+        finally:
+            if self.metrics_file:
+                self.write(self.metrics_file)
+
+    @contextmanager
+    def span(self, name: str, _trace=None, **labels):
+        span = self.start(name, _trace, **labels)
+        token = _current.set(span)
+        try:
+            yield span
+        finally:
+            self.finish(span)
+            try:
+                _current.reset(token)
+            except ValueError:
+                # a generator resumed from another context
+                _current.set(span.parent)
+
+    def traced(self, name: str, root: bool = False):
+        """
+        Decorator timing every call of a function (or every run of a
+        generator) as a span, or as a request's trace with root=True
+        """
+        def decorator(function):
+            scope = self.trace if root else self.span
+            if inspect.isgeneratorfunction(function):
+                def run(*args, **kwargs):
+                    with scope(name):
+                        yield from function(*args, **kwargs)
+
+                @functools.wraps(function)
+                def wrapper(*args, **kwargs):
+                    # every step runs in the generator's own context, so the
+                    # spans it opened are current again wherever it resumes
+                    context = contextvars.copy_context()
+                    generator = run(*args, **kwargs)
+                    try:
+                        while True:
+                            try:
+                                item = context.run(next, generator)
+                            except StopIteration as stop:
+                                return stop.value
+                            yield item
+                    finally:
+                        context.run(generator.close)
+            else:
+                @functools.wraps(function)
+                def wrapper(*args, **kwargs):
+                    with scope(name):
+                        return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def label(self, **labels):
+        """Add labels to the metrics of the current request's root span"""
+        trace = self.current_trace()
+        if trace is not None and trace.root is not None:
+            trace.root.labels = tuple(sorted({**dict(trace.root.labels), **labels}.items()))
+
+    def start(self, name: str, _trace=None, **labels) -> Span:
+        """Start a span without entering it, for stages that don't fit a block"""
+        parent = _current.get()
+        trace = _trace or (parent.trace if parent else None)
+        span = Span(name, trace, parent, tuple(sorted(labels.items())))
+        if trace is not None:
+            trace.add(span)
+        return span
+
+    def finish(self, span: Span):
+        if span.end is None:
+            span.end = time.perf_counter()
+            self.observe(span.name, span.end - span.start, span.labels)
+
+    def current_trace(self) -> Trace:
+        span = _current.get()
+        return span.trace if span else None
+
+    def submit(self, executor, function, *args, **kwargs):
+        """executor.submit that runs the function under the current span"""
+        return executor.submit(contextvars.copy_context().run, function, *args, **kwargs)
+
+    def observe(self, name: str, seconds: float, labels: tuple = ()):
+        key = (name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {METRIC} Time spent in each stage of a prediction",
+            f"# TYPE {METRIC} histogram",
+        ]
+        with self.lock:
+            histograms = sorted((key, [list(h[0]), h[1], h[2]]) for key, h in self.histograms.items())
+        for (name, labels), (counts, total, count) in histograms:
+            label_text = "".join(f',{key}="{value}"' for key, value in labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{METRIC}_bucket{{stage="{name}"{label_text},le="{le}"}} {cumulative}')
+            lines.append(f'{METRIC}_sum{{stage="{name}"{label_text}}} {total:.6f}')
+            lines.append(f'{METRIC}_count{{stage="{name}"{label_text}}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """Atomically write the metrics, e.g. for node_exporter's textfile collector"""
+        with open(f"{path}.tmp", "w") as file:
+            file.write(self.render())
+        os.replace(f"{path}.tmp", path)
+
+    def serve(self, port: int, host: str = "0.0.0.0"):
+        """Serve the metrics on http://host:port/metrics from a daemon thread"""
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = tracer.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving stage metrics on {host}:{port}/metrics")
+        return server
+
+
+tracer = Tracer()
@@ -0,0 +1,264 @@
+import os
+import json
+import time
+import uuid
+import queue
+import shutil
+import threading
+import contextvars
+from collections import Counter
+from pathlib import Path
+
+from tracing import tracer
+
+
+class UploadSpool:
+    """
+    Durable write-behind queue for uploads.
+
+    upload_file copies (hard-links when possible) the artifact into the spool
+    directory, journals the target bucket and key, and returns the object's
+    deterministic URL right away. Worker threads drain the journal, retrying
+    failed uploads with exponential backoff; an entry is only removed once its
+    upload succeeded. Entries left behind by a crash are replayed by replay().
+
+    Uploads are idempotent (same key, same bytes), and when a key is spooled
+    again before an older entry went up, the older one is skipped so the
+    newest content always wins.
+    """
+
+    def __init__(
+        self,
+        cloud,
+        spool_directory: str,
+        workers: int = 4,
+        base_delay: float = 1.0,
+        max_delay: float = 300.0,
+        max_attempts: int = 20
+    ):
+        self.cloud = cloud
+        self.journal_directory = os.path.join(spool_directory, "journal")
+        self.data_directory = os.path.join(spool_directory, "data")
+        self.failed_directory = os.path.join(spool_directory, "failed")
+        for directory in [self.journal_directory, self.data_directory, self.failed_directory]:
+            os.makedirs(directory, exist_ok=True)
+
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.latest = {}  # (bucket, key) -> newest entry id
+        self.key_locks = {}  # (bucket, key) -> lock held while uploading
+        self.outstanding = Counter()  # (bucket, key) -> entries queued or waiting to retry
+        self.contexts = {}  # entry id -> context it was spooled from, for tracing
+        self.stats = Counter()
+
+        for _ in range(workers):
+            threading.Thread(target=self.worker, daemon=True).start()
+
+    def upload_file(
+        self,
+        filepath: Path,
+        path_on_storage: str,
+        content_type: str = None,
+        bucket: str = None,
+        make_public: bool = True
+    ) -> str:
+        """Spool a file for upload and return the URL it will be served from"""
+        bucket = bucket or self.cloud.bucket
+        entry_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        data_path = os.path.join(self.data_directory, entry_id)
+
+        try:
+            os.link(filepath, data_path)
+        except OSError:
+            shutil.copyfile(filepath, data_path)
+
+        entry = {
+            "id": entry_id,
+            "file": data_path,
+            "bucket": bucket,
+            "key": path_on_storage,
+            "content_type": content_type,
+            "make_public": make_public,
+            "attempts": 0
+        }
+        self.write_entry(entry)
+        self.submit(entry)
+        return self.file_url(path_on_storage, bucket, make_public)
+
+    def upload_files(self, files: dict, bucket: str = None, make_public: bool = True) -> dict:
+        """
+        Spool several files (key -> (path, content_type)) and return their URLs
+        by key. Files whose content is already stored under their key, as
+        found by one batched ETag check, are not uploaded again.
+        """
+        bucket = bucket or self.cloud.bucket
+        try:
+            unchanged = self.cloud.unchanged_files({key: path for key, (path, _) in files.items()}, bucket)
+        except Exception as e:
+            print(f"Skipping dedup check: {e}")
+            unchanged = set()
+
+        with self.lock:
+            self.stats["deduplicated"] += len(unchanged)
+            # a pending upload of older content must not overwrite the match
+            for key in unchanged:
+                self.latest.pop((bucket, key), None)
+
+        urls = {}
+        for key, (path, content_type) in files.items():
+            if key in unchanged:
+                urls[key] = self.file_url(key, bucket, make_public)
+            else:
+                urls[key] = self.upload_file(path, key, content_type, bucket, make_public)
+        return urls
+
+    def file_url(self, path_on_storage: str, bucket: str, make_public: bool = True) -> str:
+        if make_public:
+            return self.cloud.get_file_url(path_on_storage, bucket)
+        return self.cloud.get_file_url(path_on_storage, bucket, expires=7*24*60*60)
+
+    def write_entry(self, entry):
+        """Atomically write a journal entry"""
+        path = os.path.join(self.journal_directory, f"{entry['id']}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(json.dumps(entry))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+
+    def remove_entry(self, entry, destination=None):
+        journal_path = os.path.join(self.journal_directory, f"{entry['id']}.json")
+        if destination:
+            shutil.move(journal_path, os.path.join(destination, f"{entry['id']}.json"))
+            shutil.move(entry["file"], os.path.join(destination, entry["id"]))
+        else:
+            os.remove(journal_path)
+            if os.path.exists(entry["file"]):
+                os.remove(entry["file"])
+
+    def submit(self, entry):
+        target = (entry["bucket"], entry["key"])
+        with self.lock:
+            if self.latest.get(target, "") < entry["id"]:
+                self.latest[target] = entry["id"]
+            self.key_locks.setdefault(target, threading.Lock())
+            self.outstanding[target] += 1
+            self.contexts[entry["id"]] = contextvars.copy_context()
+            self.stats["spooled"] += 1
+        self.queue.put(entry)
+
+    def replay(self) -> int:
+        """Queue every journaled entry that was not acknowledged, oldest first"""
+        entries = []
+        for name in sorted(os.listdir(self.journal_directory)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.journal_directory, name), "r") as file:
+                    entries.append(json.loads(file.read()))
+            except (OSError, ValueError) as e:
+                print(f"Skipping unreadable spool entry {name}: {e}")
+
+        for entry in entries:
+            self.submit(entry)
+        if entries:
+            print(f"Replaying {len(entries)} spooled uploads")
+        return len(entries)
+
+    def worker(self):
+        while True:
+            entry = self.queue.get()
+            with self.lock:
+                context = self.contexts.pop(entry["id"], None)
+            try:
+                # uploads are timed under the request that spooled them
+                if context is not None:
+                    context.run(self.process, entry)
+                else:
+                    self.process(entry)
+            except Exception as e:
+                # the journal entry, if any is left, is replayed on restart
+                print(f"Upload spool error for {entry['key']}: {e}")
+                self.done(entry)
+            finally:
+                self.queue.task_done()
+
+    def done(self, entry):
+        """
+        Forget an entry that went up, was superseded or given up on, and the
+        key's lock once no other entry is waiting on it
+        """
+        target = (entry["bucket"], entry["key"])
+        with self.lock:
+            self.contexts.pop(entry["id"], None)
+            if self.latest.get(target) == entry["id"]:
+                del self.latest[target]
+            self.outstanding[target] -= 1
+            if self.outstanding[target] <= 0:
+                del self.outstanding[target]
+                self.key_locks.pop(target, None)
+
+    def process(self, entry):
+        target = (entry["bucket"], entry["key"])
+        with self.lock:
+            key_lock = self.key_locks[target]
+        with key_lock:
+            with self.lock:
+                superseded = self.latest.get(target) != entry["id"]
+            if superseded:
+                self.stats["superseded"] += 1
+                self.remove_entry(entry)
+                self.done(entry)
+                return
+
+            try:
+                with tracer.span("upload"):
+                    url = self.cloud.upload_file(
+                        entry["file"], entry["key"], entry["content_type"], entry["bucket"], entry["make_public"]
+                    )
+            except Exception as e:
+                print(f"Failed to upload {entry['key']}: {e}")
+                url = None
+
+            if url is not None:
+                self.stats["uploaded"] += 1
+                self.remove_entry(entry)
+                self.done(entry)
+                return
+
+        entry["attempts"] += 1
+        self.stats["retries"] += 1
+        if entry["attempts"] >= self.max_attempts:
+            print(f"Giving up on {entry['key']} after {entry['attempts']} attempts, moved to {self.failed_directory}")
+            self.stats["failed"] += 1
+            self.remove_entry(entry, self.failed_directory)
+            self.done(entry)
+            return
+
+        self.write_entry(entry)
+        delay = min(self.base_delay * 2 ** (entry["attempts"] - 1), self.max_delay)
+        print(f"Retrying upload of {entry['key']} in {delay:.0f}s (attempt {entry['attempts']})")
+        timer = threading.Timer(delay, self.queue.put, args=(entry,))
+        timer.daemon = True
+        timer.start()
+
+    def pending(self) -> int:
+        return len([name for name in os.listdir(self.journal_directory) if name.endswith(".json")])
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {**self.stats, "pending": self.pending()}
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until the journal is empty, returning False on timeout"""
+        start_time = time.time()
+        while self.pending():
+            if timeout is not None and time.time() - start_time > timeout:
+                return False
+            time.sleep(0.1)
+        return True